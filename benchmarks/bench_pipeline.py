@@ -0,0 +1,181 @@
+# benchmarks/bench_pipeline.py
+"""
+Times each stage of prompt generation on a synthetic repository.
+
+Builds a repo with many small files, a few huge files, deep nesting and
+cp1252-encoded files (or uses --root), then measures scan, read, tokenize,
+truncate and assemble separately, plus end-to-end generate_prompt_data calls
+with exact counting and in estimate mode. Runs headless: no Tk, and the prompt
+goes to an in-memory stream instead of the clipboard.
+
+    python benchmarks/bench_pipeline.py --profile large --json after.json
+    python benchmarks/bench_pipeline.py --json after.json --compare before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from promptgen_gui import core, utils  # noqa: E402
+from synthetic import PROFILES, build_repo  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+EXCLUDES = utils.parse_csv_setting(utils.DEFAULT_EXCLUDE_PATHS)
+INCLUDES = utils.parse_csv_setting(utils.DEFAULT_INCLUDE_EXTS, strip_dots=True)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def run_stages(root, repeat, workers, max_tokens, truncation):
+    """Runs every stage and returns {stage: metrics}."""
+    results = {}
+
+    def record(stage, elapsed, files=0, size_bytes=0, tokens=0):
+        results[stage] = {
+            "seconds": round(elapsed, 6),
+            "files_per_s": round(files / elapsed, 1) if elapsed and files else None,
+            "mb_per_s": round(size_bytes / elapsed / 1e6, 2) if elapsed and size_bytes else None,
+            "tokens_per_s": round(tokens / elapsed) if elapsed and tokens else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+    elapsed, items = best_of(repeat, lambda: utils.scan_directory(root, EXCLUDES, INCLUDES, workers=workers))
+    files = [rel for rel, item_type in items if item_type == 'file']
+    abs_paths = [os.path.join(root, rel) for rel in files]
+    record("scan", elapsed, files=len(items))
+
+    def read_all():
+        return [core.read_file_content(path) for path in abs_paths]
+    elapsed, contents = best_of(repeat, read_all)
+    size_bytes = sum(os.path.getsize(path) for path in abs_paths)
+    record("read", elapsed, files=len(files), size_bytes=size_bytes)
+
+    def encode_all():
+        return [core.encode_tokens(content) for content in contents if content is not None]
+    elapsed, arrays = best_of(repeat, encode_all)
+    total_tokens = sum(len(a) for a in arrays)
+    record("tokenize", elapsed, files=len(arrays), size_bytes=size_bytes, tokens=total_tokens)
+    del contents
+
+    plan, keep = core.TRUNCATION_POLICIES[truncation]
+    tokenizer = core.resolve_tokenizer(None)
+
+    def truncate_all():
+        counts = [len(a) for a in arrays]
+        new_counts = plan(counts, max(sum(counts) - max_tokens, 0))
+        return [keep(a, n, tokenizer) for a, n in zip(arrays, new_counts) if n < len(a)]
+    elapsed, truncated = best_of(repeat, truncate_all)
+    record("truncate", elapsed, files=len(truncated), tokens=total_tokens)
+    del arrays, truncated
+
+    def assemble():
+        sink = io.StringIO()
+        core.generate_prompt_data(root, files, max_tokens=max_tokens, workers=workers, truncation=truncation, write_to=sink)
+        return len(sink.getvalue())
+    elapsed, _ = best_of(repeat, assemble)
+    record("end_to_end", elapsed, files=len(files), size_bytes=size_bytes, tokens=total_tokens)
+
+    def assemble_estimated():
+        sink = io.StringIO()
+        core.generate_prompt_data(root, files, max_tokens=max_tokens, workers=workers, truncation=truncation, write_to=sink, estimate=True)
+        return len(sink.getvalue())
+    elapsed, _ = best_of(repeat, assemble_estimated)
+    record("estimated", elapsed, files=len(files), size_bytes=size_bytes, tokens=total_tokens)
+
+    return results, {"items": len(items), "files": len(files), "bytes": size_bytes, "tokens": total_tokens}
+
+
+def print_table(results, baseline=None):
+    print(f"{'stage':<12} {'time ms':>10} {'files/s':>11} {'MB/s':>8} {'tokens/s':>12} {'peak MB':>9}  {'vs base':>8}")
+    for stage, m in results.items():
+        change = ""
+        if baseline and stage in baseline and baseline[stage]["seconds"]:
+            change = f"{baseline[stage]['seconds'] / m['seconds']:.2f}x" if m["seconds"] else "-"
+        fmt = lambda v, spec: format(v, spec) if v is not None else "-"  # noqa: E731
+        print(f"{stage:<12} {m['seconds'] * 1000:10.1f} {fmt(m['files_per_s'], ',.0f'):>11} "
+              f"{fmt(m['mb_per_s'], '.1f'):>8} {fmt(m['tokens_per_s'], ',.0f'):>12} "
+              f"{fmt(m['peak_rss_mb'], '.1f'):>9}  {change:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", help="Benchmark an existing directory instead of a synthetic repo.")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=core.DEFAULT_WORKERS)
+    parser.add_argument("--max-tokens", type=int, default=core.DEFAULT_MAX_TOKENS)
+    parser.add_argument("--truncation", choices=sorted(core.TRUNCATION_POLICIES), default=core.DEFAULT_TRUNCATION)
+    parser.add_argument("--json", metavar="PATH", help="Save the results as JSON.")
+    parser.add_argument("--compare", metavar="PATH", help="JSON results of an earlier run to compare against.")
+    args = parser.parse_args(argv)
+
+    if core.get_encoder() is None:
+        print("Error: tiktoken is required for this benchmark.")
+        return 1
+
+    tmp_dir = None
+    root = args.root
+    if root is None:
+        tmp_dir = tempfile.mkdtemp(prefix="promptgen_bench_")
+        root = tmp_dir
+        files, size_bytes = build_repo(root, args.profile)
+        print(f"Built '{args.profile}' repo ({files:,} files, {size_bytes / 1e6:.1f} MB) in {root}")
+
+    try:
+        results, totals = run_stages(root, args.repeat, args.workers, args.max_tokens, args.truncation)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["stages"]
+    print(f"{totals['files']:,} files, {totals['bytes'] / 1e6:.1f} MB, {totals['tokens']:,} tokens")
+    print_table(results, baseline)
+
+    if args.json:
+        report = {
+            "profile": args.root and "custom" or args.profile,
+            "settings": {"repeat": args.repeat, "workers": args.workers, "max_tokens": args.max_tokens,
+                         "truncation": args.truncation},
+            "platform": {"python": platform.python_version(), "system": platform.platform(),
+                         "cpus": os.cpu_count()},
+            "totals": totals,
+            "stages": results,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
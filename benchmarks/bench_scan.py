@@ -0,0 +1,111 @@
+# benchmarks/bench_scan.py
+"""
+Compares utils.scan_directory against the original os.walk implementation.
+
+Builds a synthetic tree in a temporary folder (or scans --root) and reports the
+best-of-N wall time of each variant:
+
+    python benchmarks/bench_scan.py --dirs 400 --files 250
+    python benchmarks/bench_scan.py --root ~/src/big-monorepo
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from promptgen_gui import utils  # noqa: E402
+
+EXCLUDES = utils.parse_csv_setting(utils.DEFAULT_EXCLUDE_PATHS)
+INCLUDES = utils.parse_csv_setting(utils.DEFAULT_INCLUDE_EXTS, strip_dots=True)
+
+
+def legacy_scan_directory(startpath='.', exclude_paths=None, include_exts=None, sort_items=True):
+    """The os.walk + substring-matching scanner this benchmark is measured against."""
+    items = []
+    exclude_substrings = exclude_paths or []
+    abs_startpath = os.path.abspath(startpath)
+    for root, dirs, files in os.walk(startpath, topdown=True):
+        rel_root = os.path.relpath(root, abs_startpath)
+        if rel_root == '.':
+            rel_root = ''
+        dirs[:] = [d for d in dirs if not any(ex in os.path.join(rel_root, d).replace('\\', '/') for ex in exclude_substrings)]
+        for d in sorted(dirs):
+            items.append((os.path.join(rel_root, d).replace('\\', '/'), 'dir'))
+        for f in sorted(files):
+            rel_f_path = os.path.join(rel_root, f).replace('\\', '/')
+            if any(ex in rel_f_path for ex in exclude_substrings):
+                continue
+            if include_exts and not any(f.lower().endswith(f".{ext.lower()}") for ext in include_exts):
+                continue
+            items.append((rel_f_path, 'file'))
+    if sort_items:
+        items.sort(key=lambda x: (x[0].count(os.sep), x[1] == 'file', x[0].lower()))
+    return items
+
+
+def build_tree(root, n_dirs, files_per_dir, depth):
+    """Creates n_dirs folders (nested `depth` levels) with empty files of mixed types."""
+    exts = ["py", "js", "md", "txt", "log", "bin", "json"]
+    for d in range(n_dirs):
+        parts = [f"pkg{d % 7}"] + [f"mod{(d // 7 + level) % 11}_{level}" for level in range(depth - 1)] + [f"d{d}"]
+        path = os.path.join(root, *parts)
+        os.makedirs(path, exist_ok=True)
+        for f in range(files_per_dir):
+            open(os.path.join(path, f"file{f}.{exts[f % len(exts)]}"), "w").close()
+    # Excluded folders, which both scanners must prune.
+    for name in ("node_modules", "build", ".git"):
+        path = os.path.join(root, name, "deep")
+        os.makedirs(path, exist_ok=True)
+        for f in range(files_per_dir):
+            open(os.path.join(path, f"junk{f}.js"), "w").close()
+
+
+def best_of(repeat, fn):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--root", help="Scan an existing directory instead of a synthetic tree.")
+    parser.add_argument("--dirs", type=int, default=300)
+    parser.add_argument("--files", type=int, default=100, help="Files per directory.")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    tmp_dir = None
+    root = args.root
+    if root is None:
+        tmp_dir = tempfile.mkdtemp(prefix="promptgen_bench_")
+        root = tmp_dir
+        print(f"Building synthetic tree ({args.dirs} dirs x {args.files} files) in {root} ...")
+        build_tree(root, args.dirs, args.files, args.depth)
+
+    try:
+        variants = [
+            ("legacy os.walk", lambda: legacy_scan_directory(root, EXCLUDES, INCLUDES)),
+            ("scandir", lambda: utils.scan_directory(root, EXCLUDES, INCLUDES)),
+            (f"scandir, {args.workers} threads", lambda: utils.scan_directory(root, EXCLUDES, INCLUDES, workers=args.workers)),
+            ("scandir + .gitignore", lambda: utils.scan_directory(root, EXCLUDES, INCLUDES, use_gitignore=True)),
+        ]
+        baseline = None
+        for name, fn in variants:
+            elapsed, items = best_of(args.repeat, fn)
+            baseline = baseline or elapsed
+            print(f"{name:<28} {elapsed * 1000:9.1f} ms  {len(items):>8,} items  {baseline / elapsed:5.2f}x")
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+# benchmarks/synthetic.py
+"""Builds reproducible synthetic repositories for the benchmarks."""
+import os
+import random
+
+PROFILES = {
+    # name: (small files, small file lines, huge files, huge file lines, nesting depth, cp1252 files)
+    "tiny": (200, 40, 2, 5000, 4, 10),
+    "default": (2000, 60, 5, 40000, 8, 50),
+    "large": (20000, 60, 10, 100000, 12, 200),
+}
+
+_WORDS = ("data", "value", "result", "config", "handler", "index", "buffer", "token", "node", "path",
+          "request", "response", "cache", "item", "count", "limit", "stream", "parser", "error", "state")
+
+
+def _python_source(rng, lines):
+    out = []
+    for n in range(lines):
+        if n % 12 == 0:
+            out.append(f"def {rng.choice(_WORDS)}_{n}({rng.choice(_WORDS)}, {rng.choice(_WORDS)}=None):")
+            out.append(f'    """Returns the {rng.choice(_WORDS)} for a {rng.choice(_WORDS)}."""')
+        else:
+            a, b, c = rng.choice(_WORDS), rng.choice(_WORDS), rng.choice(_WORDS)
+            out.append(f"    {a} = {b}.get('{c}', {rng.randint(0, 9999)})  # {c} {a}")
+    return "\n".join(out) + "\n"
+
+
+def build_repo(root, profile="default", seed=1234):
+    """Creates the files of a profile below root. Returns (file count, total bytes)."""
+    small, small_lines, huge, huge_lines, depth, legacy = PROFILES[profile]
+    rng = random.Random(seed)
+    files = total_bytes = 0
+
+    def write(rel_path, data):
+        nonlocal files, total_bytes
+        abs_path = os.path.join(root, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        with open(abs_path, "wb") as f:
+            f.write(data)
+        files += 1
+        total_bytes += len(data)
+
+    # Many small files spread over a moderately deep package tree.
+    for i in range(small):
+        parts = [f"pkg{i % 10}"] + [f"sub{(i // 10 + level) % 6}" for level in range(i % depth)]
+        ext = ("py", "js", "md", "txt")[i % 4]
+        write("/".join(parts + [f"module_{i}.{ext}"]), _python_source(rng, small_lines).encode("utf-8"))
+
+    # A few huge generated files.
+    for i in range(huge):
+        write(f"generated/big_{i}.py", _python_source(rng, huge_lines).encode("utf-8"))
+
+    # One very deep chain of folders.
+    deep = "/".join(f"level{n}" for n in range(depth * 4))
+    write(f"deep/{deep}/leaf.py", _python_source(rng, small_lines).encode("utf-8"))
+
+    # Files that are not valid UTF-8 and go through the cp1252 fallback.
+    for i in range(legacy):
+        text = _python_source(rng, small_lines).replace("value", "valué").replace("state", "stäte")
+        write(f"legacy/latin_{i}.txt", text.encode("cp1252"))
+
+    return files, total_bytes
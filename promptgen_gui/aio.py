@@ -0,0 +1,230 @@
+# promptgen_gui/aio.py
+"""
+asyncio API for building prompts inside a service.
+
+Unlike core.generate_prompt_data, nothing here touches the clipboard or prints:
+everything the GUI would show is returned in a PromptResult. File I/O runs on
+the event loop's default executor, at most max_concurrent_reads files at a
+time, and tokenizing runs on the PromptService's own thread pool (tiktoken
+releases the GIL), so many requests can share one process and the encoder
+that core loads once.
+
+    async with aio.PromptService(cache=cache.TokenCache()) as service:
+        result = await service.generate(root, ["src/app.py", "README.md"], max_tokens=50000)
+        send(result.text, result.total_tokens)
+
+Cancelling the awaiting task stops the work between files.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import AsyncIterator, List, Optional, Tuple
+
+from . import core
+
+DEFAULT_MAX_CONCURRENT_READS = 32
+
+
+@dataclass
+class FileStat:
+    """One file of a prompt. status is "", "Truncated" or a core.SKIP_REASONS key."""
+    rel_path: str
+    size_bytes: int
+    original_tokens: int
+    tokens: int
+    status: str = ""
+
+
+@dataclass
+class PromptResult:
+    """
+    What PromptService.generate produced.
+
+    files are the measured files sorted by path; actions are (reason, detail)
+    pairs for files that were truncated or left out before output, with reason
+    "Truncated" or a core.SKIP_REASONS key. With stream=True, text is None and
+    the prompt has to be read from `chunks`; a file that can no longer be read
+    while streaming gets its skip reason as status, so total_tokens and
+    summary() are final once chunks is exhausted. tokenizer names the backend
+    that counted the tokens; exact is False for the estimators.
+    """
+    selected_count: int
+    max_tokens: int
+    files: List[FileStat] = field(default_factory=list)
+    actions: List[Tuple[str, str]] = field(default_factory=list)
+    cache_hits: int = 0
+    cache_misses: int = 0
+    text: Optional[str] = None
+    chunks: Optional[AsyncIterator[str]] = None
+    tokenizer: str = core.ENCODING_NAME
+    exact: bool = True
+
+    @property
+    def total_tokens(self):
+        return sum(f.tokens for f in self.files if f.status not in core.SKIP_REASONS)
+
+    def summary(self):
+        """The same summary the GUI shows, as one string."""
+        lines, total = core.build_summary_lines(
+            self.selected_count, ((f.rel_path, f.size_bytes, f.tokens, f.status) for f in self.files),
+            self.actions, self.max_tokens, "output")
+        if self.cache_hits or self.cache_misses:
+            lines.append(f"Token cache: {self.cache_hits:,} hit(s), {self.cache_misses:,} miss(es)")
+        if not self.exact:
+            lines.append(core.ESTIMATED_COUNTS_NOTE.format(tokenizer=self.tokenizer))
+        if total > self.max_tokens:
+            lines.append(f"WARNING: Final token count ({total:,}) still exceeds limit ({self.max_tokens:,})!")
+        return "\n".join(lines)
+
+
+class PromptService:
+    """
+    Builds prompts for concurrent requests in one event loop.
+
+    workers is the size of the tokenizing pool shared by all requests. If a
+    core TokenCache is given, it is consulted and updated but never saved;
+    call its save() when it suits the service (e.g. periodically or on shutdown).
+    Use as an async context manager, or call close() when done.
+    """
+
+    def __init__(self, workers=core.DEFAULT_WORKERS, max_concurrent_reads=DEFAULT_MAX_CONCURRENT_READS, cache=None):
+        self.cache = cache
+        self.max_concurrent_reads = max_concurrent_reads
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="promptgen-encode")
+        self._read_slots = None  # created on first use, inside the running loop
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def _read(self, fn, *args):
+        """Runs blocking file I/O on the default executor, bounded by max_concurrent_reads."""
+        if self._read_slots is None:
+            self._read_slots = asyncio.Semaphore(self.max_concurrent_reads)
+        async with self._read_slots:
+            return await asyncio.get_running_loop().run_in_executor(None, partial(fn, *args))
+
+    async def _compute(self, fn, *args):
+        """Runs CPU-bound work (hashing, encoding, decoding) on the tokenizing pool."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args))
+
+    async def _measure(self, abs_path, allowed_special, max_file_bytes, tokenizer):
+        """Async core.measure_file, in its two halves; raises FileSkipped the same way."""
+        st, result = await self._read(core.measure_stat, abs_path, allowed_special, self.cache, max_file_bytes, tokenizer)
+        if result is not None:
+            return result
+        content = await self._read(core.load_text, abs_path, max_file_bytes)
+        return await self._compute(partial(core.measure_text, tokenizer=tokenizer), abs_path, st, content, allowed_special, self.cache)
+
+    async def _file_content(self, item, allowed_special, keep, max_file_bytes, tokenizer):
+        """Async core.output_content; only truncated rows need the tokenizing pool."""
+        run = self._compute if item[5] == "Truncated" else self._read
+        return await run(partial(core.output_content, tokenizer=tokenizer), item, keep, allowed_special, max_file_bytes)
+
+    async def generate(self, root_dir, selected_paths, exclude_paths=None, max_tokens=core.DEFAULT_MAX_TOKENS,
+                       allowed_special=None, truncation=core.DEFAULT_TRUNCATION,
+                       max_file_bytes=core.DEFAULT_MAX_FILE_BYTES, special_tokens="error", stream=False, tokenizer=None):
+        """
+        Builds the prompt for selected_paths (relative to root_dir) and returns a
+        PromptResult. The arguments mean the same as for
+        core.generate_prompt_data; with special_tokens="error" a disallowed
+        special token raises tiktoken's ValueError. With stream=True the result
+        is returned as soon as the files are measured and the prompt is produced
+        by iterating result.chunks, one file in memory at a time. tokenizer is a
+        tokenizers.BACKENDS name (None for the default); its backend is shared
+        by all requests that use it.
+        """
+        # The first use of a tokenizer loads it, which must not block the event loop.
+        backend = await self._compute(core.resolve_tokenizer, tokenizer)
+        if backend is None:
+            raise RuntimeError(f"Tokenizer '{tokenizer or core.ENCODING_NAME}' is not available (is tiktoken installed?).")
+        if truncation not in core.TRUNCATION_POLICIES:
+            raise ValueError(f"Unknown truncation policy '{truncation}'.")
+        allowed_special = core.resolve_allowed_special(allowed_special, special_tokens, backend)
+        abs_root_dir = os.path.abspath(root_dir)
+        abs_paths, relevant_structure_paths = core.collect_paths(abs_root_dir, selected_paths)
+        result = PromptResult(len(selected_paths), max_tokens, tokenizer=backend.name, exact=backend.exact)
+
+        if special_tokens == "skip":
+            found = await asyncio.gather(*(self._read(core.find_special_tokens, abs_path, allowed_special, max_file_bytes, backend)
+                                           for _, abs_path in abs_paths))
+            flagged = {rel_path for (rel_path, _), tokens in zip(abs_paths, found) if tokens}
+            result.actions.extend(("Special Tokens", rel_path) for rel_path in sorted(flagged))
+            abs_paths = [item for item in abs_paths if item[0] not in flagged]
+
+        async def measure(abs_path):
+            try:
+                return await self._measure(abs_path, allowed_special, max_file_bytes, backend)
+            except core.FileSkipped as e:
+                return e.reason
+        measured = await asyncio.gather(*(measure(abs_path) for _, abs_path in abs_paths))
+
+        file_stats = []
+        for (rel_path, abs_path), measurement in zip(abs_paths, measured):
+            if isinstance(measurement, str):
+                result.actions.append((measurement, rel_path))
+                continue
+            size_bytes, tokens, token_array, cache_hit = measurement
+            if cache_hit is True:
+                result.cache_hits += 1
+            elif cache_hit is False:
+                result.cache_misses += 1
+            file_stats.append([rel_path, size_bytes, tokens, tokens, abs_path, "", token_array])
+        del measured
+
+        if not file_stats:
+            result.text = None if stream else ""
+            if stream:
+                result.chunks = _no_chunks()
+            return result
+
+        core.plan_truncation(file_stats, max_tokens, truncation, result.actions)
+        file_stats.sort(key=lambda x: x[0])
+        result.files = [FileStat(item[0], item[1], item[2], item[3], item[5]) for item in file_stats]
+
+        chunks = self._iter_chunks(root_dir, file_stats, result.files, relevant_structure_paths, exclude_paths,
+                                   allowed_special, truncation, max_file_bytes, backend)
+        if stream:
+            result.chunks = chunks
+        else:
+            result.text = "".join([chunk async for chunk in chunks])
+        return result
+
+    async def _iter_chunks(self, root_dir, file_stats, files, relevant_structure_paths, exclude_paths,
+                           allowed_special, truncation, max_file_bytes, tokenizer):
+        _, keep = core.TRUNCATION_POLICIES[truncation]
+        try:
+            yield await self._compute(core.tree_section, root_dir, relevant_structure_paths, exclude_paths)
+        except Exception:
+            yield core.TREE_ERROR_SECTION
+        for item, file_stat in zip(file_stats, files):
+            try:
+                content = await self._file_content(item, allowed_special, keep, max_file_bytes, tokenizer)
+            except core.FileSkipped as e:
+                file_stat.status = e.reason
+                continue
+            yield core.section_header(item[0])
+            yield content
+
+
+async def _no_chunks():
+    return
+    yield
+
+
+_default_service = None
+
+
+async def generate_prompt(root_dir, selected_paths, **options):
+    """PromptService.generate on a service shared by all callers in the process."""
+    global _default_service
+    if _default_service is None:
+        _default_service = PromptService()
+    return await _default_service.generate(root_dir, selected_paths, **options)
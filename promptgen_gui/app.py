@@ -3,9 +3,10 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext, font as tkFont
 import os
-import threading
 import sys
 import re # Import the regular expression module
+import threading
+import time
 
 try:
     from ttkthemes import ThemedTk
@@ -14,15 +15,22 @@ except ImportError:
     ttk_themes_available = False
 
 try:
-    from . import core, utils
-    from .core import tiktoken_available
+    from . import cache, core, jobs, profiling, reducers, selection, session, templates, token_worker, tokenizers, utils, vcs, watcher
 except ImportError as e:
     messagebox.showerror("Import Error", f"Failed to import core modules: {e}\nMake sure all project files are in place.")
     sys.exit()
 
 
+TOKEN_DRAIN_INTERVAL_MS = 200
+PART_BUTTONS_PER_ROW = 10
+CUSTOM_MODEL = "(custom)"
+NO_TEMPLATE = "(none)"
+
+
 class PromptgenGUI:
-    def __init__(self, root):
+    def __init__(self, root, started_at=None):
+        # started_at: time.perf_counter() at process start, for the startup report.
+        self.started_at = started_at if started_at is not None else time.perf_counter()
         self.root = root
         self.root.title("PromptGen GUI")
         self.root.geometry("1000x750")
@@ -31,12 +39,18 @@ class PromptgenGUI:
         self.load_checkbox_images()
 
         self.current_dir = os.getcwd()
-        self.checked_state = {}
-        self.persistent_checked_state = {}
-        self.tree_items = {}
-
-        # --- NEW: Set to store allowed special tokens for a single operation ---
-        self.allowed_special_tokens = set()
+        self.selection = selection.SelectionModel()
+        self.scan_settings = None
+        self.snapshot_items = []
+        self.populated_dirs = set()
+        self.stale_visual_dirs = set()
+        self.watcher = None
+        self.token_worker = None
+        self.last_instrumentation = None
+
+        self.copy_job = None
+        self.token_cache = cache.TokenCache()
+        self.reduction_cache = reducers.ReductionCache()
 
         self.main_frame = ttk.Frame(root, padding="10")
         self.main_frame.pack(fill=tk.BOTH, expand=True)
@@ -52,12 +66,63 @@ class PromptgenGUI:
         self.setup_left_pane()
         self.setup_right_pane()
 
-        if not tiktoken_available:
+        # The encoder loads in the background; the window and tree don't wait for it.
+        self.open_project(first=True)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(TOKEN_DRAIN_INTERVAL_MS, self._drain_token_results)
+        self.root.after_idle(self._report_startup)
+
+    def _report_startup(self):
+        elapsed = time.perf_counter() - self.started_at
+        self.log_message(f"Startup: window and file tree ready in {elapsed * 1000:,.0f} ms.")
+
+    def _on_encoder_loaded(self, encoder, seconds, name=core.ENCODING_NAME):
+        if name != self.tokenizer_var.get():
+            return  # another tokenizer was chosen meanwhile
+        if encoder is None:
+            self.encoder_status_var.set("Tokenizer: unavailable")
             self.log_message("Warning: tiktoken not found. Token counts disabled. Run 'pip install tiktoken'.", is_error=True)
+            if tokenizers.load_error(name) is not None:
+                self.log_message(f"Could not load {name}: {tokenizers.load_error(name)}", is_error=True)
             self.copy_button.configure(state=tk.DISABLED)
-
+            if self.token_worker is not None:
+                self.token_worker.stop()
+                self.token_worker = None
+                self.update_token_meter()
+            return
+        kind = "ready" if encoder.exact else "ready, counts are estimates"
+        self.encoder_status_var.set(f"Tokenizer: {encoder.name} {kind} (loaded in {seconds:.1f} s)")
+        self.log_message(f"Tokenizer {encoder.name} loaded in {seconds * 1000:,.0f} ms, "
+                         f"{(time.perf_counter() - self.started_at) * 1000:,.0f} ms after start.")
+        if self.copy_job is None or not self.copy_job.running:
+            self.copy_button.configure(state=tk.NORMAL)
+        self.update_token_meter()  # the template's tokens can be counted now
+
+    def on_model_selected(self, event=None):
+        preset = tokenizers.MODEL_PRESETS.get(self.model_var.get())
+        if preset is None:
+            return
+        name, max_tokens = preset
+        self.max_tokens_var.set(str(max_tokens))
+        if name != self.tokenizer_var.get():
+            self.tokenizer_var.set(name)
+            self.on_tokenizer_selected()
+
+    def on_tokenizer_selected(self, event=None):
+        """Loads the chosen tokenizer in the background and recounts the tree with it."""
+        name = self.tokenizer_var.get()
+        preset = tokenizers.MODEL_PRESETS.get(self.model_var.get())
+        if preset is not None and preset[0] != name:
+            self.model_var.set(CUSTOM_MODEL)
+        self.load_tokenizer()
         self.populate_treeview()
 
+    def load_tokenizer(self):
+        name = self.tokenizer_var.get()
+        if tokenizers.is_available(name):
+            self.encoder_status_var.set(f"Tokenizer: loading {name}...")
+        tokenizers.load_in_background(name, lambda encoder, seconds: self.root.after(0, self._on_encoder_loaded, encoder, seconds, name))
+
     # ... (setup_styles_and_fonts, load_checkbox_images are unchanged) ...
     def setup_styles_and_fonts(self):
         style = ttk.Style()
@@ -92,11 +157,13 @@ class PromptgenGUI:
             assets_dir = os.path.join(script_dir, 'assets')
             self.img_checked = tk.PhotoImage(file=os.path.join(assets_dir, 'checked.png'))
             self.img_unchecked = tk.PhotoImage(file=os.path.join(assets_dir, 'unchecked.png'))
+            self.img_partial = tk.PhotoImage(file=os.path.join(assets_dir, 'partial.png'))
             print("Checkbox images loaded successfully.")
         except (FileNotFoundError, tk.TclError) as e:
             self.img_checked = None
             self.img_unchecked = None
-            print(f"Warning: Could not load checkbox images: {e}. Using text fallback '[x]' / '[ ]'.")
+            self.img_partial = None
+            print(f"Warning: Could not load checkbox images: {e}. Using text fallback '[x]' / '[ ]' / '[-]'.")
 
     def setup_left_pane(self):
         self.dir_frame = ttk.LabelFrame(self.left_pane, text="Project Directory")
@@ -113,92 +180,230 @@ class PromptgenGUI:
         self.max_tokens_var = tk.StringVar(value="150000")
         self.max_tokens_entry = ttk.Entry(self.settings_frame, textvariable=self.max_tokens_var, width=15)
         self.max_tokens_entry.grid(row=0, column=1, padx=5, pady=(5,3), sticky='w')
-        ttk.Label(self.settings_frame, text="Include Exts (csv):").grid(row=1, column=0, padx=5, pady=3, sticky='w')
-        self.include_ext_var = tk.StringVar(value="py,ts,js,jsx,tsx,vue,html,css,scss,md,json,yaml,sh,rb,go,rs,java,kt,c,cpp,h,cs,txt")
+        ttk.Label(self.settings_frame, text="Model:").grid(row=1, column=0, padx=5, pady=3, sticky='w')
+        self.model_var = tk.StringVar(value=CUSTOM_MODEL)
+        self.model_combo = ttk.Combobox(self.settings_frame, textvariable=self.model_var, values=[CUSTOM_MODEL] + list(tokenizers.MODEL_PRESETS), state='readonly', width=22)
+        self.model_combo.grid(row=1, column=1, padx=5, pady=3, sticky='w')
+        self.model_combo.bind("<<ComboboxSelected>>", self.on_model_selected)
+        ttk.Label(self.settings_frame, text="Tokenizer:").grid(row=2, column=0, padx=5, pady=3, sticky='w')
+        self.tokenizer_var = tk.StringVar(value=core.ENCODING_NAME)
+        self.tokenizer_combo = ttk.Combobox(self.settings_frame, textvariable=self.tokenizer_var, values=list(tokenizers.BACKENDS), state='readonly', width=15)
+        self.tokenizer_combo.grid(row=2, column=1, padx=5, pady=3, sticky='w')
+        self.tokenizer_combo.bind("<<ComboboxSelected>>", self.on_tokenizer_selected)
+        ttk.Label(self.settings_frame, text="Workers:").grid(row=3, column=0, padx=5, pady=3, sticky='w')
+        self.workers_var = tk.StringVar(value=str(core.DEFAULT_WORKERS))
+        self.workers_entry = ttk.Entry(self.settings_frame, textvariable=self.workers_var, width=15)
+        self.workers_entry.grid(row=3, column=1, padx=5, pady=3, sticky='w')
+        ttk.Label(self.settings_frame, text="Truncation:").grid(row=4, column=0, padx=5, pady=3, sticky='w')
+        self.truncation_var = tk.StringVar(value=core.DEFAULT_TRUNCATION)
+        self.truncation_combo = ttk.Combobox(self.settings_frame, textvariable=self.truncation_var, values=list(core.TRUNCATION_POLICIES), state='readonly', width=15)
+        self.truncation_combo.grid(row=4, column=1, padx=5, pady=3, sticky='w')
+        ttk.Label(self.settings_frame, text="Include Exts (csv):").grid(row=5, column=0, padx=5, pady=3, sticky='w')
+        self.include_ext_var = tk.StringVar(value=utils.DEFAULT_INCLUDE_EXTS)
         self.include_ext_entry = ttk.Entry(self.settings_frame, textvariable=self.include_ext_var)
-        self.include_ext_entry.grid(row=1, column=1, padx=5, pady=3, sticky='ew')
-        ttk.Label(self.settings_frame, text="Exclude Paths (csv):").grid(row=2, column=0, padx=5, pady=3, sticky='w')
-        # --- MODIFIED: Added 'env' to the default exclusion list ---
-        self.exclude_paths_var = tk.StringVar(value="node_modules,.git,venv,env,dist,build,__pycache__,*.log,*.tmp,*.bak,*.swp")
+        self.include_ext_entry.grid(row=5, column=1, padx=5, pady=3, sticky='ew')
+        ttk.Label(self.settings_frame, text="Exclude Paths (csv):").grid(row=6, column=0, padx=5, pady=3, sticky='w')
+        self.exclude_paths_var = tk.StringVar(value=utils.DEFAULT_EXCLUDE_PATHS)
         self.exclude_paths_entry = ttk.Entry(self.settings_frame, textvariable=self.exclude_paths_var)
-        self.exclude_paths_entry.grid(row=2, column=1, padx=5, pady=3, sticky='ew')
+        self.exclude_paths_entry.grid(row=6, column=1, padx=5, pady=3, sticky='ew')
+        self.use_gitignore_var = tk.BooleanVar(value=True)
+        self.use_gitignore_check = ttk.Checkbutton(self.settings_frame, text="Respect .gitignore files", variable=self.use_gitignore_var)
+        self.use_gitignore_check.grid(row=7, column=1, padx=5, pady=3, sticky='w')
+        self.auto_refresh_var = tk.BooleanVar(value=True)
+        self.auto_refresh_check = ttk.Checkbutton(self.settings_frame, text="Auto-refresh on file changes", variable=self.auto_refresh_var, command=self.toggle_auto_refresh)
+        self.auto_refresh_check.grid(row=8, column=1, padx=5, pady=3, sticky='w')
+        self.show_timings_var = tk.BooleanVar(value=False)
+        self.show_timings_check = ttk.Checkbutton(self.settings_frame, text="Show timings in summary", variable=self.show_timings_var)
+        self.show_timings_check.grid(row=9, column=1, padx=5, pady=3, sticky='w')
+        self.estimate_var = tk.BooleanVar(value=False)
+        self.estimate_check = ttk.Checkbutton(self.settings_frame, text="Estimate oversized selections (faster)", variable=self.estimate_var)
+        self.estimate_check.grid(row=10, column=1, padx=5, pady=3, sticky='w')
+        self.split_var = tk.BooleanVar(value=False)
+        self.split_check = ttk.Checkbutton(self.settings_frame, text="Split oversized selections into parts", variable=self.split_var)
+        self.split_check.grid(row=11, column=1, padx=5, pady=3, sticky='w')
+        ttk.Label(self.settings_frame, text="Reduce:").grid(row=12, column=0, padx=5, pady=3, sticky='w')
+        self.reducer_frame = ttk.Frame(self.settings_frame)
+        self.reducer_frame.grid(row=12, column=1, padx=5, pady=3, sticky='w')
+        self.reducer_vars = {}
+        for mode in reducers.MODES + ("dedupe",):
+            self.reducer_vars[mode] = tk.BooleanVar(value=False)
+            ttk.Checkbutton(self.reducer_frame, text=mode, variable=self.reducer_vars[mode]).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Label(self.settings_frame, text="Git files:").grid(row=13, column=0, padx=5, pady=3, sticky='w')
+        self.git_frame = ttk.Frame(self.settings_frame)
+        self.git_frame.grid(row=13, column=1, padx=5, pady=3, sticky='w')
+        self.git_mode_var = tk.StringVar(value="off")
+        self.git_mode_combo = ttk.Combobox(self.git_frame, textvariable=self.git_mode_var, values=["off"] + list(vcs.GIT_MODES), state='readonly', width=8)
+        self.git_mode_combo.pack(side=tk.LEFT)
+        ttk.Label(self.git_frame, text="vs").pack(side=tk.LEFT, padx=(5, 2))
+        self.git_ref_var = tk.StringVar(value=vcs.DEFAULT_REF)
+        ttk.Entry(self.git_frame, textvariable=self.git_ref_var, width=10).pack(side=tk.LEFT)
+        ttk.Label(self.git_frame, text="context").pack(side=tk.LEFT, padx=(5, 2))
+        self.git_context_var = tk.StringVar(value=str(vcs.DEFAULT_CONTEXT_LINES))
+        ttk.Spinbox(self.git_frame, textvariable=self.git_context_var, from_=0, to=100, width=4).pack(side=tk.LEFT)
         self.refresh_button = ttk.Button(self.settings_frame, text="Apply Filters & Refresh Tree", command=self.populate_treeview)
-        self.refresh_button.grid(row=3, column=0, columnspan=2, pady=(8, 5))
+        self.refresh_button.grid(row=14, column=0, columnspan=2, pady=(8, 5))
         self.settings_frame.columnconfigure(1, weight=1)
         
         self.tree_frame = ttk.LabelFrame(self.left_pane, text="Select Files/Folders")
         self.tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=(10, 5))
-        self.tree = ttk.Treeview(self.tree_frame, columns=("fullpath", "type"), displaycolumns="", show='tree')
+        self.tree = ttk.Treeview(self.tree_frame, columns=("fullpath", "type", "tokens"), displaycolumns=("tokens",), show='tree')
+        self.tree.column("tokens", width=90, anchor='e', stretch=False)
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         self.tree_scroll_y = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.tree.yview)
         self.tree_scroll_y.pack(side=tk.RIGHT, fill="y")
         self.tree.configure(yscrollcommand=self.tree_scroll_y.set)
         self.tree.bind("<Button-1>", self.on_tree_click, add='+')
+        self.tree.bind("<<TreeviewOpen>>", self.on_tree_open, add='+')
 
     # --- MODIFIED: Added is_retry flag to handle state correctly ---
     def run_copy_process(self, is_retry=False):
-        if not tiktoken_available:
-            messagebox.showerror("Missing Dependency", "Cannot proceed: tiktoken is not installed.")
+        if not tokenizers.is_available(self.tokenizer_var.get()):
+            messagebox.showerror("Missing Dependency", f"Cannot proceed: tokenizer {self.tokenizer_var.get()} is not available (is tiktoken installed?).")
             return
 
-        # If this is a new job (not a retry), clear the previously allowed tokens
-        if not is_retry:
-            self.allowed_special_tokens.clear()
-
-        try:
-            max_tokens_limit = int(self.max_tokens_var.get())
-            if max_tokens_limit <= 0: raise ValueError
-        except ValueError:
-            messagebox.showerror("Invalid Input", "Max Tokens must be a positive number.")
-            return
+        # A retry resumes the interrupted job, which keeps its allowed tokens and finished files.
+        if not (is_retry and self.copy_job is not None):
+            try:
+                max_tokens_limit = int(self.max_tokens_var.get())
+                if max_tokens_limit <= 0: raise ValueError
+            except ValueError:
+                messagebox.showerror("Invalid Input", "Max Tokens must be a positive number.")
+                return
+            workers = self.get_workers()
+            if workers is None:
+                messagebox.showerror("Invalid Input", "Workers must be a positive number.")
+                return
+
+            context_lines = self.get_git_context_lines()
+            if context_lines is None:
+                messagebox.showerror("Invalid Input", "Git context must be a number of lines (0 or more).")
+                return
+            try:
+                reducer = self.get_reducer(context_lines)
+            except vcs.GitError as e:
+                messagebox.showerror("Git Error", f"Could not read the changes: {e}")
+                return
 
-        selected_files = self.get_selected_file_paths()
-        if not selected_files and not is_retry:
-            messagebox.showwarning("No Selection", "No files are currently selected.")
-            return
+            selected_files = self.get_selected_file_paths()
+            if not selected_files:
+                messagebox.showwarning("No Selection", "No files are currently selected.")
+                return
 
-        if not is_retry:
             self.clear_summary()
+            self._show_parts([])
             self.log_message("Starting file processing...")
-        
-        self._toggle_buttons(tk.DISABLED)
-
-        # Pass the current set of allowed tokens to the thread
-        thread = threading.Thread(
-            target=self._copy_thread_func,
-            args=(self.current_dir, selected_files, *self.get_filter_settings(), max_tokens_limit, self.allowed_special_tokens),
-            daemon=True
-        )
-        thread.start()
-
-    # --- MODIFIED: Thread function now catches the specific ValueError ---
-    def _copy_thread_func(self, root_dir, selected_paths, include_exts, exclude_paths, max_tokens, allowed_special):
-        try:
-            _, summary_message = core.generate_prompt_data(
-                root_dir, selected_paths, include_exts, exclude_paths, max_tokens, allowed_special
+            include_exts, exclude_paths = self.get_filter_settings()
+            # Kept on the instance so the structured timings of the last run stay inspectable.
+            self.last_instrumentation = profiling.Instrumentation() if self.show_timings_var.get() else None
+            self.copy_job = jobs.CopyJob(
+                self.current_dir, selected_files, on_progress=self._post_copy_progress,
+                include_exts=include_exts, exclude_paths=exclude_paths, max_tokens=max_tokens_limit,
+                cache=self.token_cache, workers=workers, truncation=self.truncation_var.get(),
+                instrumentation=self.last_instrumentation, estimate=self.estimate_var.get(),
+                split=self.split_var.get(), reducer=reducer, tokenizer=self.tokenizer_var.get(),
+                template=self.get_template(), template_input=self.get_task_text()
             )
-            self.root.after(0, self._update_gui_post_copy, summary_message)
-        except ValueError as e:
-            # Check if this is the special token error we're looking for
-            if "disallowed special token" in str(e):
-                # Extract the token using regex
-                match = re.search(r"'(<\|.*?\|>)'", str(e))
-                if match:
-                    token = match.group(1)
-                    # Schedule the GUI dialog from the main thread
-                    self.root.after(0, self._handle_special_token_error, token)
-                    return # Stop this thread, the GUI will handle the retry
-            # If it's a different ValueError, treat it as a generic error
-            self._handle_generic_error(e)
-        except Exception as e:
-            # Handle any other unexpected errors
-            self._handle_generic_error(e)
+
+        self._toggle_buttons(tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        if not tokenizers.is_loaded(self.copy_job.options["tokenizer"]):
+            self.copy_progress_var.set("Waiting for the tokenizer to load...")
+        self.copy_job.start(lambda result, error: self.root.after(0, self._on_copy_finished, result, error))
+
+    def cancel_copy_process(self):
+        if self.copy_job is not None and self.copy_job.running:
+            self.copy_job.cancel()
+            self.cancel_button.config(state=tk.DISABLED)
+            self.copy_progress_var.set("Cancelling...")
+
+    def _post_copy_progress(self, phase, files_done, files_total, bytes_done, tokens_done):
+        # Called from worker threads; Tk may only be touched from the main loop.
+        self.root.after(0, self._show_copy_progress, phase, files_done, files_total, bytes_done, tokens_done)
+
+    def _show_copy_progress(self, phase, files_done, files_total, bytes_done, tokens_done):
+        self.copy_progress.configure(maximum=max(files_total, 1), value=files_done)
+        self.copy_progress_var.set(f"{phase}: {files_done:,} / {files_total:,} files, "
+                                   f"{bytes_done / 1e6:,.1f} MB, {tokens_done:,} tokens")
+
+    def _on_copy_finished(self, result, error):
+        self.cancel_button.config(state=tk.DISABLED)
+        if error is None:
+            self.copy_job = None
+            self.copy_progress_var.set("Done.")
+            if isinstance(result[0], list):
+                self._show_parts(result[0])
+            self._update_gui_post_copy(result[1])
+        elif isinstance(error, core.JobCancelled):
+            self.copy_job = None
+            self.copy_progress_var.set("Cancelled.")
+            self.log_message("Operation cancelled by user.", is_error=True)
+            self._toggle_buttons(tk.NORMAL)
+        elif isinstance(error, jobs.SpecialTokensFound):
+            self._handle_special_tokens_found(error.found)
+        elif isinstance(error, ValueError) and "disallowed special token" in str(error):
+            # Extract the token using regex
+            match = re.search(r"'(<\|.*?\|>)'", str(error))
+            if match:
+                self._handle_special_token_error(match.group(1))
+            else:
+                self._handle_generic_error(error)
+        else:
+            self._handle_generic_error(error)
 
     # --- NEW: Method to handle generic errors from the thread ---
     def _handle_generic_error(self, e):
         import traceback
-        error_msg = f"An unexpected error occurred during processing: {e}\n{traceback.format_exc()}"
-        self.root.after(0, self._update_gui_post_copy, error_msg, True)
+        self.copy_job = None
+        self.copy_progress_var.set("Failed.")
+        error_msg = f"An unexpected error occurred during processing: {e}\n{''.join(traceback.format_exception(type(e), e, e.__traceback__))}"
+        self._update_gui_post_copy(error_msg, True)
+
+    def _handle_special_tokens_found(self, found):
+        choice = self._ask_special_token_handling(found)
+        if choice is None:
+            self.copy_job = None
+            self.copy_progress_var.set("Cancelled.")
+            self.log_message("Operation cancelled by user due to special tokens.", is_error=True)
+            self._toggle_buttons(tk.NORMAL)
+            return
+        labels = {"allow": "allowed as special tokens", "text": "encoded as plain text", "skip": "skipped"}
+        self.log_message(f"Special tokens found in {len({p for files in found.values() for p in files})} file(s): {labels[choice]}.")
+        self.copy_job.special_tokens = choice
+        self.run_copy_process(is_retry=True)
+
+    def _ask_special_token_handling(self, found, max_lines=200):
+        """Lists every special token found and asks once how to handle them all."""
+        lines = []
+        for token, files in sorted(found.items()):
+            lines.append(f"{token} in {len(files)} file(s):")
+            for rel_path, line_numbers in sorted(files.items()):
+                lines.append(f"    {rel_path}: line {', '.join(map(str, line_numbers))}")
+        if len(lines) > max_lines:
+            lines = lines[:max_lines] + [f"... and {len(lines) - max_lines} more line(s)"]
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Special Tokens Found")
+        dialog.transient(self.root)
+        ttk.Label(dialog, wraplength=520, text=(
+            "The selected files contain special tokens which are disallowed by default. "
+            "This can happen in files inside virtual environments or package sources. "
+            "How should they be handled?")).pack(fill=tk.X, padx=10, pady=(10, 5))
+        details = scrolledtext.ScrolledText(dialog, height=12, width=80, font=self.text_font)
+        details.insert(tk.END, "\n".join(lines))
+        details.configure(state='disabled')
+        details.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        choice = {"value": None}
+        def choose(value):
+            choice["value"] = value
+            dialog.destroy()
+        buttons = ttk.Frame(dialog)
+        buttons.pack(fill=tk.X, padx=10, pady=(5, 10))
+        for text, value in (("Allow All", "allow"), ("Encode as Plain Text", "text"), ("Skip These Files", "skip"), ("Cancel", None)):
+            ttk.Button(buttons, text=text, command=lambda v=value: choose(v)).pack(side=tk.LEFT, padx=(0, 5))
+        dialog.protocol("WM_DELETE_WINDOW", lambda: choose(None))
+        dialog.grab_set()
+        self.root.wait_window(dialog)
+        return choice["value"]
 
     # --- NEW: Method to show a dialog and handle retries for special tokens ---
     def _handle_special_token_error(self, token):
@@ -208,11 +413,13 @@ class PromptgenGUI:
             "Do you want to allow this token and retry processing?"
         )
         if messagebox.askyesno("Special Token Found", msg):
-            self.log_message(f"User allowed special token '{token}'. Retrying...", is_error=False)
-            self.allowed_special_tokens.add(token)
-            # Call run_copy_process again, marking it as a retry
+            self.log_message(f"User allowed special token '{token}'. Resuming...", is_error=False)
+            self.copy_job.allow_special_token(token)
+            # Resume the same job; files finished before the error are not encoded again.
             self.run_copy_process(is_retry=True)
         else:
+            self.copy_job = None
+            self.copy_progress_var.set("Cancelled.")
             self.log_message(f"Operation cancelled by user due to special token '{token}'.", is_error=True)
             self._toggle_buttons(tk.NORMAL)
 
@@ -225,7 +432,7 @@ class PromptgenGUI:
     def _toggle_buttons(self, state):
         # ... (unchanged) ...
         self.refresh_button.config(state=state)
-        if tiktoken_available: self.copy_button.config(state=state)
+        if tokenizers.is_available(self.tokenizer_var.get()): self.copy_button.config(state=state)
         
     # ... (all other methods are unchanged) ...
     def setup_right_pane(self):
@@ -235,13 +442,69 @@ class PromptgenGUI:
             style.configure('Accent.TButton', font=bold_font)
         except Exception: pass
         self.copy_button = ttk.Button(self.right_pane, text="Copy Selected to Clipboard", command=self.run_copy_process, style='Accent.TButton')
-        self.copy_button.pack(pady=(10, 15), padx=10, fill=tk.X)
+        self.copy_button.pack(pady=(10, 5), padx=10, fill=tk.X)
+        self.job_frame = ttk.Frame(self.right_pane)
+        self.job_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        self.copy_progress_var = tk.StringVar(value="")
+        ttk.Label(self.job_frame, textvariable=self.copy_progress_var).grid(row=0, column=0, columnspan=2, sticky='w')
+        self.copy_progress = ttk.Progressbar(self.job_frame, mode='determinate', maximum=1)
+        self.copy_progress.grid(row=1, column=0, sticky='ew', pady=(2, 0))
+        self.cancel_button = ttk.Button(self.job_frame, text="Cancel", command=self.cancel_copy_process, state=tk.DISABLED)
+        self.cancel_button.grid(row=1, column=1, padx=(5, 0), pady=(2, 0))
+        self.job_frame.columnconfigure(0, weight=1)
+        # One button per part of a split prompt; each copies its part to the clipboard.
+        self.parts_frame = ttk.Frame(self.right_pane)
+        self.parts_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        self.part_texts = []
+        self.meter_frame = ttk.Frame(self.right_pane)
+        self.meter_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        self.token_meter_var = tk.StringVar(value="Selected tokens: -")
+        ttk.Label(self.meter_frame, textvariable=self.token_meter_var).pack(anchor='w')
+        self.token_meter = ttk.Progressbar(self.meter_frame, mode='determinate', maximum=100)
+        self.token_meter.pack(fill=tk.X, pady=(2, 0))
+        self.encoder_status_var = tk.StringVar(value="")
+        ttk.Label(self.meter_frame, textvariable=self.encoder_status_var).pack(anchor='w', pady=(2, 0))
+        self.max_tokens_var.trace_add('write', lambda *_: self.update_token_meter())
+        # The templates wrap the prompt; their tokens come off the budget for the files.
+        self.template_frame = ttk.LabelFrame(self.right_pane, text="Prompt Template")
+        self.template_frame.pack(fill=tk.X, padx=5, pady=(0, 5))
+        ttk.Label(self.template_frame, text="Template:").grid(row=0, column=0, padx=5, pady=3, sticky='w')
+        self.template_var = tk.StringVar(value=NO_TEMPLATE)
+        self.template_combo = ttk.Combobox(self.template_frame, textvariable=self.template_var, values=[NO_TEMPLATE] + list(templates.get_templates()), state='readonly', width=28)
+        self.template_combo.grid(row=0, column=1, padx=5, pady=3, sticky='w')
+        self.template_combo.bind("<<ComboboxSelected>>", lambda e: self.update_token_meter())
+        self.template_cost_var = tk.StringVar(value="")
+        ttk.Label(self.template_frame, textvariable=self.template_cost_var).grid(row=0, column=2, padx=5, pady=3, sticky='w')
+        ttk.Label(self.template_frame, text="Task:").grid(row=1, column=0, padx=5, pady=3, sticky='nw')
+        self.task_text = scrolledtext.ScrolledText(self.template_frame, wrap=tk.WORD, height=4, relief=tk.SUNKEN, bd=1, font=self.text_font)
+        self.task_text.grid(row=1, column=1, columnspan=2, padx=5, pady=(3, 5), sticky='ew')
+        self.task_text.bind("<KeyRelease>", lambda e: self.update_token_meter())
+        self.template_frame.columnconfigure(2, weight=1)
         self.summary_frame = ttk.LabelFrame(self.right_pane, text="Summary & Log")
         self.summary_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         self.summary_text = scrolledtext.ScrolledText(self.summary_frame, wrap=tk.WORD, relief=tk.SUNKEN, bd=1, padx=5, pady=5, font=self.text_font)
         self.summary_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
         self.summary_text.configure(state='disabled')
 
+    def _show_parts(self, texts):
+        for child in self.parts_frame.winfo_children():
+            child.destroy()
+        self.part_texts = texts if len(texts) > 1 else []
+        if not self.part_texts:
+            return
+        ttk.Label(self.parts_frame, text="Copy part:").grid(row=0, column=0, padx=(0, 5), sticky='w')
+        for i in range(len(self.part_texts)):
+            button = ttk.Button(self.parts_frame, text=str(i + 1), width=4, command=lambda i=i: self.copy_part(i))
+            button.grid(row=i // PART_BUTTONS_PER_ROW, column=1 + i % PART_BUTTONS_PER_ROW, padx=1, pady=1)
+
+    def copy_part(self, index):
+        try:
+            core.copy_to_clipboard(self.part_texts[index])
+        except Exception as e:
+            self.log_message(f"Could not copy part {index + 1} to clipboard: {e}", is_error=True)
+            return
+        self.log_message(f"Part {index + 1} of {len(self.part_texts)} copied to clipboard.")
+
     def log_message(self, message, is_error=False):
         self.summary_text.configure(state='normal')
         tag = "error" if is_error else "info"
@@ -253,81 +516,423 @@ class PromptgenGUI:
     def select_directory(self):
         new_dir = filedialog.askdirectory(initialdir=self.current_dir, title="Select Project Directory")
         if new_dir and os.path.isdir(new_dir):
+            self.save_session()
             self.current_dir = os.path.normpath(new_dir)
             self.dir_var.set(self.current_dir)
-            self.populate_treeview()
+            self.open_project()
         elif new_dir:
             messagebox.showwarning("Invalid Selection", f"Path selected is not a valid directory:\n{new_dir}")
 
+    def get_workers(self):
+        """Returns the Workers setting, or None if it isn't a positive number."""
+        try:
+            workers = int(self.workers_var.get())
+        except ValueError:
+            return None
+        return workers if workers > 0 else None
+
+    def get_git_context_lines(self):
+        """Returns the git context setting, or None if it isn't a number >= 0."""
+        try:
+            context_lines = int(self.git_context_var.get())
+        except ValueError:
+            return None
+        return context_lines if context_lines >= 0 else None
+
+    def get_reducer(self, context_lines=vcs.DEFAULT_CONTEXT_LINES):
+        """A Reducer for the checked reducers and git mode, or None if none applies. Raises vcs.GitError."""
+        modes = [mode for mode in reducers.MODES if self.reducer_vars[mode].get()]
+        dedupe = self.reducer_vars["dedupe"].get()
+        if self.git_mode_var.get() == "hunks":
+            return vcs.HunkReducer(self.current_dir, self.git_ref_var.get().strip() or vcs.DEFAULT_REF, context_lines,
+                                   modes, dedupe=dedupe, cache=self.reduction_cache)
+        if not modes and not dedupe:
+            return None
+        return reducers.Reducer(modes, dedupe=dedupe, cache=self.reduction_cache)
+
     def get_filter_settings(self):
-        inc_ext_str = self.include_ext_var.get().strip()
-        include_exts = [ext.strip().lstrip('.') for ext in inc_ext_str.split(',') if ext.strip()] if inc_ext_str else None
-        exc_path_str = self.exclude_paths_var.get().strip()
-        exclude_paths = [path.strip().replace('\\', '/') for path in exc_path_str.split(',') if path.strip()] if exc_path_str else None
+        include_exts = utils.parse_csv_setting(self.include_ext_var.get(), strip_dots=True)
+        exclude_paths = utils.parse_csv_setting(self.exclude_paths_var.get())
         return include_exts, exclude_paths
 
+    def get_scan_settings(self):
+        """Everything that determines the scan result and its token counts; a change requires a full rebuild."""
+        include_exts, exclude_paths = self.get_filter_settings()
+        git_mode = self.git_mode_var.get()
+        git_scan = None if git_mode == "off" else ("tracked" if git_mode == "tracked" else "changed")
+        git_ref = self.git_ref_var.get().strip() or vcs.DEFAULT_REF
+        return (self.current_dir, tuple(include_exts or ()), tuple(exclude_paths or ()),
+                self.use_gitignore_var.get(), self.get_workers() or 1, git_scan, git_ref, self.tokenizer_var.get())
+
+    @staticmethod
+    def scan_with_settings(settings):
+        root_dir, include_exts, exclude_paths, use_gitignore, workers, git_scan, git_ref, _ = settings
+        if git_scan:
+            # git's file list already honours .gitignore; "changed" narrows it to the diff against git_ref.
+            return vcs.scan_git(root_dir, list(exclude_paths), list(include_exts),
+                                changed_ref=git_ref if git_scan == "changed" else None, with_stats=True)
+        return utils.scan_directory(root_dir, list(exclude_paths), list(include_exts), sort_items=True,
+                                    use_gitignore=use_gitignore, workers=workers, with_stats=True)
+
     def populate_treeview(self):
+        settings = self.get_scan_settings()
+        if len(self.selection) and settings == self.scan_settings:
+            self.refresh_tree_incremental()
+            return
         self.log_message("Refreshing file tree...")
+        self.stop_watcher()
         for item in self.tree.get_children(): self.tree.delete(item)
-        self.checked_state.clear()
-        self.tree_items.clear()
-        include_exts, exclude_paths = self.get_filter_settings()
         try:
-            items = utils.scan_directory(self.current_dir, exclude_paths, include_exts, sort_items=True)
+            items = self.scan_with_settings(settings)
         except Exception as e:
             self.log_message(f"Error scanning directory: {e}", is_error=True)
             return
-        parent_map = {'': ''}
-        current_scan_rel_paths = set()
-        for rel_path, item_type in items:
-            current_scan_rel_paths.add(rel_path)
-            parent_rel_path = os.path.dirname(rel_path)
-            parent_iid = parent_map.get(parent_rel_path, '')
-            name = os.path.basename(rel_path)
-            initial_state = self.persistent_checked_state.get(rel_path, True)
-            self.persistent_checked_state.setdefault(rel_path, initial_state)
-            image, text_prefix = (self.img_checked if initial_state else self.img_unchecked, "") if self.img_checked else (None, "[x] " if initial_state else "[ ] ")
-            iid = self.tree.insert(parent_iid, 'end', text=f"{text_prefix}{name}", image=image, values=(rel_path, item_type), open=False)
-            self.checked_state[iid] = initial_state
-            self.tree_items[iid] = (rel_path, item_type)
-            if item_type == 'dir':
-                parent_map[rel_path] = iid
-        stale_paths = set(self.persistent_checked_state.keys()) - current_scan_rel_paths
-        for stale_path in stale_paths:
-            del self.persistent_checked_state[stale_path]
+        # The whole scan goes into the selection model; Treeview nodes are only
+        # created for the top level and for folders the user expands.
+        # Check state carries over for paths that are still present.
+        self.selection = selection.SelectionModel.from_items(items, self.selection.check_states())
+        self.populated_dirs = set()
+        self.stale_visual_dirs = set()
+        self._populate_children('')
+        self.scan_settings = settings
+        self.snapshot_items = items
+        self.start_watcher()
+        self.start_token_worker()
         self.log_message(f"Tree populated for: {self.current_dir}")
         self.clear_summary()
 
+    # --- Sessions: the last tree of each project, restored on reopen ---
+    def session_settings(self):
+        return {"include": self.include_ext_var.get(), "exclude": self.exclude_paths_var.get(),
+                "use_gitignore": self.use_gitignore_var.get(), "git_mode": self.git_mode_var.get(),
+                "git_ref": self.git_ref_var.get(), "tokenizer": self.tokenizer_var.get(),
+                "model": self.model_var.get(), "max_tokens": self.max_tokens_var.get()}
+
+    def _apply_session_settings(self, settings):
+        choices = {"git_mode": ["off"] + list(vcs.GIT_MODES), "tokenizer": tokenizers.BACKENDS,
+                   "model": [CUSTOM_MODEL] + list(tokenizers.MODEL_PRESETS)}
+        variables = {"include": self.include_ext_var, "exclude": self.exclude_paths_var,
+                     "use_gitignore": self.use_gitignore_var, "git_mode": self.git_mode_var,
+                     "git_ref": self.git_ref_var, "tokenizer": self.tokenizer_var,
+                     "model": self.model_var, "max_tokens": self.max_tokens_var}
+        for key, var in variables.items():
+            value = settings.get(key)
+            if value is not None and (key not in choices or value in choices[key]):
+                var.set(value)
+
+    def open_project(self, first=False):
+        """
+        Shows current_dir: from its saved session if there is one, with a rescan
+        in the background to pick up changes made since; otherwise by scanning.
+        """
+        started = time.perf_counter()
+        tokenizer = None if first else self.tokenizer_var.get()
+        saved = session.SessionStore(self.current_dir).load()
+        if saved is not None:
+            self._apply_session_settings(saved.settings)
+        if self.tokenizer_var.get() != tokenizer:
+            self.load_tokenizer()
+        if saved is None:
+            self.populate_treeview()
+            return
+        # Token counts are only valid for the tokenizer they were made with.
+        tokens = saved.tokens if saved.settings.get("tokenizer") == self.tokenizer_var.get() else None
+        settings = self.get_scan_settings()
+        self.stop_watcher()
+        for item in self.tree.get_children(): self.tree.delete(item)
+        self.selection = selection.SelectionModel.from_items(saved.items, saved.states, initial_tokens=tokens)
+        self.populated_dirs = set()
+        self.stale_visual_dirs = set()
+        self._populate_children('')
+        self.scan_settings = settings
+        self.snapshot_items = saved.items
+        self.start_watcher()
+        self.start_token_worker()
+        self.clear_summary()
+        self.log_message(f"Tree restored from the last session for: {self.current_dir} "
+                         f"({len(saved.items):,} items in {(time.perf_counter() - started) * 1000:,.0f} ms). Checking for changes...")
+        # The same path as a watcher notification: rescan off the main loop, then apply the diff.
+        threading.Thread(target=self._on_directory_changed, args=(settings, None), daemon=True).start()
+
+    def save_session(self):
+        if self.scan_settings is None or self.scan_settings[0] != self.current_dir:
+            return
+        session.SessionStore(self.current_dir).save(self.session_settings(), self.snapshot_items, self.selection)
+
+    def on_close(self):
+        self.save_session()
+        self.stop_watcher()
+        if self.token_worker is not None:
+            self.token_worker.stop()
+        self.token_cache.save()
+        self.root.destroy()
+
+    @staticmethod
+    def _placeholder_iid(rel_path):
+        return f"{rel_path}//placeholder"
+
+    def _populate_children(self, parent_iid):
+        """Creates the Treeview nodes for one folder's children (on first expansion)."""
+        if self.tree.exists(self._placeholder_iid(parent_iid)):
+            self.tree.delete(self._placeholder_iid(parent_iid))
+        for rel_path in self.selection.children_of(parent_iid):
+            self._insert_tree_item(parent_iid, rel_path)
+        self.populated_dirs.add(parent_iid)
+
+    def _checkbox_visual(self, rel_path):
+        """Returns (image, text prefix) for an item's checked/unchecked/partial state."""
+        state = self.selection.state(rel_path)
+        if self.img_checked:
+            images = {selection.CHECKED: self.img_checked, selection.UNCHECKED: self.img_unchecked, selection.PARTIAL: self.img_partial}
+            return images[state], ""
+        prefixes = {selection.CHECKED: "[x] ", selection.UNCHECKED: "[ ] ", selection.PARTIAL: "[-] "}
+        return None, prefixes[state]
+
+    def _insert_tree_item(self, parent_iid, rel_path, index='end'):
+        # Relative paths are unique, so they double as Treeview item ids.
+        item_type = self.selection.item_type(rel_path)
+        image, text_prefix = self._checkbox_visual(rel_path)
+        name = os.path.basename(rel_path)
+        self.tree.insert(parent_iid, index, iid=rel_path, text=f"{text_prefix}{name}", image=image or '',
+                         values=(rel_path, item_type, self._token_cell(rel_path)), open=False)
+        if item_type == 'dir' and self.selection.has_children(rel_path):
+            # A dummy child makes the folder expandable until its real children are inserted.
+            self.tree.insert(rel_path, 'end', iid=self._placeholder_iid(rel_path), text="...")
+
+    def on_tree_open(self, event):
+        iid = self.tree.focus()
+        if iid not in self.selection:
+            return
+        if iid not in self.populated_dirs:
+            self._populate_children(iid)
+            self._enqueue_token_counts(self.selection.children_of(iid), token_worker.VISIBLE)
+        elif iid in self.stale_visual_dirs:
+            self.stale_visual_dirs.discard(iid)
+            self._refresh_subtree_visuals(iid, opening=True)
+
+    def refresh_tree_incremental(self, items=None):
+        """Rescans (cheap stat pass) and only inserts/removes the Treeview nodes that changed."""
+        if items is None:
+            try:
+                items = self.scan_with_settings(self.scan_settings)
+            except Exception as e:
+                self.log_message(f"Error scanning directory: {e}", is_error=True)
+                return
+        added, removed, modified = utils.diff_snapshots(self.snapshot_items, items)
+        touched_parents = set()
+        for rel_path, item_type in removed:
+            if item_type == 'dir':
+                # Forget the folder's expanded subfolders too, so a folder that comes back starts collapsed.
+                prefix = rel_path + '/'
+                self.populated_dirs = {d for d in self.populated_dirs if d != rel_path and not d.startswith(prefix)}
+                self.stale_visual_dirs = {d for d in self.stale_visual_dirs if d != rel_path and not d.startswith(prefix)}
+            if rel_path not in self.selection:
+                continue  # already removed together with its folder
+            parent_iid = os.path.dirname(rel_path)
+            self.selection.remove(rel_path)
+            touched_parents.add(parent_iid)
+            if self.tree.exists(rel_path):
+                self.tree.delete(rel_path)
+            if parent_iid and not self.selection.has_children(parent_iid) and self.tree.exists(self._placeholder_iid(parent_iid)):
+                self.tree.delete(self._placeholder_iid(parent_iid))
+        for rel_path, item_type in added:
+            parent_iid = os.path.dirname(rel_path)
+            if parent_iid and parent_iid not in self.selection:
+                continue
+            # New items follow their folder's check state.
+            state = self.selection.is_checked(parent_iid) if parent_iid else True
+            index = self.selection.add(rel_path, item_type, state)
+            touched_parents.add(parent_iid)
+            if parent_iid in self.populated_dirs and (not parent_iid or self.tree.exists(parent_iid)):
+                self._insert_tree_item(parent_iid, rel_path, index)
+            elif self.tree.exists(parent_iid) and not self.tree.exists(self._placeholder_iid(parent_iid)):
+                self.tree.insert(parent_iid, 'end', iid=self._placeholder_iid(parent_iid), text="...")
+        if self.token_worker is not None:
+            changed_files = [rel_path for rel_path, item_type in added if item_type == 'file' and rel_path in self.selection]
+            self.token_worker.enqueue(changed_files + [p for p in modified if p in self.selection], token_worker.VISIBLE)
+        # Folder tri-states may have changed along the affected branches.
+        for parent_iid in touched_parents:
+            if parent_iid in self.selection:
+                self._refresh_ancestor_visuals(parent_iid, include_self=True)
+        self.snapshot_items = items
+        if self.watcher is not None:
+            self.watcher.last_items = items
+        if added or removed or modified:
+            self.log_message(f"Tree updated: {len(added)} added, {len(removed)} removed, {len(modified)} modified.")
+
+    def start_watcher(self):
+        self.stop_watcher()
+        if not self.auto_refresh_var.get():
+            return
+        settings = self.scan_settings
+        root_dir, include_exts, exclude_paths, use_gitignore, _, git_scan, _, _ = settings
+        self.watcher = watcher.DirectoryWatcher(
+            self.current_dir,
+            scan=lambda: self.scan_with_settings(settings),
+            on_change=lambda items: self._on_directory_changed(settings, items),
+            ignore=utils.make_ignore_filter(root_dir, exclude_paths, include_exts, use_gitignore or bool(git_scan)),
+        )
+        self.watcher.start(self.snapshot_items)
+
+    def stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def _on_directory_changed(self, settings, items):
+        # Called on the watcher's thread; the Treeview is only touched from the main loop.
+        if items is None:
+            try:
+                items = self.scan_with_settings(settings)
+            except Exception as e:
+                print(f"Warning: Rescan after file change failed: {e}")
+                return
+        self.root.after(0, self._apply_watched_scan, settings, items)
+
+    def _apply_watched_scan(self, settings, items):
+        if settings == self.scan_settings:
+            self.refresh_tree_incremental(items)
+
+    def toggle_auto_refresh(self):
+        if self.auto_refresh_var.get() and self.scan_settings is not None:
+            self.start_watcher()
+        else:
+            self.stop_watcher()
+
     def clear_summary(self):
         self.summary_text.configure(state='normal')
         self.summary_text.delete('1.0', tk.END)
         self.summary_text.configure(state='disabled')
 
     def update_item_visual(self, iid):
-        if iid not in self.checked_state: return
-        is_checked = self.checked_state[iid]
+        if iid not in self.selection or not self.tree.exists(iid): return
+        image, text_prefix = self._checkbox_visual(iid)
         if self.img_checked:
-            self.tree.item(iid, image=(self.img_checked if is_checked else self.img_unchecked))
+            self.tree.item(iid, image=image)
         else:
             text = self.tree.item(iid, 'text')
-            base_text = text[4:] if text.startswith(("[x] ", "[ ] ")) else text
-            self.tree.item(iid, text=("[x] " if is_checked else "[ ] ") + base_text)
+            base_text = text[4:] if text.startswith(("[x] ", "[ ] ", "[-] ")) else text
+            self.tree.item(iid, text=text_prefix + base_text)
 
     def on_tree_click(self, event):
         iid = self.tree.identify_row(event.y)
         if not iid: return
         element = self.tree.identify_element(event.x, event.y)
         if self.img_checked and element != 'image': return
-        if iid in self.checked_state: self.set_check_state(iid, not self.checked_state[iid], cascade=True)
+        if iid in self.selection: self.set_check_state(iid, not self.selection.is_checked(iid), cascade=True)
 
     def set_check_state(self, iid, state, cascade=True):
-        if iid not in self.tree_items: return
-        self.checked_state[iid] = state
-        self.persistent_checked_state[self.tree_items[iid][0]] = state
-        self.update_item_visual(iid)
-        if cascade:
-            for child_iid in self.tree.get_children(iid):
-                self.set_check_state(child_iid, state, cascade=True)
+        if iid not in self.selection: return
+        self.selection.set_checked(iid, state, cascade=cascade)
+        self._refresh_subtree_visuals(iid)
+        self._refresh_ancestor_visuals(iid)
+        self.update_token_meter()
+
+    def _refresh_subtree_visuals(self, iid, opening=False):
+        """Updates the widgets of an item and its visible descendants.
+
+        Descendants inside collapsed folders are not touched; those folders are
+        marked stale and refreshed when they are opened. `opening` is set while
+        handling <<TreeviewOpen>>, which fires before the folder is shown open.
+        """
+        if not opening:
+            self.update_item_visual(iid)
+        stack = [iid]
+        while stack:
+            folder = stack.pop()
+            if folder not in self.populated_dirs:
+                continue
+            if not (opening and folder == iid) and not self.tree.item(folder, 'open'):
+                self.stale_visual_dirs.add(folder)
+                continue
+            for child in self.tree.get_children(folder):
+                if child in self.selection:
+                    self.update_item_visual(child)
+                    stack.append(child)
+
+    def _refresh_ancestor_visuals(self, iid, include_self=False):
+        if include_self:
+            self.update_item_visual(iid)
+        for ancestor in self.selection.ancestors(iid):
+            self.update_item_visual(ancestor)
+
+    def start_token_worker(self):
+        if self.token_worker is not None:
+            self.token_worker.stop()
+            self.token_worker = None
+        if not tokenizers.is_available(self.tokenizer_var.get()):
+            return
+        self.token_worker = token_worker.TokenCountWorker(self.current_dir, cache=self.token_cache, tokenizer=self.tokenizer_var.get())
+        self._enqueue_token_counts(self.selection.children_of(''), token_worker.VISIBLE)
+        self._enqueue_token_counts(self.selection, token_worker.BACKGROUND)
+        self.update_token_meter()
+
+    def _enqueue_token_counts(self, rel_paths, priority):
+        if self.token_worker is None:
+            return
+        uncounted = [p for p in rel_paths if self.selection.item_type(p) == 'file' and self.selection.token_count(p) is None]
+        self.token_worker.enqueue(uncounted, priority)
+
+    def _drain_token_results(self):
+        """Applies finished background token counts in one batch per tick."""
+        worker = self.token_worker
+        if worker is not None:
+            results = worker.pop_results()
+            touched = set()
+            for rel_path, tokens in results:
+                if rel_path not in self.selection:
+                    continue
+                self.selection.set_tokens(rel_path, tokens or 0)
+                touched.add(rel_path)
+                touched.update(self.selection.ancestors(rel_path))
+            for rel_path in touched:
+                if self.tree.exists(rel_path):
+                    self.tree.set(rel_path, "tokens", self._token_cell(rel_path))
+            if results:
+                self.update_token_meter()
+        self.root.after(TOKEN_DRAIN_INTERVAL_MS, self._drain_token_results)
+
+    def _token_cell(self, rel_path):
+        tokens = self.selection.token_count(rel_path)
+        if tokens is None or (tokens == 0 and self.selection.item_type(rel_path) == 'dir'):
+            return ""
+        return f"{tokens:,}"
+
+    def get_template(self):
+        return templates.get_templates().get(self.template_var.get())
+
+    def get_task_text(self):
+        return self.task_text.get("1.0", "end-1c")
+
+    def get_template_tokens(self):
+        """Tokens the chosen template adds with the current task text; 0 without one or before the tokenizer loaded."""
+        template = self.get_template()
+        name = self.tokenizer_var.get()
+        if template is None or not tokenizers.is_loaded(name):
+            return 0
+        return template.cost(tokenizers.get_tokenizer(name), self.get_task_text())
+
+    def update_token_meter(self):
+        try:
+            max_tokens = int(self.max_tokens_var.get())
+        except ValueError:
+            max_tokens = 0
+        template_tokens = self.get_template_tokens()
+        self.template_cost_var.set(f"{template_tokens:,} tokens" if template_tokens else "")
+        max_tokens -= template_tokens
+        selected = self.selection.selected_tokens
+        text = f"Selected tokens: {selected:,}"
+        if template_tokens:
+            text += f" + template {template_tokens:,}"
+        if max_tokens > 0:
+            text += f" / {max_tokens:,}"
+            self.token_meter.configure(value=min(selected / max_tokens, 1.0) * 100)
+            if selected > max_tokens:
+                text += " (over limit, files will be truncated)"
+        pending = self.token_worker.pending if self.token_worker is not None else 0
+        if pending:
+            text += f"  - counting, {pending:,} file(s) left"
+        self.token_meter_var.set(text)
 
     def get_selected_file_paths(self):
-        return [self.tree_items[iid][0] for iid in self.tree_items if self.checked_state.get(iid) and self.tree_items[iid][1] == 'file']
\ No newline at end of file
+        return self.selection.selected_files()
@@ -0,0 +1,137 @@
+# promptgen_gui/cache.py
+import hashlib
+import json
+import os
+import sys
+import threading
+
+DEFAULT_MAX_ENTRIES = 50000
+CACHE_FILE_NAME = "token_cache.json"
+CACHE_VERSION = 1
+
+
+def default_cache_dir():
+    """Returns the per-user cache directory used by PromptGen GUI."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "promptgen_gui")
+
+
+def content_digest(content):
+    """Returns a short, stable hash of a file's decoded text content."""
+    return hashlib.blake2b(content.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class TokenCache:
+    """
+    On-disk cache of token counts.
+
+    Entries are keyed by (absolute path, encoding name, allowed special tokens) and
+    validated against the file's mtime and size. When the stat data changed, the
+    stored content hash is compared instead, so touching a file without editing it
+    still counts as a hit. The least recently used entries are evicted once the
+    cache grows beyond max_entries.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path or os.path.join(default_cache_dir(), CACHE_FILE_NAME)
+        self.max_entries = max_entries
+        self._entries = {}
+        self._clock = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one writer of the file at a time
+        self.load()
+
+    @staticmethod
+    def _key(abs_path, encoding_name, allowed_special):
+        allowed = ",".join(sorted(allowed_special or ()))
+        return f"{encoding_name}|{allowed}|{abs_path}"
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Warning: Ignoring unreadable token cache '{self.path}': {e}")
+            return
+        if data.get("version") != CACHE_VERSION:
+            return
+        with self._lock:
+            self._entries = data.get("entries", {})
+            self._clock = max((entry[4] for entry in self._entries.values()), default=0)
+
+    def save(self):
+        """Writes the cache to disk if it changed since it was loaded."""
+        with self._save_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._evict()
+                # Serialized under the lock: other threads may add entries meanwhile.
+                data = json.dumps({"version": CACHE_VERSION, "entries": self._entries}, separators=(",", ":"))
+                self._dirty = False
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"Warning: Could not save token cache '{self.path}': {e}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, abs_path, st, encoding_name, allowed_special=None, digest=None):
+        """
+        Returns the cached token count, or None on a miss.
+
+        A match on mtime and size is enough for a hit, so callers can try this before
+        reading the file. If the stat data differs, pass the content digest to
+        validate the entry by content instead.
+        """
+        key = self._key(abs_path, encoding_name, allowed_special)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            mtime_ns, size, entry_digest, tokens, _ = entry
+            if (mtime_ns, size) != (st.st_mtime_ns, st.st_size):
+                if digest is None or digest != entry_digest:
+                    return None
+                entry[0], entry[1] = st.st_mtime_ns, st.st_size
+            self._clock += 1
+            entry[4] = self._clock
+            self._dirty = True
+            return tokens
+
+    def put(self, abs_path, st, encoding_name, allowed_special, digest, tokens):
+        key = self._key(abs_path, encoding_name, allowed_special)
+        with self._lock:
+            self._clock += 1
+            self._entries[key] = [st.st_mtime_ns, st.st_size, digest, tokens, self._clock]
+            self._dirty = True
+
+    def _evict(self):
+        overflow = len(self._entries) - self.max_entries
+        if overflow <= 0:
+            return
+        oldest = sorted(self._entries.items(), key=lambda item: item[1][4])[:overflow]
+        for key, _ in oldest:
+            del self._entries[key]
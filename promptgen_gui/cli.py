@@ -0,0 +1,219 @@
+# promptgen_gui/cli.py
+import argparse
+import contextlib
+import fnmatch
+import os
+import sys
+
+from . import cache, core, profiling, reducers, templates, tokenizers, utils, vcs
+
+# Headless entry point: `python -m promptgen_gui ROOT [ROOT ...]`.
+# All roots are processed in one interpreter, so tiktoken is loaded only once.
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m promptgen_gui",
+        description="Generate LLM prompts (directory structure + file contents) without the GUI.",
+    )
+    parser.add_argument("roots", nargs="+", help="Project directories to generate prompts for.")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Output file, or '-' for stdout (default). '{name}' is replaced by the root's "
+                             "folder name to write one file per root; otherwise prompts are concatenated.")
+    parser.add_argument("-i", "--include", default=utils.DEFAULT_INCLUDE_EXTS,
+                        help="Comma-separated file extensions to include ('' for all).")
+    parser.add_argument("-e", "--exclude", default=utils.DEFAULT_EXCLUDE_PATHS,
+                        help="Comma-separated paths/patterns to exclude.")
+    parser.add_argument("--no-gitignore", action="store_true", help="Don't apply the roots' .gitignore files.")
+    parser.add_argument("--git", action="store_true",
+                        help="List files with git (tracked and untracked, .gitignore honoured) instead of walking the folders.")
+    parser.add_argument("--changed", nargs="?", const=vcs.DEFAULT_REF, metavar="REF",
+                        help=f"Only include files that differ from REF in the work tree (default {vcs.DEFAULT_REF}), "
+                             "plus untracked ones. Implies --git.")
+    parser.add_argument("--hunks", type=int, metavar="CONTEXT",
+                        help="Emit only the changed hunks of each changed file, with CONTEXT lines around each change. "
+                             "Implies --changed.")
+    parser.add_argument("-s", "--selection-file",
+                        help="File listing the paths (or glob patterns) to include, one per line, relative to "
+                             "each root. Lines starting with '#' are ignored. Default: every scanned file.")
+    parser.add_argument("-m", "--max-tokens", type=int,
+                        help=f"Token budget (default {core.DEFAULT_MAX_TOKENS:,}, or the --model's context window).")
+    parser.add_argument("--tokenizer", choices=list(tokenizers.BACKENDS),
+                        help=f"How to count tokens (default {tokenizers.DEFAULT_TOKENIZER}, or the --model's). "
+                             "The estimate:* backends are faster but approximate and need no tiktoken.")
+    parser.add_argument("--model", choices=list(tokenizers.MODEL_PRESETS),
+                        help="Use a model's tokenizer and context window; --tokenizer and --max-tokens override them.")
+    parser.add_argument("-w", "--workers", type=int, default=core.DEFAULT_WORKERS)
+    parser.add_argument("--max-file-bytes", type=int, default=core.DEFAULT_MAX_FILE_BYTES,
+                        help="Skip files larger than this many bytes (0 for no limit).")
+    parser.add_argument("--estimate", action="store_true",
+                        help="Plan oversized selections from file sizes and only encode what is emitted (faster, same limit).")
+    parser.add_argument("--split", action="store_true",
+                        help="Instead of truncating, pack an oversized selection into several prompts of at most "
+                             "--max-tokens each. '{part}' in --output writes one file per part.")
+    parser.add_argument("--reduce", default="",
+                        help=f"Comma-separated reducers to shrink file contents before counting: {', '.join(reducers.MODES)}. "
+                             "'comments' and 'outline' only change Python files.")
+    parser.add_argument("--dedupe", action="store_true", help="Emit files identical to an earlier one as a reference to it.")
+    parser.add_argument("--outline-min-bytes", type=int, default=reducers.DEFAULT_OUTLINE_MIN_BYTES,
+                        help="With --reduce outline, keep files smaller than this whole.")
+    parser.add_argument("--template", metavar="NAME",
+                        help="Wrap the prompt in a task template: one of the shipped templates "
+                             f"({', '.join(templates.get_templates()) or 'none found'}) or a template file. "
+                             "Its tokens count against --max-tokens.")
+    parser.add_argument("--task", default="", help="Text for the template's {{input}} placeholder, e.g. the bug description.")
+    parser.add_argument("--task-file", metavar="PATH", help="Read the --task text from a file ('-' for stdin).")
+    parser.add_argument("-t", "--truncation", choices=list(core.TRUNCATION_POLICIES), default=core.DEFAULT_TRUNCATION)
+    parser.add_argument("--allow-special", default="",
+                        help="Comma-separated special tokens (e.g. '<|endoftext|>') to allow in file contents.")
+    parser.add_argument("--special-tokens", choices=list(core.SPECIAL_TOKEN_HANDLING), default="error",
+                        help="What to do with special tokens such as <|endoftext|> that aren't in --allow-special: "
+                             "fail (default), allow them, encode them as plain text, or skip the files containing them.")
+    parser.add_argument("--no-cache", action="store_true", help="Don't read or update the on-disk token cache.")
+    parser.add_argument("--timings", action="store_true", help="Add stage timings, counters and the slowest files to the summary.")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="Write cProfile stats of each run to PATH ({name} is replaced by the root's folder name). Implies --timings.")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Don't print the summary to stderr.")
+    return parser
+
+
+def read_selection_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.strip().replace("\\", "/") for line in f]
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def select_files(items, patterns):
+    """Returns the scanned files matching any selection pattern, or all files if there are none."""
+    files = [rel_path for rel_path, item_type in items if item_type == "file"]
+    if patterns is None:
+        return files
+    exact = set(patterns)
+    globs = [pattern for pattern in patterns if any(ch in pattern for ch in "*?[")]
+    return [f for f in files if f in exact or any(fnmatch.fnmatchcase(f, g) for g in globs)]
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    preset_tokenizer, preset_max_tokens = tokenizers.MODEL_PRESETS.get(args.model, (tokenizers.DEFAULT_TOKENIZER, core.DEFAULT_MAX_TOKENS))
+    tokenizer_name = args.tokenizer or preset_tokenizer
+    if args.max_tokens is None:
+        args.max_tokens = preset_max_tokens
+    if args.max_tokens <= 0 or args.workers <= 0:
+        print("Error: --max-tokens and --workers must be positive.", file=sys.stderr)
+        return 2
+    if args.hunks is not None and args.hunks < 0:
+        print("Error: --hunks must not be negative.", file=sys.stderr)
+        return 2
+    changed_ref = args.changed or (vcs.DEFAULT_REF if args.hunks is not None else None)
+    if tokenizers.get_tokenizer(tokenizer_name) is None:
+        print(f"Error: tiktoken is required for {tokenizer_name} but not installed, or its encoding could not be loaded.", file=sys.stderr)
+        return 1
+
+    include_exts = utils.parse_csv_setting(args.include, strip_dots=True)
+    exclude_paths = utils.parse_csv_setting(args.exclude)
+    allowed_special = set(utils.parse_csv_setting(args.allow_special) or ())
+    reduce_modes = utils.parse_csv_setting(args.reduce) or ()
+    unknown = set(reduce_modes) - set(reducers.MODES)
+    if unknown:
+        print(f"Error: unknown reducer(s) in --reduce: {', '.join(sorted(unknown))}.", file=sys.stderr)
+        return 2
+    template = None
+    task = args.task
+    if (args.task or args.task_file) and not args.template:
+        print("Error: --task and --task-file need a --template to fill in.", file=sys.stderr)
+        return 2
+    if args.template:
+        try:
+            template = templates.get_template(args.template)
+        except ValueError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 2
+        if args.task_file:
+            if args.task_file == "-":
+                task = sys.stdin.read()
+            else:
+                try:
+                    with open(args.task_file, "r", encoding="utf-8") as f:
+                        task = f.read()
+                except (OSError, UnicodeDecodeError) as e:
+                    print(f"Error: could not read --task-file '{args.task_file}': {e}", file=sys.stderr)
+                    return 2
+    reduction_cache = reducers.ReductionCache() if reduce_modes or args.dedupe or args.hunks is not None else None
+    patterns = None
+    if args.selection_file:
+        try:
+            patterns = read_selection_file(args.selection_file)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error: could not read --selection-file '{args.selection_file}': {e}", file=sys.stderr)
+            return 2
+    token_cache = None if args.no_cache else cache.TokenCache()
+
+    per_root_output = args.output != "-" and ("{name}" in args.output or (args.split and core.PART_PLACEHOLDER in args.output))
+    shared_output = None
+    if args.output == "-":
+        shared_output = sys.stdout
+    elif not per_root_output:
+        shared_output = open(args.output, "w", encoding="utf-8", newline="")
+
+    exit_code = 0
+    wrote_prompt = False
+    try:
+        # Warnings from the pipeline are printed; keep them out of a prompt written to stdout.
+        with contextlib.redirect_stdout(sys.stderr):
+            for root in args.roots:
+                if not os.path.isdir(root):
+                    print(f"Error: '{root}' is not a directory.", file=sys.stderr)
+                    exit_code = 1
+                    continue
+                name = os.path.basename(os.path.abspath(root))
+                instrumentation = None
+                if args.timings or args.profile:
+                    profile_path = args.profile.replace("{name}", name) if args.profile else None
+                    instrumentation = profiling.Instrumentation(profile_path=profile_path)
+                try:
+                    if args.git or changed_ref:
+                        items = vcs.scan_git(root, exclude_paths, include_exts, changed_ref=changed_ref)
+                    else:
+                        items = utils.scan_directory(root, exclude_paths, include_exts, sort_items=True,
+                                                     use_gitignore=not args.no_gitignore, workers=args.workers,
+                                                     instrumentation=instrumentation)
+                    reducer = None
+                    if args.hunks is not None:
+                        reducer = vcs.HunkReducer(root, changed_ref, args.hunks, reduce_modes, dedupe=args.dedupe,
+                                                  outline_min_bytes=args.outline_min_bytes, cache=reduction_cache)
+                    elif reduction_cache is not None:
+                        reducer = reducers.Reducer(reduce_modes, dedupe=args.dedupe, outline_min_bytes=args.outline_min_bytes,
+                                                   cache=reduction_cache)
+                except vcs.GitError as e:
+                    print(f"Error reading git data for '{root}': {e}", file=sys.stderr)
+                    exit_code = 1
+                    continue
+                selected = select_files(items, patterns)
+                if per_root_output:
+                    write_to = args.output.replace("{name}", name)
+                else:
+                    write_to = shared_output
+                    if wrote_prompt:
+                        write_to.write("\n\n")
+                try:
+                    _, summary = core.generate_prompt_data(
+                        root, selected, include_exts, exclude_paths, args.max_tokens, allowed_special,
+                        cache=token_cache, workers=args.workers, truncation=args.truncation, write_to=write_to,
+                        instrumentation=instrumentation, max_file_bytes=args.max_file_bytes or None, estimate=args.estimate,
+                        special_tokens=args.special_tokens, split=args.split, reducer=reducer,
+                        tokenizer=tokenizer_name, template=template, template_input=task
+                    )
+                except ValueError as e:
+                    print(f"Error processing '{root}': {e}", file=sys.stderr)
+                    exit_code = 1
+                    continue
+                wrote_prompt = True
+                if not args.quiet:
+                    print(f"=== {root} ===\n{summary}\n", file=sys.stderr)
+    finally:
+        if shared_output is not None and shared_output is not sys.stdout:
+            shared_output.close()
+        elif shared_output is sys.stdout:
+            sys.stdout.flush()
+    return exit_code
@@ -1,147 +1,1299 @@
 # promptgen_gui/core.py
 
+import bisect
+import codecs
+import heapq
+import io
+import itertools
+import re
+import math
+import mmap
 import os
-import pyperclip
-import tiktoken
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import profiling, tokenizers
+from .cache import content_digest
+from .tokenizers import SPECIAL_AS_TEXT
 from .utils import generate_tree_structure_string
 
-try:
-    encoder = tiktoken.get_encoding("cl100k_base")
-    tiktoken_available = True
-except (ImportError, ValueError):
-    encoder = None
-    tiktoken_available = False
-    print("Warning: tiktoken not installed or model not found.")
+# The default tokenizer, loaded on first use (see get_encoder), which can take
+# seconds on a cold start. tiktoken_available turns False if loading fails.
+# Functions that count tokens take a `tokenizer` (see tokenizers.BACKENDS);
+# None means this one.
+ENCODING_NAME = tokenizers.DEFAULT_TOKENIZER
+tiktoken_available = tokenizers.tiktoken_available
+encoder = None
+encoder_error = None
 
 DEFAULT_MAX_TOKENS = 150000
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+DEFAULT_MAX_FILE_BYTES = 20 * 1024 * 1024  # larger files are skipped, not read
+
+# Estimation mode (see _measure_estimated).
+DEFAULT_BYTES_PER_TOKEN = 4.0
+ESTIMATE_SAMPLE_FILES = 16
+ESTIMATE_SAMPLE_MAX_BYTES = 256 * 1024  # larger files aren't worth encoding as a sample
+ESTIMATE_MIN_CALIBRATION_TOKENS = 5000
+ESTIMATE_MARGIN = 1.1  # plan for 10% more than the limit; the exact pass trims the excess
+PROGRESS_INTERVAL = 0.1  # seconds between progress callbacks
+RELEASE_CHECK_TOKENS = 1 << 20  # check which token arrays can go after this many more are held
+
+def get_encoder():
+    """
+    Returns the default tokenizer, loading it on the first call. Other threads
+    calling meanwhile wait for that load. Returns None if tiktoken is missing or
+    the encoding can't be loaded; encoder_error then says why.
+    """
+    global encoder, encoder_error, tiktoken_available
+    if encoder is not None or not tiktoken_available:
+        return encoder
+    encoder = tokenizers.get_tokenizer(ENCODING_NAME)
+    if encoder is None:
+        encoder_error = tokenizers.load_error(ENCODING_NAME)
+        tiktoken_available = False
+    return encoder
+
+def resolve_tokenizer(tokenizer):
+    """The backend for a `tokenizer` argument: None (the default), a tokenizers.BACKENDS name or a backend. May be None."""
+    if tokenizer is None:
+        return get_encoder()
+    if isinstance(tokenizer, str):
+        return get_encoder() if tokenizer == ENCODING_NAME else tokenizers.get_tokenizer(tokenizer)
+    return tokenizer
+
+def load_encoder_in_background(on_done):
+    """Starts loading the encoder on a daemon thread; on_done(encoder, seconds) is called from that thread."""
+    def target():
+        start = time.perf_counter()
+        on_done(get_encoder(), time.perf_counter() - start)
+    threading.Thread(target=target, daemon=True).start()
 
 # --- MODIFIED: Accepts allowed_special_tokens ---
-def calculate_tokens(text, allowed_special_tokens=None):
-    """Calculates token count for a given text using tiktoken."""
-    if not tiktoken_available or encoder is None: return 0
-    allowed = allowed_special_tokens or set()
-    return len(encoder.encode(text, allowed_special=allowed))
-
-def read_file_content(filepath):
-    # ... (unchanged) ...
+def calculate_tokens(text, allowed_special_tokens=None, tokenizer=None):
+    """Calculates token count for a given text using the tokenizer (the default if None)."""
+    tokenizer = resolve_tokenizer(tokenizer)
+    if tokenizer is None: return 0
+    return tokenizer.count(text, allowed_special_tokens)
+
+def encode_tokens(text, allowed_special_tokens=None, tokenizer=None):
+    """Encodes text into a compact token sequence (for tiktoken, an array of ids, 4 bytes per token)."""
+    return resolve_tokenizer(tokenizer).encode(text, allowed_special_tokens)
+
+ESTIMATED_COUNTS_NOTE = "Token counts are estimates ({tokenizer}); the real count for your model may differ."
+
+# --- Truncation policies ---
+# A policy pairs a planner, which decides how many tokens each file keeps, with a
+# keeper, which decides which of a file's tokens survive.
+TRUNCATION_MARKER = "\n\n... [truncated] ...\n\n"
+
+def _plan_largest_first(token_counts, overflow):
+    """Removes tokens from the largest files first until the overflow is gone."""
+    new_counts = list(token_counts)
+    for i in sorted(range(len(new_counts)), key=lambda i: new_counts[i], reverse=True):
+        if overflow <= 0: break
+        tokens_to_remove = min(new_counts[i], overflow)
+        new_counts[i] -= tokens_to_remove
+        overflow -= tokens_to_remove
+    return new_counts
+
+def _plan_proportional(token_counts, overflow):
+    """Shrinks every file by the same fraction of its size."""
+    total = sum(token_counts)
+    budget = max(total - overflow, 0)
+    shares = [count * budget for count in token_counts]
+    new_counts = [share // total for share in shares]
+    # Hand the tokens lost to rounding to the files with the largest remainders.
+    leftover = budget - sum(new_counts)
+    by_remainder = sorted(range(len(shares)), key=lambda i: shares[i] % total, reverse=True)
+    for i in by_remainder[:leftover]:
+        new_counts[i] += 1
+    return new_counts
+
+def _keep_head(token_array, new_count, tokenizer):
+    return tokenizer.decode(token_array[:new_count])
+
+def _keep_head_tail(token_array, new_count, tokenizer):
+    """Keeps the beginning and the end of a file, dropping its middle."""
+    marker_tokens = tokenizer.count(TRUNCATION_MARKER)
+    if new_count <= marker_tokens * 2:
+        return _keep_head(token_array, new_count, tokenizer)
+    kept = new_count - marker_tokens
+    head = kept - kept // 2
+    tail = kept // 2
+    return tokenizer.decode(token_array[:head]) + TRUNCATION_MARKER + tokenizer.decode(token_array[len(token_array) - tail:])
+
+TRUNCATION_POLICIES = {
+    "largest_first": (_plan_largest_first, _keep_head),
+    "proportional": (_plan_proportional, _keep_head),
+    "head_tail": (_plan_largest_first, _keep_head_tail),
+}
+DEFAULT_TRUNCATION = "largest_first"
+
+# --- Reading files ---
+SNIFF_BYTES = 8192
+MMAP_THRESHOLD = 1024 * 1024  # files at least this large are mapped instead of read
+
+# Reasons a file is left out of the prompt, as shown in the summary.
+SKIP_REASONS = {
+    "Read Error": "read errors",
+    "Binary": "binary content",
+    "Too Large": "size over the per-file limit",
+    "Decode Error": "text that is neither utf-8 nor cp1252",
+    "Special Tokens": "disallowed special tokens",
+}
+
+class FileSkipped(Exception):
+    """Raised by load_text when a file can't be used; reason is a SKIP_REASONS key."""
+    def __init__(self, reason, detail=""):
+        super().__init__(detail or reason)
+        self.reason = reason
+
+_BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+         (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+
+def _sniff_encoding(prefix):
+    """Guesses the encoding from the first bytes; raises FileSkipped for binary data."""
+    for bom, encoding in _BOMS:
+        if prefix.startswith(bom):
+            return encoding
+    if b"\0" in prefix:
+        raise FileSkipped("Binary")
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return f.read()
+        # final=False tolerates a multi-byte character cut off at the end of the prefix.
+        codecs.getincrementaldecoder('utf-8')().decode(prefix, final=False)
+        return 'utf-8'
     except UnicodeDecodeError:
+        return 'cp1252'
+
+def _decode(data, encoding, instrumentation):
+    if encoding == 'utf-8':
         try:
-            with open(filepath, 'r', encoding='cp1252') as f:
-                return f.read()
-        except Exception:
+            return str(data, 'utf-8')
+        except UnicodeDecodeError:
+            encoding = 'cp1252'  # invalid bytes past the sniffed prefix
+    if encoding == 'cp1252':
+        instrumentation.count("cp1252 fallbacks")
+    try:
+        with instrumentation.stage(f"{encoding} decode"):
+            return str(data, encoding)
+    except UnicodeDecodeError:
+        raise FileSkipped("Decode Error") from None
+
+def load_text(filepath, max_bytes=DEFAULT_MAX_FILE_BYTES, instrumentation=profiling.NULL):
+    """
+    Reads a file in one pass and returns its text, or raises FileSkipped.
+
+    The bytes are read once (large files are memory-mapped) and decoded from the
+    same buffer: the encoding and binary content are sniffed from the first
+    SNIFF_BYTES, and a utf-8 failure falls back to cp1252 without reading again.
+    Files larger than max_bytes (None for no limit) are rejected before reading.
+    Line endings are normalized to \\n, as in text mode.
+    """
+    try:
+        with open(filepath, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if max_bytes is not None and size > max_bytes:
+                raise FileSkipped("Too Large", f"{size:,} bytes")
+            if size >= MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    text = _decode(data, _sniff_encoding(data[:SNIFF_BYTES]), instrumentation)
+            else:
+                data = f.read()
+                text = _decode(data, _sniff_encoding(data[:SNIFF_BYTES]), instrumentation)
+    except OSError as e:
+        raise FileSkipped("Read Error", str(e)) from None
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+def read_file_content(filepath, instrumentation=profiling.NULL, max_bytes=DEFAULT_MAX_FILE_BYTES):
+    """Returns the text of a file, or None (with a warning) if it can't be used."""
+    try:
+        return load_text(filepath, max_bytes, instrumentation)
+    except FileSkipped as e:
+        if e.reason == "Decode Error":
             print(f"Warning: Unable to decode file '{filepath}' with utf-8 or cp1252. Skipping content.")
-            return None
-    except Exception as e:
-        print(f"Warning: Error reading file '{filepath}': {e}. Skipping content.")
+        elif e.reason == "Read Error":
+            print(f"Warning: Error reading file '{filepath}': {e}. Skipping content.")
         return None
 
-# --- MODIFIED: Accepts allowed_special parameter ---
-def generate_prompt_data(root_dir, selected_paths, include_exts=None, exclude_paths=None, max_tokens=DEFAULT_MAX_TOKENS, allowed_special=None):
-    if not tiktoken_available:
-        return None, "Error: tiktoken library is required but not installed."
+def sniff_file(abs_path):
+    """Raises FileSkipped if a file looks binary, reading only its first bytes."""
+    try:
+        with open(abs_path, 'rb') as f:
+            _sniff_encoding(f.read(SNIFF_BYTES))
+    except OSError as e:
+        raise FileSkipped("Read Error", str(e)) from None
 
-    allowed_special = allowed_special or set()
-    file_stats = []
-    action_summary = []
-    relevant_structure_paths = set()
+# --- Special token pre-scan ---
+SPECIAL_TOKEN_HANDLING = ("error", "allow", "text", "skip")
+MAX_SPECIAL_TOKEN_LINES = 20  # line numbers reported per token and file
+
+_special_token_regexes = {}  # tokenizer name -> compiled pattern, or None if it has no special tokens
+
+def _special_token_pattern(tokenizer):
+    """One compiled bytes regex matching every special token of the tokenizer."""
+    if tokenizer.name not in _special_token_regexes:
+        # Longest first, so a token is never matched by a shorter prefix of it.
+        tokens = sorted(tokenizer.special_tokens_set, key=len, reverse=True)
+        _special_token_regexes[tokenizer.name] = re.compile(b"|".join(re.escape(t.encode("utf-8")) for t in tokens)) if tokens else None
+    return _special_token_regexes[tokenizer.name]
+
+def find_special_tokens(abs_path, allowed_special=None, max_file_bytes=DEFAULT_MAX_FILE_BYTES, tokenizer=None):
+    """
+    Returns {token: [line numbers]} of the special tokens in a file that aren't
+    in allowed_special, searching the raw bytes (memory-mapped for large files)
+    without decoding them. Unreadable and oversized files yield {}.
+    """
+    allowed = allowed_special or set()
+    tokenizer = resolve_tokenizer(tokenizer)
+    if SPECIAL_AS_TEXT in allowed or tokenizer is None:
+        return {}
+    pattern = _special_token_pattern(tokenizer)
+    if pattern is None:
+        return {}
+    found = {}
+    try:
+        with open(abs_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0 or (max_file_bytes is not None and size > max_file_bytes):
+                return {}
+            if size >= MMAP_THRESHOLD:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = f.read()
+            if any(data[:4].startswith(bom) for bom, _ in _BOMS):
+                # UTF-16/32 text doesn't contain the tokens' ASCII bytes; search its utf-8 form.
+                if isinstance(data, mmap.mmap):
+                    data.close()
+                data = load_text(abs_path, max_file_bytes).encode("utf-8")
+            try:
+                line, line_start = 1, 0
+                for match in pattern.finditer(data):
+                    token = match.group().decode("utf-8")
+                    if token in allowed:
+                        continue
+                    line += data[line_start:match.start()].count(b"\n")  # mmap has no count()
+                    line_start = match.start()
+                    lines = found.setdefault(token, [])
+                    if len(lines) < MAX_SPECIAL_TOKEN_LINES and (not lines or lines[-1] != line):
+                        lines.append(line)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+    except (OSError, ValueError, FileSkipped):
+        return {}
+    return found
+
+def scan_special_tokens(root_dir, rel_paths, allowed_special=None, workers=DEFAULT_WORKERS, max_file_bytes=DEFAULT_MAX_FILE_BYTES, progress=None, cancel_event=None, tokenizer=None, instrumentation=profiling.NULL):
+    """
+    Finds the disallowed special tokens in all given files in one pass, so the
+    user can decide about all of them at once instead of per ValueError.
+
+    Returns {token: {rel_path: [line numbers]}}; empty if there are none.
+    """
+    tokenizer = resolve_tokenizer(tokenizer)
+    if tokenizer is None or not tokenizer.special_tokens_set:
+        return {}
     abs_root_dir = os.path.abspath(root_dir)
+    job = _JobControl(progress, cancel_event)
+    job.start_phase("Scanning for special tokens", len(rel_paths))
 
-    # --- 1. Filter and Collect Stats ---
-    for rel_path in selected_paths:
-        abs_path = os.path.normpath(os.path.join(abs_root_dir, rel_path))
-        if not os.path.isfile(abs_path): continue
+    def scan(rel_path):
+        job.check()
+        found = find_special_tokens(os.path.join(abs_root_dir, rel_path), allowed_special, max_file_bytes, tokenizer)
+        job.advance()
+        return found
+    results = _map_workers(scan, list(rel_paths), workers, instrumentation)
+    job.finish_phase()
+    by_token = {}
+    for rel_path, found in zip(rel_paths, results):
+        for token, lines in found.items():
+            by_token.setdefault(token, {})[rel_path] = lines
+    return by_token
+
+def resolve_allowed_special(allowed_special, special_tokens, tokenizer=None):
+    """Returns the allowed_special set to encode with for a SPECIAL_TOKEN_HANDLING choice."""
+    if special_tokens not in SPECIAL_TOKEN_HANDLING:
+        raise ValueError(f"Unknown special token handling '{special_tokens}'.")
+    allowed_special = set(allowed_special or ())
+    tokenizer = resolve_tokenizer(tokenizer)
+    if special_tokens == "allow" and tokenizer is not None:
+        allowed_special |= tokenizer.special_tokens_set
+    elif special_tokens == "text":
+        allowed_special.add(SPECIAL_AS_TEXT)
+    return allowed_special
+
+def measure_file(abs_path, allowed_special=None, cache=None, instrumentation=profiling.NULL, max_file_bytes=DEFAULT_MAX_FILE_BYTES, reducer=None, tokenizer=None):
+    """
+    Counts the tokens of a file, consulting the TokenCache if one is given.
+
+    Returns (size_bytes, tokens, token_array, cache_hit) and raises FileSkipped
+    if the file can't be used. The content itself is not kept: a cache hit on
+    mtime/size skips the read entirely, and token_array is only set when the file
+    was actually encoded. cache_hit is None when no cache is used. Safe to call
+    from worker threads.
+
+    With a reducers.Reducer, the reduced content is counted instead. The
+    TokenCache is not used then; the reducer's own cache, keyed by content
+    hash, spares unchanged files the reduction and encoding.
+
+    Counts are per tokenizer (None for the default); so are the cache entries.
+    """
+    tokenizer = resolve_tokenizer(tokenizer)
+    st, result = measure_stat(abs_path, allowed_special, cache if reducer is None else None, max_file_bytes, tokenizer)
+    if result is not None:
+        return result
+    if reducer is not None:
+        with instrumentation.stage("read"):
+            content = load_text(abs_path, max_file_bytes, instrumentation)
+        instrumentation.count("bytes read", st.st_size)
+        with instrumentation.stage("reduce"):
+            _, token_array, tokens, saved = reducer.reduce(abs_path, content, lambda text: tokenizer.encode(text, allowed_special), _reduce_context(allowed_special, tokenizer))
+        reducer.record(saved)
+        return st.st_size, tokens, token_array, None
+
+    with instrumentation.stage("read"):
+        content = load_text(abs_path, max_file_bytes, instrumentation)
+    instrumentation.count("bytes read", st.st_size)
+    return measure_text(abs_path, st, content, allowed_special, cache, instrumentation, tokenizer)
+
+def measure_stat(abs_path, allowed_special=None, cache=None, max_file_bytes=DEFAULT_MAX_FILE_BYTES, tokenizer=None):
+    """
+    The first half of measure_file, which doesn't read the file: returns its
+    os.stat result and, on a TokenCache hit by mtime/size, measure_file's
+    result (else None, and the content goes to measure_text). Raises FileSkipped.
+    """
+    try:
+        st = os.stat(abs_path)
+    except OSError as e:
+        raise FileSkipped("Read Error", str(e)) from None
+    if max_file_bytes is not None and st.st_size > max_file_bytes:
+        raise FileSkipped("Too Large", f"{st.st_size:,} bytes")
+    if cache is not None:
+        tokens = cache.get(abs_path, st, resolve_tokenizer(tokenizer).name, allowed_special)
+        if tokens is not None:
+            return st, (st.st_size, tokens, None, True)
+    return st, None
+
+def measure_text(abs_path, st, content, allowed_special=None, cache=None, instrumentation=profiling.NULL, tokenizer=None):
+    """The second half of measure_file, for content that was already read; st is its os.stat result."""
+    tokenizer = resolve_tokenizer(tokenizer)
+    if cache is None:
+        with instrumentation.stage("encode"):
+            token_array = tokenizer.encode(content, allowed_special)
+        instrumentation.count("tokens encoded", len(token_array))
+        return st.st_size, len(token_array), token_array, None
+
+    # The stat data changed; the file may still be identical by content.
+    digest = content_digest(content)
+    tokens = cache.get(abs_path, st, tokenizer.name, allowed_special, digest=digest)
+    if tokens is not None:
+        return st.st_size, tokens, None, True
+    with instrumentation.stage("encode"):
+        token_array = tokenizer.encode(content, allowed_special)
+    instrumentation.count("tokens encoded", len(token_array))
+    cache.put(abs_path, st, tokenizer.name, allowed_special, digest, len(token_array))
+    return st.st_size, len(token_array), token_array, False
+
+TREE_ERROR_SECTION = "Directory structure: (Error generating structure)"
+
+def tree_section(root_dir, relevant_structure_paths, exclude_paths=None):
+    """The directory structure that starts every prompt."""
+    return "Directory structure (showing relevant files/folders):\n" + generate_tree_structure_string(
+        root_dir, relevant_structure_paths, exclude_paths=exclude_paths)
+
+def _reduce_context(allowed_special, tokenizer):
+    """What besides the content decides a reduced file's count, for the Reducer's cache key."""
+    return tokenizer.name + "|" + ",".join(sorted(allowed_special or ()))
+
+def _output_text(abs_path, allowed_special, max_file_bytes, instrumentation, reducer, tokenizer):
+    """The text emitted for a file: its content, reduced if a Reducer is given. Raises FileSkipped."""
+    if reducer is not None and abs_path in reducer.duplicates:
+        return reducer.duplicate_text(abs_path)
+    content = load_text(abs_path, max_file_bytes, instrumentation)
+    if reducer is not None:
+        with instrumentation.stage("reduce"):
+            content = reducer.reduce(abs_path, content, lambda text: tokenizer.encode(text, allowed_special), _reduce_context(allowed_special, tokenizer))[0]
+    return content
+
+def iter_prompt_chunks(root_dir, file_stats, relevant_structure_paths, exclude_paths=None, allowed_special=None, truncation=DEFAULT_TRUNCATION, instrumentation=profiling.NULL, max_file_bytes=DEFAULT_MAX_FILE_BYTES, job=None, reducer=None, tokenizer=None):
+    """
+    Yields the prompt text piece by piece: the directory structure first, then one
+    "--- path ---" section per file.
+
+    file_stats rows are [rel_path, size_bytes, original_tokens, current_tokens,
+    abs_path, status, token_array]. Whole files are read from disk one at a time
+    as their section is emitted; truncated files are decoded from their token
+    arrays, which are released right after. Rows of files that can no longer be
+    read get their SKIP_REASONS key (e.g. "Read Error") as status. A _JobControl
+    passed as `job` is advanced per file and can cancel the iteration. With a
+    reducers.Reducer, the reduced contents are emitted. tokenizer must be the
+    one the token arrays and counts came from.
+    """
+    job = job or _JobControl()
+    tokenizer = resolve_tokenizer(tokenizer)
+    _, keep = TRUNCATION_POLICIES[truncation]
+    try:
+        with instrumentation.stage("tree"):
+            tree = tree_section(root_dir, relevant_structure_paths, exclude_paths)
+        yield tree
+    except Exception as e:
+        print(f"Error generating tree structure string: {e}")
+        yield TREE_ERROR_SECTION
+
+    for item in file_stats:
+        job.check()
+        job.advance(item[1], item[3])
+        try:
+            content = output_content(item, keep, allowed_special, max_file_bytes, instrumentation, reducer, tokenizer)
+        except FileSkipped as e:
+            item[5] = e.reason
+            continue
+        yield section_header(item[0])
+        yield content
+
+def output_content(item, keep, allowed_special=None, max_file_bytes=DEFAULT_MAX_FILE_BYTES, instrumentation=profiling.NULL, reducer=None, tokenizer=None):
+    """
+    The text emitted for a file_stats row: the file's content or, if it was
+    truncated, what the policy's `keep` leaves of its tokens. The row's token
+    array is released. Only truncated rows are encoded or decoded here. Raises
+    FileSkipped if the file can no longer be read.
+    """
+    _, _, _, current_tokens, abs_path, status, token_array = item
+    item[6] = None
+    if status != "Truncated":
+        with instrumentation.stage("output read"):
+            return _output_text(abs_path, allowed_special, max_file_bytes, instrumentation, reducer, tokenizer)
+    if current_tokens == 0:
+        return ""
+    tokenizer = resolve_tokenizer(tokenizer)
+    if token_array is None:
+        # Counted from the cache, so it has to be encoded once here.
+        content = _output_text(abs_path, allowed_special, max_file_bytes, instrumentation, reducer, tokenizer)
+        with instrumentation.stage("re-encode for truncation"):
+            token_array = tokenizer.encode(content, allowed_special)
+        del content
+    with instrumentation.stage("truncate"):
+        return keep(token_array, current_tokens, tokenizer)
+
+# --- Progress, cancellation and resuming ---
+class JobCancelled(Exception):
+    """Raised by generate_prompt_data when its cancel_event is set."""
+
+class _JobControl:
+    """
+    Per-run helper for generate_prompt_data: reports progress, checks for
+    cancellation and looks up results memoized by an earlier, interrupted run.
+
+    progress(phase, files_done, files_total, bytes_done, tokens_done) is called
+    from worker threads, at most every PROGRESS_INTERVAL seconds plus once at
+    the end of each phase ("Counting tokens", then "Writing prompt").
+    """
+
+    def __init__(self, progress=None, cancel_event=None, memo=None):
+        self.progress = progress
+        self.cancel_event = cancel_event
+        self.memo = memo
+        self._lock = threading.Lock()
+        self._phase = None
+        self._total = self._files = self._bytes = self._tokens = 0
+        self._last_report = 0.0
+
+    def check(self):
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def start_phase(self, phase, total):
+        self.finish_phase()
+        with self._lock:
+            self._phase, self._total = phase, total
+            self._files = self._bytes = self._tokens = 0
+        self._report(force=True)
+
+    def advance(self, size_bytes=0, tokens=0):
+        with self._lock:
+            self._files += 1
+            self._bytes += size_bytes
+            self._tokens += tokens
+        self._report()
+
+    def finish_phase(self):
+        if self._phase is not None:
+            self._report(force=True)
+
+    def _report(self, force=False):
+        if self.progress is None:
+            return
+        with self._lock:
+            now = time.perf_counter()
+            if not force and now - self._last_report < PROGRESS_INTERVAL:
+                return
+            self._last_report = now
+            state = (self._phase, self._files, self._total, self._bytes, self._tokens)
+        self.progress(*state)
+
+    def measure(self, rel_path, abs_path, allowed_special, cache, instrumentation, max_file_bytes, reducer=None, tokenizer=None):
+        """
+        measure_file with cancellation, progress and the memo: a file measured
+        by an earlier run of the same job is reused if its mtime and size still
+        match. Raises FileSkipped like measure_file.
+        """
+        self.check()
+        if self.memo is not None:
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                st = None
+            entry = self.memo.get(rel_path)
+            if st is not None and entry is not None and entry[0] == (st.st_mtime_ns, st.st_size):
+                result = entry[1]
+                self.advance(result[0], result[1])
+                return result
+        result = measure_file(abs_path, allowed_special, cache, instrumentation, max_file_bytes, reducer, tokenizer)
+        if self.memo is not None and st is not None:
+            # Without the array; a file that gets cut is encoded again on output.
+            self.memo[rel_path] = ((st.st_mtime_ns, st.st_size), result[:2] + (None, result[3]))
+        self.advance(result[0], result[1])
+        return result
+
+def _open_sink(write_to):
+    """Returns (writer, close) for a path or any object with a write() method."""
+    if isinstance(write_to, (str, os.PathLike)):
+        f = open(write_to, 'w', encoding='utf-8', newline='')
+        return f, f.close
+    return write_to, lambda: None
+
+def generate_prompt_data(root_dir, selected_paths, include_exts=None, exclude_paths=None, max_tokens=DEFAULT_MAX_TOKENS, allowed_special=None, cache=None, workers=DEFAULT_WORKERS, truncation=DEFAULT_TRUNCATION, write_to=None, instrumentation=None, max_file_bytes=DEFAULT_MAX_FILE_BYTES, estimate=False, progress=None, cancel_event=None, memo=None, special_tokens="error", split=False, reducer=None, tokenizer=None, template=None, template_input="", special_token_files=None):
+    """
+    Builds the prompt text for the selected files and copies it to the clipboard.
+
+    Files are read and tokenized by a pool of `workers` threads (tiktoken releases
+    the GIL while encoding). If a TokenCache is given, token counts of unchanged
+    files are taken from it instead of being re-encoded.
+
+    `truncation` names one of TRUNCATION_POLICIES and decides how files are cut
+    when the selection exceeds max_tokens. Token arrays from the counting pass
+    are reused for truncation, so no file is encoded twice.
+
+    The prompt is streamed section by section, holding one file's content at a
+    time. By default it is collected and copied to the clipboard. If `write_to`
+    is a path or a writable text stream (file, sys.stdout, socket.makefile('w')),
+    it is written there instead, nothing is copied and None is returned in place
+    of the text.
+
+    With estimate=True, oversized selections are planned from file sizes first
+    and only the content that will be emitted is encoded (see
+    _measure_estimated); the token limit still holds exactly.
+
+    Binary files, files over max_file_bytes (None for no limit) and unreadable
+    files are skipped and listed by reason in the summary.
+
+    If a profiling.Instrumentation is given, stage timings, counters and the
+    slowest files are recorded in it and appended to the summary.
+
+    For long runs, `progress` is called with (phase, files_done, files_total,
+    bytes_done, tokens_done) from worker threads, and setting the threading.Event
+    `cancel_event` makes the call raise JobCancelled soon after. Passing the same
+    dict as `memo` to a repeated call (e.g. after a special-token ValueError)
+    reuses every file measured before; it is only valid while allowed_special
+    stays the same or grows, since files that were encoded contain no special
+    tokens outside the set they were encoded with.
+
+    `special_tokens` decides what happens to special tokens (e.g. <|endoftext|>)
+    that aren't in allowed_special: "error" raises tiktoken's ValueError, "allow"
+    encodes them as special tokens, "text" encodes them as plain text and "skip"
+    leaves out the files that contain them (found with scan_special_tokens).
+    If the caller has scanned already, passing the flagged rel paths as
+    special_token_files skips the second scan.
+
+    With split=True, a selection over max_tokens is not truncated but packed
+    into several prompts ("parts") of at most max_tokens each, see _write_parts.
+    The text is then returned as a list with one string per part, of which the
+    first is copied to the clipboard. A write_to path containing "{part}" gets
+    one file per part; other sinks receive the parts one after another.
+    estimate is ignored, since packing needs exact counts.
+
+    A reducers.Reducer passed as `reducer` shrinks the file contents before
+    they are counted and emitted (whitespace, Python comments and docstrings,
+    outlines of large files, duplicate files); the tokens saved per reducer
+    are listed in the summary. It also turns off estimate.
+
+    `tokenizer` picks what counts and cuts the tokens: a tokenizers.BACKENDS
+    name, or None for the default tiktoken encoding (ENCODING_NAME). The
+    estimators there are much faster but only approximate, so max_tokens then
+    holds for the estimate rather than for the model's real tokenizer.
+
+    A templates.PromptTemplate passed as `template` wraps the prompt (each part,
+    when split), with template_input filled in for its {{input}} placeholder.
+    Its tokens are taken off max_tokens before the files are fitted, so the
+    filled-in template and the files together stay within the limit.
+    """
+    tokenizer_name = tokenizer if isinstance(tokenizer, str) else ENCODING_NAME if tokenizer is None else tokenizer.name
+    tokenizer = resolve_tokenizer(tokenizer)
+    if tokenizer is None:
+        return None, f"Error: tokenizer '{tokenizer_name}' is not available (tiktoken not installed, or its encoding could not be loaded)."
+    allowed_special = resolve_allowed_special(allowed_special, special_tokens, tokenizer)
+    job = _JobControl(progress, cancel_event, memo)
+    options = dict(root_dir=root_dir, selected_paths=selected_paths, include_exts=include_exts, exclude_paths=exclude_paths,
+                   max_tokens=max_tokens, allowed_special=allowed_special, cache=cache, workers=workers, truncation=truncation,
+                   write_to=write_to, max_file_bytes=max_file_bytes, estimate=estimate and not split and reducer is None,
+                   skip_special=special_tokens == "skip", special_token_files=special_token_files, split=split,
+                   reducer=reducer, tokenizer=tokenizer, template=template, template_input=template_input, job=job)
+    if instrumentation is None:
+        return _generate_prompt_data(**options, instrumentation=profiling.NULL)
+    with instrumentation.profiling():
+        text, summary = _generate_prompt_data(**options, instrumentation=instrumentation)
+    return text, summary + "\n" + "\n".join(instrumentation.summary_lines())
+
+def _map_workers(fn, items, workers, instrumentation=profiling.NULL):
+    """map() over a thread pool of `workers` threads, or inline for one worker."""
+    if workers > 1 and len(items) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(instrumentation.profiled(fn), items))
+    return [fn(item) for item in items]
+
+def _measure_estimated(abs_paths, max_tokens, allowed_special, cache, workers, truncation, max_file_bytes, instrumentation, action_summary, tokenizer, job):
+    """
+    Steps 1 and 2 of generate_prompt_data for estimate=True.
+
+    Token counts come from the cache where it has them; other files are
+    estimated from their size with a bytes-per-token ratio calibrated on those
+    cached files or, if there are too few, on a small sample that is encoded.
+    The policy's planner runs on the estimates with ESTIMATE_MARGIN headroom.
+    Files planned to get no tokens are never read or encoded. Files cut by a
+    head-keeping policy only have the prefix they can use encoded; other kept
+    files are encoded in full. The planner then runs again on these exact
+    counts, so the result never exceeds max_tokens.
+
+    Returns (file_stats, cache_hits, cache_misses, note) with the statuses and
+    current token counts of the rows already final.
+    """
+    plan, keep = TRUNCATION_POLICIES[truncation]
+    cache_hits = cache_misses = 0
+    entries = []  # [rel_path, abs_path, size, exact tokens or None, token_array, is_prefix]
+
+    def skip(rel_path, reason):
+        action_summary.append((reason, rel_path))
+
+    with instrumentation.stage("stat + sniff"):
+        for rel_path, abs_path in abs_paths:
+            job.check()
+            try:
+                try:
+                    st = os.stat(abs_path)
+                except OSError as e:
+                    raise FileSkipped("Read Error", str(e)) from None
+                if max_file_bytes is not None and st.st_size > max_file_bytes:
+                    raise FileSkipped("Too Large")
+                sniff_file(abs_path)
+            except FileSkipped as e:
+                skip(rel_path, e.reason)
+                continue
+            tokens = cache.get(abs_path, st, tokenizer.name, allowed_special) if cache is not None else None
+            if tokens is not None:
+                cache_hits += 1
+            entries.append([rel_path, abs_path, st.st_size, tokens, None, False])
+
+    def measure(entry):
+        try:
+            return job.measure(entry[0], entry[1], allowed_special, cache, instrumentation, max_file_bytes, tokenizer=tokenizer)
+        except FileSkipped as e:
+            return e.reason
+
+    def apply_measured(measured_entries, results):
+        nonlocal cache_hits, cache_misses
+        for entry, result in zip(measured_entries, results):
+            if isinstance(result, str):
+                skip(entry[0], result)
+                entry[3] = -1
+                continue
+            _, entry[3], entry[4], cache_hit = result
+            if cache_hit is True:
+                cache_hits += 1
+            elif cache_hit is False:
+                cache_misses += 1
+
+    # --- Calibrate the bytes-per-token ratio ---
+    if sum(e[3] for e in entries if e[3] is not None) < ESTIMATE_MIN_CALIBRATION_TOKENS:
+        candidates = [e for e in entries if e[3] is None and 0 < e[2] <= ESTIMATE_SAMPLE_MAX_BYTES]
+        sample = candidates[::max(1, len(candidates) // ESTIMATE_SAMPLE_FILES)][:ESTIMATE_SAMPLE_FILES]
+        with instrumentation.stage("estimate sample"):
+            apply_measured(sample, _map_workers(measure, sample, workers, instrumentation))
+        entries = [e for e in entries if e[3] != -1]
+    known = [e for e in entries if e[3] is not None]
+    known_tokens = sum(e[3] for e in known)
+    bytes_per_token = sum(e[2] for e in known) / known_tokens if known_tokens else DEFAULT_BYTES_PER_TOKEN
+
+    # --- Plan on the estimates ---
+    estimates = [e[3] if e[3] is not None else math.ceil(e[2] / bytes_per_token) for e in entries]
+    budget = max_tokens if len(known) == len(entries) else int(max_tokens * ESTIMATE_MARGIN)
+    total = sum(estimates)
+    planned = plan(estimates, total - budget) if total > budget else estimates
+
+    # --- Encode exactly what can be emitted ---
+    def encode_planned(i):
+        entry = entries[i]
+        if keep is _keep_head and planned[i] < estimates[i]:
+            job.check()
+            try:
+                with instrumentation.stage("read"):
+                    text = load_text(entry[1], max_file_bytes, instrumentation)
+            except FileSkipped as e:
+                return e.reason
+            # A cached count gives this file's own ratio; the average can be far off for it.
+            ratio = entry[2] / entry[3] if entry[3] else bytes_per_token
+            limit = int(planned[i] * ratio * ESTIMATE_MARGIN) + 64
+            while len(text) > limit:
+                with instrumentation.stage("encode prefix"):
+                    token_array = tokenizer.encode(text[:limit], allowed_special)
+                if len(token_array) >= planned[i]:
+                    job.advance(entry[2], len(token_array))
+                    return entry[2], len(token_array), token_array, "prefix"
+                # Too short for its share: retry with the ratio this prefix showed.
+                limit = int(limit * planned[i] / max(len(token_array), 1) * ESTIMATE_MARGIN) + 64
+            with instrumentation.stage("encode"):
+                token_array = tokenizer.encode(text, allowed_special)
+            job.advance(entry[2], len(token_array))
+            return entry[2], len(token_array), token_array, None
+        return measure(entry)
+
+    # Files known from the cache and kept whole are read only when emitted.
+    to_encode = [i for i, e in enumerate(entries) if planned[i] > 0 and e[4] is None and
+                 (e[3] is None or (keep is _keep_head and planned[i] < estimates[i]))]
+    job.start_phase("Counting tokens", len(to_encode))
+    with instrumentation.stage("measure (wall)"):
+        results = _map_workers(encode_planned, to_encode, workers, instrumentation)
+    for i, result in zip(to_encode, results):
+        entry = entries[i]
+        if isinstance(result, str):
+            skip(entry[0], result)
+            entry[3] = -1
+            continue
+        _, tokens, entry[4], flag = result
+        if flag == "prefix":
+            entry[5] = True
+        else:
+            entry[3] = tokens
+            if flag is True:
+                cache_hits += 1
+            elif flag is False:
+                cache_misses += 1
+    del results
+
+    # --- Plan again on exact counts ---
+    kept = [i for i, e in enumerate(entries) if e[3] != -1]
+    available = [0 if planned[i] == 0 else (len(entries[i][4]) if entries[i][5] else entries[i][3]) for i in kept]
+    total = sum(available)
+    final = plan(available, total - max_tokens) if total > max_tokens else available
+
+    file_stats = []
+    estimated = 0
+    for i, available_tokens, tokens in zip(kept, available, final):
+        rel_path, abs_path, size, exact, token_array, is_prefix = entries[i]
+        if exact is not None:
+            original, label = exact, f"{exact:,}"
+        else:
+            original = max(estimates[i], available_tokens)
+            label = f"~{original:,}"
+        if exact is None or is_prefix:
+            estimated += 1
+        row = [rel_path, size, original, tokens, abs_path, "", token_array]
+        if tokens < original or is_prefix:
+            row[5] = "Truncated"
+            action_summary.append(("Truncated", f"{rel_path} (from {label} to {tokens:,} tokens)"))
+        else:
+            row[6] = None
+        file_stats.append(row)
+    instrumentation.count("files not fully encoded", estimated)
+    note = f"Token estimate: {bytes_per_token:.2f} bytes/token, {estimated:,} file(s) not fully encoded"
+    return file_stats, cache_hits, cache_misses, note
+
+def _tree_paths(rel_paths):
+    """The given paths plus all their parent folders, as generate_tree_structure_string expects them."""
+    relevant_structure_paths = set()
+    for rel_path in rel_paths:
         relevant_structure_paths.add(rel_path)
         temp_path = rel_path
         while parent := os.path.dirname(temp_path):
             if parent == temp_path: break
             relevant_structure_paths.add(parent)
             temp_path = parent
-        
-        content = read_file_content(abs_path)
-        if content is None:
-            action_summary.append(("Read Error", rel_path))
-            continue
-        
-        # Pass the allowed tokens to the calculation
-        tokens = calculate_tokens(content, allowed_special_tokens=allowed_special)
-        file_stats.append([rel_path, os.path.getsize(abs_path), tokens, tokens, content, ""])
+    return relevant_structure_paths
 
-    if not file_stats:
-        return "", "No files selected or remaining after filters."
+def collect_paths(abs_root_dir, selected_paths):
+    """Returns the (rel_path, abs_path) pairs of the selected files that exist, and the paths to show in the tree."""
+    abs_paths = []
+    for rel_path in selected_paths:
+        abs_path = os.path.normpath(os.path.join(abs_root_dir, rel_path))
+        if not os.path.isfile(abs_path): continue
+        abs_paths.append((rel_path, abs_path))
+    return abs_paths, _tree_paths(rel for rel, _ in abs_paths)
 
-    # --- 2. Enforce Token Limit by Truncating ---
-    file_stats.sort(key=lambda x: x[2], reverse=True)
+def plan_truncation(file_stats, max_tokens, truncation, action_summary, instrumentation=profiling.NULL):
+    """Cuts file_stats rows down to max_tokens in place; only rows that get cut keep their token arrays."""
+    plan, _ = TRUNCATION_POLICIES[truncation]
     current_total_tokens = sum(item[3] for item in file_stats)
-
+    new_counts = [item[3] for item in file_stats]
     if current_total_tokens > max_tokens:
-        overflow = current_total_tokens - max_tokens
-        for i in range(len(file_stats)):
-            if overflow <= 0: break
-            
-            rel_path, _, original_tokens, current_tokens, content, _ = file_stats[i]
-            if current_tokens == 0: continue
-
-            tokens_to_remove = min(current_tokens, overflow)
-            new_token_count = current_tokens - tokens_to_remove
-
-            # --- MODIFIED: Pass allowed_special to encode calls ---
-            encoded_content = encoder.encode(content, allowed_special=allowed_special)
-            truncated_encoded_content = encoded_content[:new_token_count]
-            new_content = encoder.decode(truncated_encoded_content)
-            
-            file_stats[i][3] = new_token_count
-            file_stats[i][4] = new_content
-            file_stats[i][5] = "Truncated"
-            
-            action_summary.append(("Truncated", f"{rel_path} (from {original_tokens:,} to {new_token_count:,} tokens)"))
-            overflow -= tokens_to_remove
-    
-    # ... (Rest of the function is unchanged) ...
-    clipboard_chunks = []
+        with instrumentation.stage("truncation plan"):
+            new_counts = plan(new_counts, current_total_tokens - max_tokens)
+
+    # Truncated files are decoded from their token arrays on output.
+    for item, new_token_count in zip(file_stats, new_counts):
+        if new_token_count >= item[3]:
+            item[6] = None
+            continue
+        item[3] = new_token_count
+        item[5] = "Truncated"
+        action_summary.append(("Truncated", f"{item[0]} (from {item[2]:,} to {new_token_count:,} tokens)"))
+
+class _ArrayRelease:
+    """
+    Drops token arrays while files are measured, as soon as their file can't be
+    cut: only cut files are decoded from their arrays. The final total isn't
+    known until every file is counted, so files not measured yet are assumed to
+    have at most one token per byte. Should that ever be wrong, a cut file
+    without its array is simply encoded again on output.
+    """
+
+    def __init__(self, abs_paths, max_tokens, truncation):
+        self.max_tokens = max_tokens
+        self.largest_first = TRUNCATION_POLICIES[truncation][0] is _plan_largest_first
+        self._pending = {}  # rel_path -> size of the files not measured yet
+        for rel_path, abs_path in abs_paths:
+            try:
+                self._pending[rel_path] = os.stat(abs_path).st_size
+            except OSError:
+                self._pending[rel_path] = 0
+        self._counts = []  # tokens of the measured files
+        self._held = []    # heap of (tokens, n, result) for the results still holding an array
+        self._order = itertools.count()
+        self._unchecked = 0
+        self._lock = threading.Lock()
+
+    def add(self, rel_path, result):
+        """Records a measured file; result is a [size, tokens, token_array, cache_hit] list whose array may be dropped."""
+        with self._lock:
+            self._pending.pop(rel_path, None)
+            if result is None:  # skipped
+                return
+            self._counts.append(result[1])
+            if result[2] is None:
+                return
+            heapq.heappush(self._held, (result[1], next(self._order), result))
+            self._unchecked += result[1]
+            if self._unchecked >= RELEASE_CHECK_TOKENS:
+                self._release()
+
+    def finish(self):
+        with self._lock:
+            self._release()
+
+    def _release(self):
+        self._unchecked = 0
+        threshold = self._threshold()
+        while self._held and self._held[0][0] <= threshold:
+            heapq.heappop(self._held)[2][2] = None
+
+    def _threshold(self):
+        """The most tokens a file can have and still be certain not to be cut."""
+        pending = sorted(self._pending.values())
+        if sum(self._counts) + sum(pending) <= self.max_tokens:
+            return math.inf
+        if not self.largest_first:
+            return -1  # proportional cuts shrink every file
+        # largest_first cuts a file only if it and the files no larger than it exceed max_tokens together.
+        counts = sorted(self._counts)
+        count_sums = list(itertools.accumulate(counts, initial=0))
+        pending_sums = list(itertools.accumulate(pending, initial=0))
+
+        def at_most(tokens):
+            i = bisect.bisect_right(counts, tokens)
+            j = bisect.bisect_right(pending, tokens)
+            return count_sums[i] + pending_sums[j] + (len(pending) - j) * tokens
+        lo, hi = 0, len(counts)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if at_most(counts[mid]) <= self.max_tokens:
+                lo = mid + 1
+            else:
+                hi = mid
+        return counts[lo - 1] if lo else -1
+
+def build_summary_lines(selected_count, files, action_summary, max_tokens, destination):
+    """
+    The summary up to the token total, and that total. files are (rel_path,
+    size_bytes, tokens, status) of the emitted files; those whose status is a
+    SKIP_REASONS key are listed as skipped.
+    """
     included_files_details = []
     final_included_token_count = 0
-    file_stats.sort(key=lambda x: x[0])
-    for rel_path, size_bytes, _, current_tokens, content, _ in file_stats:
-        clipboard_chunks.append(f"--- {rel_path} ---\n{content}")
-        included_files_details.append((size_bytes, f" - {rel_path} | Size: {size_bytes:,} bytes | Tokens: {current_tokens:,}"))
-        final_included_token_count += current_tokens
-    try:
-        dir_structure_text = "Directory structure (showing relevant files/folders):\n" + \
-                             generate_tree_structure_string(root_dir, relevant_structure_paths, exclude_paths=exclude_paths)
-    except Exception as e:
-        print(f"Error generating tree structure string: {e}")
-        dir_structure_text = "Directory structure: (Error generating structure)"
-    combined_text = dir_structure_text + "\n\n" + "\n\n".join(clipboard_chunks)
-    summary_lines = [f"Processed {len(selected_paths)} files found in selection."]
     action_reasons = {}
     for reason, detail in action_summary:
         action_reasons.setdefault(reason, []).append(detail)
+    for rel_path, size_bytes, current_tokens, status in files:
+        if status in SKIP_REASONS:
+            action_reasons.setdefault(status, []).append(rel_path)
+            continue
+        included_files_details.append((size_bytes, f" - {rel_path} | Size: {size_bytes:,} bytes | Tokens: {current_tokens:,}"))
+        final_included_token_count += current_tokens
+    summary_lines = [f"Processed {selected_count} files found in selection."]
     if action_reasons:
         summary_lines.append("\nFile Actions Taken:")
         if "Truncated" in action_reasons:
             details = action_reasons["Truncated"]
             summary_lines.append(f"  - Truncated {len(details)} file(s) to fit {max_tokens:,} token limit:")
             for detail in sorted(details): summary_lines.append(f"    - {detail}")
-        if "Read Error" in action_reasons:
-            details = action_reasons["Read Error"]
-            summary_lines.append(f"  - Skipped {len(details)} file(s) due to read errors:")
+        if "Split" in action_reasons:
+            details = action_reasons["Split"]
+            summary_lines.append(f"  - Split {len(details)} file(s) on line boundaries to fit {max_tokens:,} tokens per part:")
             for detail in sorted(details): summary_lines.append(f"    - {detail}")
-    summary_lines.append("\nIncluded files in clipboard (sorted by size desc):")
+        summary_lines.extend(_skipped_summary_lines(action_reasons))
+    summary_lines.append(f"\nIncluded files in {destination} (sorted by size desc):")
     if included_files_details:
         included_files_details.sort(key=lambda x: x[0], reverse=True)
         summary_lines.extend([details for _, details in included_files_details])
     else:
         summary_lines.append("   (None)")
     summary_lines.append(f"\nTotal tokens copied: {final_included_token_count:,}")
-    if final_included_token_count > max_tokens:
+    return summary_lines, final_included_token_count
+
+def _skipped_summary_lines(action_reasons):
+    lines = []
+    for reason, description in SKIP_REASONS.items():
+        details = action_reasons.get(reason)
+        if details:
+            lines.append(f"  - Skipped {len(details)} file(s) due to {description}:")
+            for detail in sorted(details): lines.append(f"    - {detail}")
+    return lines
+
+def _generate_prompt_data(*, root_dir, selected_paths, include_exts, exclude_paths, max_tokens, allowed_special, cache, workers, truncation, write_to, max_file_bytes, estimate, skip_special, special_token_files, split, reducer, tokenizer, template, template_input, job, instrumentation):
+    if truncation not in TRUNCATION_POLICIES:
+        raise ValueError(f"Unknown truncation policy '{truncation}'.")
+    template_line = None
+    if template is not None:
+        template_tokens = template.cost(tokenizer, template_input)
+        if template_tokens >= max_tokens:
+            raise ValueError(f"Max tokens ({max_tokens:,}) leaves no room for files after template '{template.name}' ({template_tokens:,} tokens).")
+        template_line = f"Template '{template.name}': {template_tokens:,} tokens, leaving {max_tokens - template_tokens:,} of {max_tokens:,} for the files"
+        max_tokens -= template_tokens
+
+    allowed_special = allowed_special or set()
+    cache_hits = cache_misses = 0
+    estimate_note = None
+    file_stats = []
+    action_summary = []
+    abs_root_dir = os.path.abspath(root_dir)
+
+    # --- 1. Filter and Collect Stats ---
+    abs_paths, relevant_structure_paths = collect_paths(abs_root_dir, selected_paths)
+
+    if skip_special:
+        if special_token_files is not None:
+            flagged = set(special_token_files)
+        else:
+            with instrumentation.stage("special token scan"):
+                found = scan_special_tokens(abs_root_dir, [rel for rel, _ in abs_paths], allowed_special, workers, max_file_bytes,
+                                            job.progress, job.cancel_event, tokenizer, instrumentation)
+            flagged = {rel_path for files in found.values() for rel_path in files}
+        for rel_path in sorted(flagged):
+            action_summary.append(("Special Tokens", rel_path))
+        abs_paths = [item for item in abs_paths if item[0] not in flagged]
+
+    if estimate:
+        file_stats, cache_hits, cache_misses, estimate_note = _measure_estimated(
+            abs_paths, max_tokens, allowed_special, cache, workers, truncation, max_file_bytes, instrumentation, action_summary, tokenizer, job)
+    else:
+        # Files are read and encoded concurrently; map() keeps the selection order.
+        # Split prompts never decode arrays; otherwise only files that can still be cut keep theirs.
+        job.start_phase("Counting tokens", len(abs_paths))
+        release = None if split else _ArrayRelease(abs_paths, max_tokens, truncation)
+
+        def measure(item):
+            start = time.perf_counter()
+            try:
+                result = list(job.measure(item[0], item[1], allowed_special, cache, instrumentation, max_file_bytes, reducer, tokenizer))
+            except FileSkipped as e:
+                job.advance()
+                result = e.reason
+            if release is not None:
+                release.add(item[0], None if isinstance(result, str) else result)
+            elif not isinstance(result, str):
+                result[2] = None
+            instrumentation.record_file("measure", item[0], time.perf_counter() - start)
+            return result
+        with instrumentation.stage("measure (wall)"):
+            results = _map_workers(measure, abs_paths, workers, instrumentation)
+        if release is not None:
+            release.finish()
+
+        for (rel_path, abs_path), result in zip(abs_paths, results):
+            if isinstance(result, str):
+                action_summary.append((result, rel_path))
+                continue
+            size_bytes, tokens, token_array, cache_hit = result
+            if cache_hit is True:
+                cache_hits += 1
+            elif cache_hit is False:
+                cache_misses += 1
+            file_stats.append([rel_path, size_bytes, tokens, tokens, abs_path, "", token_array])
+        del results
+
+    if reducer is not None and reducer.dedupe:
+        duplicates = reducer.find_duplicates(sorted((item[0], item[4]) for item in file_stats))
+        for item in file_stats:
+            if item[4] in duplicates:
+                tokens = tokenizer.count(reducer.duplicate_text(item[4]), allowed_special)
+                reducer.record({"dedupe": item[3] - tokens})
+                item[2] = item[3] = tokens
+                item[6] = None
+    instrumentation.count("files measured", len(file_stats))
+    if cache is not None:
+        instrumentation.count("cache hits", cache_hits)
+        with instrumentation.stage("cache save"):
+            cache.save()
+
+    if not file_stats:
+        action_reasons = {}
+        for reason, detail in action_summary:
+            action_reasons.setdefault(reason, []).append(detail)
+        return ([] if split else ""), "\n".join(["No files selected or remaining after filters."] + _skipped_summary_lines(action_reasons))
+
+    split_parts = split and sum(item[3] for item in file_stats) > max_tokens
+    if split_parts:
+        # --- 2 and 3. Pack the Files into Parts and Write Them ---
+        file_stats.sort(key=lambda x: x[0])
+        texts, part_lines = _write_parts(root_dir, file_stats, max_tokens, allowed_special, exclude_paths, write_to, max_file_bytes, instrumentation, job, action_summary, reducer, tokenizer, template, template_input)
+    else:
+        # --- 2. Enforce Token Limit by Truncating ---
+        # (Estimation mode has already planned the cuts on exact counts.)
+        if not estimate:
+            plan_truncation(file_stats, max_tokens, truncation, action_summary, instrumentation)
+
+        # --- 3. Stream the Prompt to its Sink ---
+        file_stats.sort(key=lambda x: x[0])
+        if split and isinstance(write_to, (str, os.PathLike)):
+            write_to = os.fspath(write_to).replace(PART_PLACEHOLDER, "1")  # it all fits in part 1
+        buffer = io.StringIO() if write_to is None else None
+        writer, close = _open_sink(write_to) if write_to is not None else (buffer, lambda: None)
+        try:
+            job.start_phase("Writing prompt", len(file_stats))
+            with instrumentation.stage("assemble (wall)"):
+                chunks = iter_prompt_chunks(root_dir, file_stats, relevant_structure_paths, exclude_paths, allowed_special, truncation, instrumentation, max_file_bytes, job, reducer, tokenizer)
+                if template is not None:
+                    chunks = template.render(template_input, chunks)
+                for chunk in chunks:
+                    writer.write(chunk)
+            job.finish_phase()
+        finally:
+            close()
+
+    summary_lines, final_included_token_count = build_summary_lines(
+        len(selected_paths), ((item[0], item[1], item[3], item[5]) for item in file_stats), action_summary, max_tokens,
+        "clipboard" if write_to is None else "output")
+    if cache is not None and reducer is None:  # reduced contents bypass the TokenCache
+        summary_lines.append(f"Token cache: {cache_hits:,} hit(s), {cache_misses:,} miss(es)")
+    if estimate_note:
+        summary_lines.append(estimate_note)
+    if not tokenizer.exact:
+        summary_lines.append(ESTIMATED_COUNTS_NOTE.format(tokenizer=tokenizer.name))
+    if template_line:
+        summary_lines.append(template_line)
+    if reducer is not None:
+        summary_lines.extend(reducer.summary_lines())
+    if split_parts:
+        summary_lines.extend(part_lines)
+    elif final_included_token_count > max_tokens:
          summary_lines.append(f"WARNING: Final token count ({final_included_token_count:,}) still exceeds limit ({max_tokens:,})!")
+
+    if write_to is not None:
+        target = write_to if isinstance(write_to, (str, os.PathLike)) else getattr(write_to, 'name', 'stream')
+        summary_lines.append(f"\n--- Written to {target} ---")
+        return None, "\n".join(summary_lines)
+
+    if not split_parts:
+        texts = [buffer.getvalue()]
+        buffer.close()
     try:
-        pyperclip.copy(combined_text)
-        summary_lines.append(f"\n--- Copied to clipboard! ---")
+        with instrumentation.stage("clipboard"):
+            copy_to_clipboard(texts[0])
+        if split_parts:
+            summary_lines.append(f"\n--- Part 1 of {len(texts)} copied to clipboard! ---")
+        else:
+            summary_lines.append(f"\n--- Copied to clipboard! ---")
     except Exception as e:
         error_detail = f"{e} (Is 'xclip' or 'xsel' installed on Linux?)"
         summary_lines.append(f"\n--- ERROR: Could not copy to clipboard: {error_detail} ---")
-    return combined_text, "\n".join(summary_lines)
\ No newline at end of file
+    return (texts if split else texts[0]), "\n".join(summary_lines)
+
+def copy_to_clipboard(text):
+    """Copies text to the system clipboard; raises if no clipboard is available."""
+    import pyperclip  # imported on first use; runs that write to a file never need it
+    pyperclip.copy(text)
+
+# --- Splitting into parts ---
+PART_HEADER = "[Part {part} of {parts}]\n"
+PART_PLACEHOLDER = "{part}"  # in a write_to path, gives every part its own file
+
+def pack_parts(sizes, capacity):
+    """
+    Packs items into as few parts of `capacity` as it can, best fit decreasing:
+    each item, largest first, goes into the part with the least room that still
+    fits it. Returns lists of indices into sizes, in index order, with the parts
+    ordered by their first index. An item larger than capacity gets a part of its
+    own. Runs in O(n log n) apart from keeping the short list of parts sorted.
+    """
+    parts = []
+    free = []  # sorted (room left, part number)
+    for i in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+        size = sizes[i]
+        pos = bisect.bisect_left(free, (size, -1))
+        if pos < len(free):
+            room, part = free.pop(pos)
+            parts[part].append(i)
+            bisect.insort(free, (room - size, part))
+        else:
+            parts.append([i])
+            bisect.insort(free, (capacity - size, len(parts) - 1))
+    for part in parts:
+        part.sort()
+    parts.sort(key=lambda part: part[0])
+    return parts
+
+def _split_lines(text):
+    """The lines of text, each with its \\n except maybe the last."""
+    lines = text.split('\n')
+    return [line + '\n' for line in lines[:-1]] + ([lines[-1]] if lines[-1] else [])
+
+def split_on_lines(text, capacity, allowed_special=None, tokenizer=None):
+    """
+    Cuts text into pieces of at most `capacity` tokens, only between lines.
+    Returns [(first_line, last_line, piece_text)] with 1-based line numbers. A
+    single line longer than capacity is cut on token boundaries. Tokens are
+    counted line by line, which in practice is never less than the count of the
+    joined piece.
+    """
+    tokenizer = resolve_tokenizer(tokenizer)
+    pieces = []
+    current, current_tokens, first_line = [], 0, 1
+    for number, line in enumerate(_split_lines(text), 1):
+        tokens = tokenizer.count(line, allowed_special)
+        if current and current_tokens + tokens > capacity:
+            pieces.append((first_line, number - 1, "".join(current)))
+            current, current_tokens, first_line = [], 0, number
+        if tokens > capacity:
+            token_array = tokenizer.encode(line, allowed_special)
+            for start in range(0, len(token_array), capacity):
+                pieces.append((number, number, tokenizer.decode(token_array[start:start + capacity])))
+            first_line = number + 1
+            continue
+        current.append(line)
+        current_tokens += tokens
+    if current:
+        pieces.append((first_line, first_line + len(current) - 1, "".join(current)))
+    return pieces
+
+def section_header(rel_path, piece=None):
+    if piece is None:
+        return f"\n\n--- {rel_path} ---\n"
+    index, count, first_line, last_line = piece
+    return f"\n\n--- {rel_path} (lines {first_line}-{last_line}, piece {index} of {count}) ---\n"
+
+def _tree_overhead(rel_path, tokenizer):
+    """Tokens the file can add to a part's directory tree at most (its own and its folders' lines)."""
+    return tokenizer.count("".join(f"\n{'│   ' * depth}├── {name}/" for depth, name in enumerate(rel_path.split('/'))))
+
+def _iter_part_chunks(root_dir, items, part, parts, exclude_paths, allowed_special, max_file_bytes, instrumentation, job, reducer, tokenizer):
+    """Like iter_prompt_chunks for one part; items are (file_stats row, piece, piece_text or None)."""
+    if parts > 1:
+        yield PART_HEADER.format(part=part, parts=parts)
+    try:
+        with instrumentation.stage("tree"):
+            yield tree_section(root_dir, _tree_paths(row[0] for row, _, _ in items), exclude_paths)
+    except Exception as e:
+        print(f"Error generating tree structure string: {e}")
+        yield TREE_ERROR_SECTION
+    for row, piece, text in items:
+        job.check()
+        job.advance(row[1] if piece is None else 0, row[3] if piece is None else 0)
+        if text is None:
+            try:
+                with instrumentation.stage("output read"):
+                    text = _output_text(row[4], allowed_special, max_file_bytes, instrumentation, reducer, tokenizer)
+            except FileSkipped as e:
+                row[5] = e.reason
+                continue
+        yield section_header(row[0], piece)
+        yield text
+
+def _write_parts(root_dir, file_stats, max_tokens, allowed_special, exclude_paths, write_to, max_file_bytes, instrumentation, job, action_summary, reducer, tokenizer, template=None, template_input=""):
+    """
+    Steps 2 and 3 of generate_prompt_data for split=True.
+
+    Every file_stats row (sorted by path) becomes one item, or several line-bounded
+    pieces if it doesn't fit a part on its own. Item sizes include an upper bound
+    for the section header and tree lines they add, and each part's budget leaves
+    room for its part header, so parts stay within max_tokens. The items are
+    packed with pack_parts and each part gets its own directory tree and, if
+    given, its own copy of the template (whose tokens max_tokens excludes).
+
+    Returns (texts, summary lines); texts is None when written to write_to.
+    """
+    root_name = os.path.basename(os.path.abspath(root_dir))
+    capacity = max_tokens - tokenizer.count(PART_HEADER.format(part=999, parts=999) + tree_section(root_dir, ()) + root_name + "/")
+    items, sizes = [], []
+    with instrumentation.stage("split"):
+        for row in file_stats:
+            rel_path, _, tokens, _, abs_path, _, _ = row
+            row[6] = None
+            overhead = tokenizer.count(section_header(rel_path)) + _tree_overhead(rel_path, tokenizer)
+            if tokens + overhead <= capacity:
+                items.append((row, None, None))
+                sizes.append(tokens + overhead)
+                continue
+            overhead = tokenizer.count(section_header(rel_path, (999, 999, 9999999, 9999999))) + _tree_overhead(rel_path, tokenizer)
+            if capacity - overhead < 1:
+                raise ValueError(f"Max tokens ({max_tokens:,}) is too small to split '{rel_path}' into parts.")
+            try:
+                content = _output_text(abs_path, allowed_special, max_file_bytes, instrumentation, reducer, tokenizer)
+            except FileSkipped as e:
+                row[5] = e.reason
+                continue
+            pieces = split_on_lines(content, capacity - overhead, allowed_special, tokenizer)
+            del content
+            for index, (first_line, last_line, text) in enumerate(pieces, 1):
+                items.append((row, (index, len(pieces), first_line, last_line), text))
+                sizes.append(tokenizer.count(text, allowed_special) + overhead)
+            action_summary.append(("Split", f"{rel_path} ({tokens:,} tokens) into {len(pieces)} pieces"))
+    with instrumentation.stage("pack"):
+        parts = pack_parts(sizes, capacity)
+
+    texts = [] if write_to is None else None
+    per_part_files = isinstance(write_to, (str, os.PathLike)) and PART_PLACEHOLDER in os.fspath(write_to)
+    writer, close = (None, lambda: None) if write_to is None or per_part_files else _open_sink(write_to)
+    summary_lines = [f"\nSplit into {len(parts)} part(s) of at most {max_tokens:,} tokens:"]
+    try:
+        job.start_phase("Writing prompt", len(items))
+        with instrumentation.stage("assemble (wall)"):
+            for number, part in enumerate(parts, 1):
+                chunks = _iter_part_chunks(root_dir, [items[i] for i in part], number, len(parts), exclude_paths, allowed_special, max_file_bytes, instrumentation, job, reducer, tokenizer)
+                if template is not None:
+                    chunks = template.render(template_input, chunks)
+                if write_to is None:
+                    texts.append("".join(chunks))
+                elif per_part_files:
+                    part_writer, part_close = _open_sink(os.fspath(write_to).replace(PART_PLACEHOLDER, str(number)))
+                    try:
+                        for chunk in chunks: part_writer.write(chunk)
+                    finally:
+                        part_close()
+                else:
+                    if number > 1: writer.write("\n\n")
+                    for chunk in chunks: writer.write(chunk)
+                summary_lines.append(f"  - Part {number}: {len(part)} file(s) or piece(s), up to {sum(sizes[i] for i in part):,} tokens")
+        job.finish_phase()
+    finally:
+        close()
+    return texts, summary_lines
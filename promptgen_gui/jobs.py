@@ -0,0 +1,93 @@
+# promptgen_gui/jobs.py
+import threading
+
+from . import core
+
+
+class SpecialTokensFound(Exception):
+    """Raised by CopyJob.run when the pre-scan found special tokens; `found` is scan_special_tokens' result."""
+
+    def __init__(self, found):
+        super().__init__(f"Found {len(found)} disallowed special token(s).")
+        self.found = found
+
+
+class CopyJob:
+    """
+    One prompt generation that runs in the background, reports progress and can
+    be cancelled or resumed.
+
+    `options` are passed on to core.generate_prompt_data. on_progress(phase,
+    files_done, files_total, bytes_done, tokens_done) is called from worker
+    threads. If a run stops on a disallowed special token, allow it with
+    allow_special_token() and start the job again: files measured by the
+    earlier run are reused, so only the remaining ones are read and encoded.
+
+    Unless special_tokens is given (see generate_prompt_data), the selection is
+    first scanned for special tokens and SpecialTokensFound is raised with all
+    of them; set special_tokens to the user's decision and start the job again.
+    """
+
+    def __init__(self, root_dir, selected_paths, on_progress=None, allowed_special=None, special_tokens=None, **options):
+        self.root_dir = root_dir
+        self.selected_paths = selected_paths
+        self.on_progress = on_progress
+        self.allowed_special = set(allowed_special or ())
+        self.special_tokens = special_tokens
+        self.special_token_files = None  # flagged by the pre-scan, so "skip" needn't scan again
+        self.options = options
+        self.cancel_event = threading.Event()
+        self.memo = {}  # rel_path -> ((mtime_ns, size), measure_file result without its token array)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def allow_special_token(self, token):
+        self.allowed_special.add(token)
+
+    def run(self):
+        """
+        Runs (or resumes) the job and returns generate_prompt_data's result.
+        Raises JobCancelled, SpecialTokensFound, or ValueError for a special
+        token that appeared after the scan.
+        """
+        if self.special_tokens is None:
+            found = core.scan_special_tokens(
+                self.root_dir, self.selected_paths, self.allowed_special,
+                workers=self.options.get("workers", core.DEFAULT_WORKERS),
+                max_file_bytes=self.options.get("max_file_bytes", core.DEFAULT_MAX_FILE_BYTES),
+                progress=self.on_progress, cancel_event=self.cancel_event,
+                tokenizer=self.options.get("tokenizer")
+            )
+            if found:
+                self.special_token_files = {rel_path for files in found.values() for rel_path in files}
+                raise SpecialTokensFound(found)
+            self.special_tokens = "error"
+        result = core.generate_prompt_data(
+            self.root_dir, self.selected_paths, allowed_special=self.allowed_special,
+            progress=self.on_progress, cancel_event=self.cancel_event, memo=self.memo,
+            special_tokens=self.special_tokens, special_token_files=self.special_token_files, **self.options
+        )
+        self.memo.clear()
+        return result
+
+    def start(self, on_finished):
+        """Runs the job on a daemon thread and calls on_finished(result, error) there."""
+        def target():
+            try:
+                result = self.run()
+            except Exception as e:
+                on_finished(None, e)
+                return
+            on_finished(result, None)
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
@@ -0,0 +1,177 @@
+# promptgen_gui/profiling.py
+import cProfile
+import heapq
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_SLOWEST = 10
+
+
+class Instrumentation:
+    """
+    Collects timings and counters from one scan or prompt generation.
+
+    Pass an instance as `instrumentation=` to core.generate_prompt_data or
+    utils.scan_directory. Stage times are summed over all calls, so stages that
+    run on worker threads (read, encode) can add up to more than the wall time.
+    The slowest files are kept per stage. If profile_path is set, the run is
+    also profiled with cProfile and the stats are dumped there; functions run
+    on worker threads through profiled() get a profiler per thread, whose
+    stats are merged into the same dump.
+
+    as_dict() returns everything as plain data; summary_lines() formats it for
+    the summary log. Safe to use from worker threads.
+    """
+
+    def __init__(self, slowest=DEFAULT_SLOWEST, profile_path=None):
+        self.slowest = slowest
+        self.profile_path = profile_path
+        self.stages = {}    # name -> [seconds, calls]
+        self.counters = {}  # name -> value
+        self.files = {}     # stage -> heap of (seconds, rel_path)
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._profiling = False
+        self._profiling_thread = None
+        self._thread_profilers = []
+        self._local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(name, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_file(self, stage, rel_path, seconds):
+        """Remembers rel_path if it is among the slowest files of a stage."""
+        with self._lock:
+            heap = self.files.setdefault(stage, [])
+            if len(heap) < self.slowest:
+                heapq.heappush(heap, (seconds, rel_path))
+            elif seconds > heap[0][0]:
+                heapq.heapreplace(heap, (seconds, rel_path))
+
+    @contextmanager
+    def profiling(self):
+        """
+        Runs the block under cProfile if a profile_path was given. Stats of
+        successive blocks (e.g. a scan, then a generation) accumulate in one file.
+        """
+        if not self.profile_path or self._profiling:
+            yield
+            return
+        if self._profiler is None:
+            self._profiler = cProfile.Profile()
+        self._profiling = True
+        self._profiling_thread = threading.get_ident()
+        self._profiler.enable()
+        try:
+            yield
+        finally:
+            self._profiler.disable()
+            self._profiling = False
+            try:
+                stats = pstats.Stats(self._profiler)
+                with self._lock:
+                    for profiler in self._thread_profilers:
+                        stats.add(profiler)
+                stats.dump_stats(self.profile_path)
+            except OSError as e:
+                print(f"Warning: Could not write profile to '{self.profile_path}': {e}")
+
+    def profiled(self, fn):
+        """
+        Returns fn wrapped for use on worker threads: inside a profiling()
+        block, each thread's calls are profiled by a cProfile of its own (a
+        profiler only sees its own thread). Outside one, fn is returned as is.
+        """
+        if not self._profiling:
+            return fn
+
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() == self._profiling_thread:
+                return fn(*args, **kwargs)  # run inline; the main profiler sees it
+            profiler = getattr(self._local, "profiler", None)
+            if profiler is None:
+                profiler = self._local.profiler = cProfile.Profile()
+                with self._lock:
+                    self._thread_profilers.append(profiler)
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one cProfile per process, which then sees every thread.
+                return fn(*args, **kwargs)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.disable()
+        return wrapper
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "stages": {name: {"seconds": seconds, "calls": calls} for name, (seconds, calls) in self.stages.items()},
+                "counters": dict(self.counters),
+                "slowest_files": {stage: [{"path": path, "seconds": seconds} for seconds, path in sorted(heap, reverse=True)]
+                                  for stage, heap in self.files.items()},
+                "profile_path": self.profile_path,
+            }
+
+    def summary_lines(self):
+        data = self.as_dict()
+        lines = ["\nTimings:"]
+        for name, stage in data["stages"].items():
+            calls = f" ({stage['calls']:,} calls)" if stage["calls"] > 1 else ""
+            lines.append(f"  - {name}: {stage['seconds'] * 1000:,.1f} ms{calls}")
+        if data["counters"]:
+            lines.append("Counters:")
+            for name, value in data["counters"].items():
+                lines.append(f"  - {name}: {value:,}")
+        for stage, files in data["slowest_files"].items():
+            lines.append(f"Slowest files ({stage}):")
+            for f in files:
+                lines.append(f"  - {f['path']}: {f['seconds'] * 1000:,.1f} ms")
+        if self.profile_path:
+            lines.append(f"cProfile stats written to {self.profile_path}")
+        return lines
+
+
+class _NullInstrumentation:
+    """Stand-in used when no instrumentation is requested; every call is a no-op."""
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def record_file(self, stage, rel_path, seconds):
+        pass
+
+    @contextmanager
+    def profiling(self):
+        yield
+
+    def profiled(self, fn):
+        return fn
+
+
+NULL = _NullInstrumentation()
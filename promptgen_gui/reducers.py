@@ -0,0 +1,240 @@
+# promptgen_gui/reducers.py
+import ast
+import io
+import os
+import re
+import threading
+import tokenize
+from collections import OrderedDict
+
+from .cache import content_digest
+
+# Applied in this order, whichever are enabled.
+MODES = ("whitespace", "comments", "outline")
+PYTHON_EXTS = (".py", ".pyw", ".pyi")
+DEFAULT_OUTLINE_MIN_BYTES = 32 * 1024  # smaller files are kept whole
+DEFAULT_CACHE_MAX_CHARS = 64 * 1024 * 1024
+CACHE_ENTRY_CHARS = 64  # what an entry costs on top of its text, so count-only entries are bounded too
+DUPLICATE_TEXT = "(identical to {original})\n"
+
+_TRAILING_SPACE = re.compile(r"[ \t]+$", re.MULTILINE)
+_BLANK_RUNS = re.compile(r"\n{3,}")
+
+
+def collapse_whitespace(text, abs_path):
+    """Strips trailing whitespace and collapses runs of blank lines into one."""
+    return _BLANK_RUNS.sub("\n\n", _TRAILING_SPACE.sub("", text))
+
+
+def _docstring_nodes(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)) and node.body:
+            first = node.body[0]
+            if isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str):
+                yield node, first
+
+
+def strip_python_comments(text, abs_path):
+    """
+    Removes comments and docstrings from Python files; other files and files
+    that don't parse are returned unchanged. A body that only had a docstring
+    gets `...` instead, so the code stays valid.
+    """
+    if not abs_path.endswith(PYTHON_EXTS):
+        return text
+    try:
+        tree = ast.parse(text)
+        comments = [tok.start for tok in tokenize.generate_tokens(io.StringIO(text).readline) if tok.type == tokenize.COMMENT]
+    except (SyntaxError, ValueError, tokenize.TokenError):
+        return text
+    lines = text.splitlines(keepends=True)
+    for row, col in comments:
+        line = lines[row - 1]
+        code = line[:col].rstrip()
+        lines[row - 1] = code + "\n" if code else None
+    for parent, doc in _docstring_nodes(tree):
+        first, last = doc.lineno, doc.end_lineno
+        if lines[first - 1] is None or lines[first - 1][:doc.col_offset].strip():
+            continue  # shares its line with other code
+        indent = lines[first - 1][:doc.col_offset]
+        for row in range(first, last + 1):
+            lines[row - 1] = None
+        if len(parent.body) == 1 and not isinstance(parent, ast.Module):
+            lines[first - 1] = indent + "...\n"
+    return "".join(line for line in lines if line is not None)
+
+
+def outline_python(text, abs_path, min_bytes=DEFAULT_OUTLINE_MIN_BYTES):
+    """
+    Shrinks a large Python file to its imports and class and function
+    signatures. Files under min_bytes, other languages and files that don't
+    parse are returned unchanged.
+    """
+    if len(text) < min_bytes or not abs_path.endswith(PYTHON_EXTS):
+        return text
+    try:
+        tree = ast.parse(text)
+    except (SyntaxError, ValueError):
+        return text
+    lines = text.splitlines()
+    out = [f"# Outline: imports and signatures only ({len(lines):,} lines in full)"]
+
+    def header(node):
+        start = min([d.lineno for d in node.decorator_list] + [node.lineno])
+        end = max(node.body[0].lineno - 1, node.lineno)
+        return lines[start - 1:end]
+
+    def visit(body, depth):
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)) and depth == 0:
+                out.extend(lines[node.lineno - 1:node.end_lineno])
+            elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                out.extend(header(node))
+                out.append("    " * (depth + 1) + "...")
+            elif isinstance(node, ast.ClassDef):
+                out.extend(header(node))
+                before = len(out)
+                visit(node.body, depth + 1)
+                if len(out) == before:
+                    out.append("    " * (depth + 1) + "...")
+    visit(tree.body, 0)
+    return "\n".join(out) + "\n"
+
+
+class ReductionCache:
+    """
+    Reduced texts and their token counts by content hash, so files that didn't
+    change aren't reduced or encoded again. Entries for content no reducer
+    changed hold None instead of the text, which the caller still has. Keeps
+    the most recently used entries up to max_chars. Safe to share between
+    threads and runs.
+    """
+
+    def __init__(self, max_chars=DEFAULT_CACHE_MAX_CHARS):
+        self.max_chars = max_chars
+        self._entries = OrderedDict()  # key -> (text or None, tokens, saved)
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    @staticmethod
+    def _size(entry):
+        return CACHE_ENTRY_CHARS + (len(entry[0]) if entry[0] is not None else 0)
+
+    def put(self, key, entry):
+        if self._size(entry) > self.max_chars:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._chars -= self._size(old)
+            self._entries[key] = entry
+            self._chars += self._size(entry)
+            while self._chars > self.max_chars:
+                _, evicted = self._entries.popitem(last=False)
+                self._chars -= self._size(evicted)
+
+
+class Reducer:
+    """
+    The reducers chosen for one prompt generation, and what they saved.
+
+    Pass an instance as `reducer=` to core.generate_prompt_data. `modes` picks
+    from MODES; with dedupe=True, files whose content is identical to an earlier
+    one (by path) are emitted as a reference to it. Reduced texts are kept in
+    `cache`; pass the same ReductionCache to later runs to reuse them.
+    """
+
+    def __init__(self, modes=(), dedupe=False, outline_min_bytes=DEFAULT_OUTLINE_MIN_BYTES, cache=None):
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise ValueError(f"Unknown reducer(s): {', '.join(sorted(unknown))}.")
+        self.modes = tuple(mode for mode in MODES if mode in modes)
+        self.dedupe = dedupe
+        self.outline_min_bytes = outline_min_bytes
+        self.cache = cache if cache is not None else ReductionCache()
+        self.saved = {}       # mode or "dedupe" -> tokens saved
+        self.digests = {}     # abs_path -> content digest, for dedupe
+        self.duplicates = {}  # abs_path -> rel_path of the copy that is emitted
+        self._lock = threading.Lock()
+        self._functions = {
+            "whitespace": collapse_whitespace,
+            "comments": strip_python_comments,
+            "outline": lambda text, abs_path: outline_python(text, abs_path, self.outline_min_bytes),
+        }
+
+    def reduce(self, abs_path, text, encode, context=""):
+        """
+        Returns (reduced_text, token_array, tokens, saved) for a file's content.
+        encode(text) must return the token ids; context should identify anything
+        else that changes the count (e.g. the allowed special tokens). On a cache
+        hit token_array is None. saved maps each mode to the tokens it removed.
+        """
+        digest = content_digest(text)
+        if self.dedupe:
+            self.digests[abs_path] = digest
+        key = (digest, os.path.splitext(abs_path)[1].lower(), self.modes, self.outline_min_bytes, context)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return (text if entry[0] is None else entry[0]), None, entry[1], entry[2]
+        original = text
+        steps = []  # (mode, text) for every mode that changed the text
+        for mode in self.modes:
+            reduced = self._functions[mode](text, abs_path)
+            if reduced != text:
+                steps.append((mode, reduced))
+                text = reduced
+        # Each text is encoded once; the last array is the one returned.
+        token_array = encode(original)
+        saved = {}
+        for mode, reduced in steps:
+            reduced_array = encode(reduced)
+            saved[mode] = len(token_array) - len(reduced_array)
+            token_array = reduced_array
+        self.cache.put(key, (None if text is original else text, len(token_array), saved))
+        return text, token_array, len(token_array), saved
+
+    def record(self, saved):
+        with self._lock:
+            for mode, tokens in saved.items():
+                self.saved[mode] = self.saved.get(mode, 0) + tokens
+
+    def find_duplicates(self, files):
+        """
+        Given (rel_path, abs_path) pairs in output order, remembers every file
+        whose content matches an earlier one and returns {abs_path: rel_path of
+        that earlier file}. A resumed job calls this again, so earlier results
+        are dropped first.
+        """
+        self.duplicates = {}
+        self.saved.pop("dedupe", None)
+        first_by_digest = {}
+        for rel_path, abs_path in files:
+            digest = self.digests.get(abs_path)
+            if digest is None:
+                continue
+            original = first_by_digest.setdefault(digest, rel_path)
+            if original != rel_path:
+                self.duplicates[abs_path] = original
+        return self.duplicates
+
+    def duplicate_text(self, abs_path):
+        return DUPLICATE_TEXT.format(original=self.duplicates[abs_path])
+
+    def summary_lines(self):
+        if not self.saved:
+            return []
+        lines = [f"Reducers saved {sum(self.saved.values()):,} tokens:"]
+        for mode in MODES + ("dedupe",):
+            if mode not in self.saved:
+                continue
+            tokens = self.saved[mode]
+            detail = f" ({len(self.duplicates):,} duplicate file(s))" if mode == "dedupe" else ""
+            lines.append(f"  - {mode}: {tokens:,}{detail}")
+        return lines
@@ -0,0 +1,264 @@
+# promptgen_gui/selection.py
+import bisect
+import re
+from array import array
+
+CHECKED = "checked"
+UNCHECKED = "unchecked"
+PARTIAL = "partial"
+
+_SET_FLAG = re.compile(b"\x01")
+
+
+class SelectionModel:
+    """
+    Check state of every scanned file and folder, independent of the Treeview.
+
+    Paths are interned to integer ids; parents, types and flags live in flat
+    arrays. Each folder keeps the number of files below it and how many of those
+    are checked, so a folder's tri-state is O(1), toggling a file is O(depth) and
+    toggling a folder is a tight loop over its subtree plus O(depth). Removed
+    paths leave tombstones until the model is rebuilt on the next full scan.
+
+    Token counts are tracked the same way: files start unknown (-1) and every
+    folder rolls up the known tokens below it, in total and for checked files,
+    so the selected token total is always available in O(1).
+    """
+
+    def __init__(self):
+        self.paths = []               # id -> rel_path
+        self.ids = {}                 # rel_path -> id
+        self.parent = array('i')      # id -> parent id, -1 for top-level items
+        self.children = []            # id -> child ids (folders first, by name); None for files
+        self.roots = []               # top-level ids, same order
+        self.is_dir = bytearray()
+        self.alive = bytearray()
+        self.checked = bytearray()    # one flag per node; for folders only meaningful when empty
+        self.file_total = array('I')  # folder id -> number of files below it
+        self.file_checked = array('I')  # folder id -> number of checked files below it
+        self.tokens = array('q')        # file id -> token count, -1 while unknown
+        self.token_total = array('q')   # folder id -> known tokens below it
+        self.token_checked = array('q')  # folder id -> known tokens of checked files below it
+        self.total_tokens = 0
+        self.selected_tokens = 0
+
+    @classmethod
+    def from_items(cls, items, initial_states=None, default=True, initial_tokens=None):
+        """
+        Builds a model from scan_directory items (sorted parents-first).
+        initial_tokens maps files to token counts already known, e.g. from a
+        saved session; other files start unknown.
+        """
+        model = cls()
+        initial_states = initial_states or {}
+        for item in items:
+            rel_path, item_type = item[0], item[1]
+            model._append(rel_path, item_type, initial_states.get(rel_path, default))
+        # Totals are summed bottom-up once instead of walking ancestors per file.
+        for i in range(len(model.paths) - 1, -1, -1):
+            p = model.parent[i]
+            if p == -1:
+                continue
+            if model.is_dir[i]:
+                model.file_total[p] += model.file_total[i]
+                model.file_checked[p] += model.file_checked[i]
+            else:
+                model.file_total[p] += 1
+                model.file_checked[p] += model.checked[i]
+        if initial_tokens:
+            model._load_tokens(initial_tokens)
+        return model
+
+    def _load_tokens(self, tokens_by_path):
+        for rel_path, tokens in tokens_by_path.items():
+            i = self.ids.get(rel_path)
+            if i is not None and not self.is_dir[i]:
+                self.tokens[i] = tokens
+        for i in range(len(self.paths) - 1, -1, -1):
+            if self.is_dir[i]:
+                total, checked = self.token_total[i], self.token_checked[i]
+            else:
+                total = max(self.tokens[i], 0)
+                checked = total if self.checked[i] else 0
+                self.total_tokens += total
+                self.selected_tokens += checked
+            p = self.parent[i]
+            if p != -1:
+                self.token_total[p] += total
+                self.token_checked[p] += checked
+
+    def _append(self, rel_path, item_type, state):
+        i = len(self.paths)
+        parent_path = rel_path.rpartition('/')[0]
+        p = self.ids.get(parent_path, -1) if parent_path else -1
+        if parent_path and p == -1:
+            raise KeyError(f"Parent folder of '{rel_path}' is not in the model.")
+        self.paths.append(rel_path)
+        self.ids[rel_path] = i
+        self.parent.append(p)
+        is_dir = item_type == 'dir'
+        self.children.append([] if is_dir else None)
+        self.is_dir.append(is_dir)
+        self.alive.append(1)
+        self.checked.append(1 if state else 0)
+        self.file_total.append(0)
+        self.file_checked.append(0)
+        self.tokens.append(-1)
+        self.token_total.append(0)
+        self.token_checked.append(0)
+        (self.children[p] if p != -1 else self.roots).append(i)
+        return i
+
+    def __contains__(self, rel_path):
+        return rel_path in self.ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def item_type(self, rel_path):
+        return 'dir' if self.is_dir[self.ids[rel_path]] else 'file'
+
+    def children_of(self, rel_path):
+        """Child paths of a folder ('' for the top level), in display order."""
+        ids = self.roots if rel_path == '' else self.children[self.ids[rel_path]] or ()
+        return [self.paths[i] for i in ids]
+
+    def has_children(self, rel_path):
+        i = self.ids[rel_path]
+        return bool(self.children[i])
+
+    def is_checked(self, rel_path):
+        return self.state(rel_path) != UNCHECKED
+
+    def state(self, rel_path):
+        i = self.ids[rel_path]
+        if not self.is_dir[i] or self.file_total[i] == 0:
+            return CHECKED if self.checked[i] else UNCHECKED
+        if self.file_checked[i] == 0:
+            return UNCHECKED
+        return CHECKED if self.file_checked[i] == self.file_total[i] else PARTIAL
+
+    def ancestors(self, rel_path):
+        p = self.parent[self.ids[rel_path]]
+        while p != -1:
+            yield self.paths[p]
+            p = self.parent[p]
+
+    def set_checked(self, rel_path, state, cascade=True):
+        """
+        Checks or unchecks an item and everything below it. With cascade=False a
+        folder only sets its own flag, which no count includes and only an empty
+        folder shows.
+        """
+        i = self.ids[rel_path]
+        flag = 1 if state else 0
+        if self.is_dir[i] and not cascade:
+            self.checked[i] = flag
+            return
+        if self.is_dir[i]:
+            delta = (self.file_total[i] if state else 0) - self.file_checked[i]
+            token_delta = (self.token_total[i] if state else 0) - self.token_checked[i]
+            stack = [i]
+            while stack:
+                n = stack.pop()
+                self.checked[n] = flag
+                if self.is_dir[n]:
+                    self.file_checked[n] = self.file_total[n] if state else 0
+                    self.token_checked[n] = self.token_total[n] if state else 0
+                    stack.extend(self.children[n])
+        else:
+            delta = flag - self.checked[i]
+            token_delta = delta * max(self.tokens[i], 0)
+            self.checked[i] = flag
+        self.selected_tokens += token_delta
+        if delta or token_delta:
+            p = self.parent[i]
+            while p != -1:
+                self.file_checked[p] += delta
+                self.token_checked[p] += token_delta
+                p = self.parent[p]
+
+    def set_tokens(self, rel_path, tokens):
+        """Records a file's token count and rolls the change up to its folders."""
+        i = self.ids.get(rel_path)
+        if i is None or self.is_dir[i]:
+            return
+        delta = tokens - max(self.tokens[i], 0)
+        self.tokens[i] = tokens
+        checked_delta = delta if self.checked[i] else 0
+        self.total_tokens += delta
+        self.selected_tokens += checked_delta
+        p = self.parent[i]
+        while p != -1:
+            self.token_total[p] += delta
+            self.token_checked[p] += checked_delta
+            p = self.parent[p]
+
+    def token_count(self, rel_path):
+        """A file's token count (None while unknown) or a folder's known total."""
+        i = self.ids[rel_path]
+        if self.is_dir[i]:
+            return self.token_total[i]
+        return self.tokens[i] if self.tokens[i] >= 0 else None
+
+    def add(self, rel_path, item_type, state):
+        """Adds one item below an existing folder, keeping its siblings in display order."""
+        i = self._append(rel_path, item_type, state)
+        p = self.parent[i]
+        siblings = self.children[p] if p != -1 else self.roots
+        siblings.pop()
+        keys = [(not self.is_dir[s], self.paths[s].lower()) for s in siblings]
+        index = bisect.bisect(keys, (not self.is_dir[i], rel_path.lower()))
+        siblings.insert(index, i)
+        if not self.is_dir[i]:
+            while p != -1:
+                self.file_total[p] += 1
+                self.file_checked[p] += self.checked[i]
+                p = self.parent[p]
+        return index
+
+    def remove(self, rel_path):
+        """Removes an item and everything below it."""
+        i = self.ids.get(rel_path)
+        if i is None:
+            return
+        if self.is_dir[i]:
+            files, checked = self.file_total[i], self.file_checked[i]
+            tokens, checked_tokens = self.token_total[i], self.token_checked[i]
+        else:
+            files, checked = 1, self.checked[i]
+            tokens = max(self.tokens[i], 0)
+            checked_tokens = tokens if checked else 0
+        self.total_tokens -= tokens
+        self.selected_tokens -= checked_tokens
+        p = self.parent[i]
+        (self.children[p] if p != -1 else self.roots).remove(i)
+        while p != -1:
+            self.file_total[p] -= files
+            self.file_checked[p] -= checked
+            self.token_total[p] -= tokens
+            self.token_checked[p] -= checked_tokens
+            p = self.parent[p]
+        stack = [i]
+        while stack:
+            n = stack.pop()
+            self.alive[n] = 0
+            del self.ids[self.paths[n]]
+            if self.is_dir[n]:
+                stack.extend(self.children[n])
+
+    def selected_files(self):
+        """Paths of all checked files, in scan order."""
+        # Combine the flag arrays as big integers so the scan runs in C, not per item.
+        size = len(self.paths)
+        mask = int.from_bytes(self.checked, 'little') & int.from_bytes(self.alive, 'little')
+        mask &= ~int.from_bytes(self.is_dir, 'little')
+        flags = mask.to_bytes(size, 'little')
+        return [self.paths[m.start()] for m in _SET_FLAG.finditer(flags)]
+
+    def check_states(self):
+        """Returns {rel_path: checked} for every item, e.g. to carry state into a new scan."""
+        return {path: self.is_checked(path) for path in self.ids}
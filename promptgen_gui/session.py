@@ -0,0 +1,105 @@
+# promptgen_gui/session.py
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from .cache import default_cache_dir
+
+# One SQLite file per project folder, kept in the cache dir rather than in the
+# project: the last scan snapshot (with stats, so a rescan can be diffed
+# against it), every item's check state, the token counts known when it was
+# saved, and the settings the scan was made with.
+
+SESSION_DIR_NAME = "sessions"
+SESSION_VERSION = 1
+
+
+def session_path(root_dir):
+    """Where the session of root_dir is stored."""
+    abs_root_dir = os.path.normcase(os.path.abspath(root_dir))
+    digest = hashlib.blake2b(abs_root_dir.encode("utf-8", "surrogatepass"), digest_size=8).hexdigest()
+    name = os.path.basename(abs_root_dir.rstrip("\\/")) or "root"
+    return os.path.join(default_cache_dir(), SESSION_DIR_NAME, f"{name}-{digest}.sqlite")
+
+
+@dataclass
+class Session:
+    """
+    A saved project state. items are scan_directory(with_stats=True) items in
+    scan order; states maps every item to its check state and tokens maps the
+    files that had been counted to their token count.
+    """
+    settings: dict
+    items: List[tuple] = field(default_factory=list)
+    states: Dict[str, bool] = field(default_factory=dict)
+    tokens: Dict[str, int] = field(default_factory=dict)
+    saved_at: float = 0.0
+
+
+class SessionStore:
+    """Reads and writes the session of one project folder."""
+
+    def __init__(self, root_dir, path=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.path = path or session_path(root_dir)
+
+    def _connect(self):
+        db = sqlite3.connect(self.path)
+        db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS items (path TEXT NOT NULL, is_dir INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, "
+                   "size INTEGER NOT NULL, checked INTEGER NOT NULL, tokens INTEGER NOT NULL)")
+        return db
+
+    def load(self):
+        """Returns the saved Session, or None if there is none (or it is unreadable or from another version)."""
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            db = self._connect()
+            try:
+                meta = dict(db.execute("SELECT key, value FROM meta"))
+                if meta.get("version") != str(SESSION_VERSION) or meta.get("root_dir") != self.root_dir:
+                    return None
+                rows = db.execute("SELECT path, is_dir, mtime_ns, size, checked, tokens FROM items ORDER BY rowid").fetchall()
+            finally:
+                db.close()
+            session = Session(json.loads(meta.get("settings", "{}")), saved_at=float(meta.get("saved_at", 0)))
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Warning: Ignoring unreadable session '{self.path}': {e}")
+            return None
+        types = ('file', 'dir')
+        session.items = [(path, types[is_dir], mtime_ns, size) for path, is_dir, mtime_ns, size, _, _ in rows]
+        session.states = {row[0]: bool(row[4]) for row in rows}
+        session.tokens = {row[0]: row[5] for row in rows if row[5] >= 0}
+        return session
+
+    def save(self, settings, items, model):
+        """
+        Replaces the saved session. items are the current scan items with stats;
+        check states and token counts come from the selection.SelectionModel.
+        """
+        def row(item):
+            rel_path, item_type, mtime_ns, size = item
+            if rel_path not in model:
+                return rel_path, item_type == 'dir', mtime_ns, size, True, -1
+            tokens = model.token_count(rel_path) if item_type == 'file' else None
+            return rel_path, item_type == 'dir', mtime_ns, size, model.is_checked(rel_path), -1 if tokens is None else tokens
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = self._connect()
+            try:
+                with db:
+                    db.execute("DELETE FROM meta")
+                    db.execute("DELETE FROM items")
+                    db.executemany("INSERT INTO meta VALUES (?, ?)", [
+                        ("version", str(SESSION_VERSION)), ("root_dir", self.root_dir),
+                        ("settings", json.dumps(settings)), ("saved_at", repr(time.time()))])
+                    db.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)", map(row, items))
+            finally:
+                db.close()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Could not save session '{self.path}': {e}")
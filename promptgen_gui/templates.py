@@ -0,0 +1,119 @@
+# promptgen_gui/templates.py
+import os
+import re
+import threading
+
+from .tokenizers import SPECIAL_AS_TEXT
+
+# Prompt templates: task instructions that wrap the generated prompt. A
+# template is a text file in TEMPLATES_DIR; {{input}} is replaced with the
+# user's text (e.g. the bug description) and {{code}} with the generated
+# prompt. A template without {{code}} gets the prompt appended at its end.
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "prompts")
+TEMPLATE_EXTS = (".txt", ".md")
+INPUT = "input"
+CODE = "code"
+_PLACEHOLDER_PATTERN = re.compile(r"\{\{\s*(input|code)\s*\}\}")
+
+
+class PromptTemplate:
+    """
+    A template split once into literal text and placeholders. The tokens of its
+    literal text are counted once per tokenizer; cost() adds the user's text.
+    """
+
+    def __init__(self, name, text, path=None):
+        self.name = name
+        self.path = path
+        self.segments = []  # (INPUT or CODE, None) or (None, literal text), in order
+        pos = 0
+        for match in _PLACEHOLDER_PATTERN.finditer(text):
+            if match.start() > pos:
+                self.segments.append((None, text[pos:match.start()]))
+            self.segments.append((match.group(1), None))
+            pos = match.end()
+        if pos < len(text):
+            self.segments.append((None, text[pos:]))
+        if not any(kind == CODE for kind, _ in self.segments):
+            self.segments.append((CODE, None))
+        self.input_slots = sum(kind == INPUT for kind, _ in self.segments)
+        self._literal = "".join(literal for kind, literal in self.segments if kind is None)
+        self._overheads = {}  # tokenizer name -> tokens of the literal text
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "r", encoding="utf-8-sig") as f:
+            text = f.read()
+        return cls(os.path.splitext(os.path.basename(path))[0], text, path)
+
+    def overhead(self, tokenizer):
+        """Tokens of the template's own text."""
+        tokens = self._overheads.get(tokenizer.name)
+        if tokens is None:
+            tokens = self._overheads[tokenizer.name] = tokenizer.count(self._literal, {SPECIAL_AS_TEXT})
+        return tokens
+
+    def cost(self, tokenizer, user_text=""):
+        """Tokens the template adds to a prompt once user_text is filled in."""
+        if not user_text or not self.input_slots:
+            return self.overhead(tokenizer)
+        return self.overhead(tokenizer) + self.input_slots * tokenizer.count(user_text, {SPECIAL_AS_TEXT})
+
+    def render(self, user_text, code_chunks):
+        """Yields the filled-in template, passing code_chunks through at the {{code}} placeholder."""
+        code_chunks = iter(code_chunks)
+        for kind, literal in self.segments:
+            if kind is None:
+                yield literal
+            elif kind == INPUT:
+                yield user_text
+            else:
+                yield from code_chunks
+
+
+def load_templates(directory=TEMPLATES_DIR):
+    """Reads every template in directory into {name: PromptTemplate}, sorted by name."""
+    found = {}
+    try:
+        names = sorted(os.listdir(directory), key=str.lower)
+    except OSError as e:
+        print(f"Warning: Could not read the prompt templates in '{directory}': {e}")
+        return found
+    for file_name in names:
+        path = os.path.join(directory, file_name)
+        if not file_name.lower().endswith(TEMPLATE_EXTS) or not os.path.isfile(path):
+            continue
+        try:
+            template = PromptTemplate.from_file(path)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Warning: Could not load prompt template '{path}': {e}")
+            continue
+        found[template.name] = template
+    return found
+
+
+_templates = None
+_lock = threading.Lock()
+
+
+def get_templates():
+    """The shipped templates, loaded on first use and shared afterwards."""
+    global _templates
+    with _lock:
+        if _templates is None:
+            _templates = load_templates()
+    return _templates
+
+
+def get_template(name_or_path):
+    """A shipped template by name, or a template file by path. Raises ValueError if there is neither."""
+    template = get_templates().get(name_or_path)
+    if template is not None:
+        return template
+    if os.path.isfile(name_or_path):
+        try:
+            return PromptTemplate.from_file(name_or_path)
+        except (OSError, UnicodeDecodeError) as e:
+            raise ValueError(f"Could not load prompt template '{name_or_path}': {e}") from None
+    raise ValueError(f"Unknown template '{name_or_path}'. Choose from: {', '.join(get_templates())}, or give a file path.")
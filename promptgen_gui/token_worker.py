@@ -0,0 +1,103 @@
+# promptgen_gui/token_worker.py
+import itertools
+import os
+import queue
+import threading
+
+from . import core
+
+VISIBLE = 0
+BACKGROUND = 1
+
+
+class TokenCountWorker:
+    """
+    Counts the tokens of project files on a background thread.
+
+    Paths are processed by priority (VISIBLE before BACKGROUND), so the rows on
+    screen fill in first; enqueueing a path again with a better priority moves it
+    up. Results are collected in a queue for the GUI to drain in batches from its
+    own loop, which keeps Tk calls on the main thread. Counts go through the
+    TokenCache, so unchanged files are neither read nor encoded again.
+    `tokenizer` is a tokenizers.BACKENDS name, None for the default.
+    """
+
+    def __init__(self, root_dir, cache=None, tokenizer=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.cache = cache
+        self.tokenizer = tokenizer
+        self._queue = queue.PriorityQueue()
+        self._results = queue.SimpleQueue()
+        self._seq = itertools.count()
+        self._queued = {}  # rel_path -> best queued priority
+        self._counting = None  # rel_path being counted, no longer in _queued
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        return len(self._queued) + (self._counting is not None)
+
+    def enqueue(self, rel_paths, priority=BACKGROUND):
+        with self._lock:
+            for rel_path in rel_paths:
+                best = self._queued.get(rel_path)
+                if best is not None and best <= priority:
+                    continue
+                self._queued[rel_path] = priority
+                self._queue.put((priority, next(self._seq), rel_path))
+
+    def stop(self):
+        self._stop.set()
+        self._queue.put((-1, -1, None))  # wake the thread up
+
+    def pop_results(self, limit=1000):
+        """Returns up to `limit` finished (rel_path, tokens) pairs; tokens is None if unreadable."""
+        results = []
+        try:
+            while len(results) < limit:
+                results.append(self._results.get_nowait())
+        except queue.Empty:
+            pass
+        return results
+
+    def _run(self):
+        while not self._stop.is_set():
+            priority, _, rel_path = self._queue.get()
+            if rel_path is None:
+                break
+            with self._lock:
+                # Skip stale entries superseded by a better priority.
+                if self._queued.get(rel_path) != priority:
+                    continue
+                # Enqueueing it again while it is counted (it changed meanwhile) queues a fresh count.
+                del self._queued[rel_path]
+                self._counting = rel_path
+            tokens = self._count(rel_path)
+            with self._lock:
+                self._counting = None
+            self._results.put((rel_path, tokens))
+            if not self._queued and self.cache is not None:
+                self.cache.save()
+
+    def _count(self, rel_path):
+        tokenizer = core.resolve_tokenizer(self.tokenizer)
+        if tokenizer is None:
+            return None
+        abs_path = os.path.join(self.root_dir, rel_path)
+        try:
+            result = core.measure_file(abs_path, cache=self.cache, tokenizer=tokenizer)
+        except core.FileSkipped:
+            return None
+        except ValueError:
+            # Contains special tokens; for an estimate, count them as special tokens.
+            content = core.read_file_content(abs_path)
+            if content is None:
+                return None
+            return tokenizer.count(content, tokenizer.special_tokens_set)
+        except Exception as e:
+            print(f"Warning: Could not count tokens of '{rel_path}': {e}")
+            return None
+        return result[1]
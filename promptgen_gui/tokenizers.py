@@ -0,0 +1,249 @@
+# promptgen_gui/tokenizers.py
+import importlib.util
+import math
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+
+from .cache import default_cache_dir
+
+# Tokenizer backends, by name. Every backend offers what core needs of one:
+# `name`, `special_tokens_set`, `exact`, count(text, allowed_special),
+# encode(text, allowed_special) returning a compact token sequence that can be
+# sliced, and decode(tokens) for such a slice. tiktoken encodings count exactly;
+# the estimators are much faster and only approximate a model's tokenizer.
+
+TIKTOKEN_ENCODINGS = ("cl100k_base", "o200k_base", "p50k_base", "r50k_base")
+REGEX_ESTIMATOR = "estimate:regex"
+BYTES_ESTIMATOR = "estimate:bytes"
+BACKENDS = TIKTOKEN_ENCODINGS + (REGEX_ESTIMATOR, BYTES_ESTIMATOR)
+DEFAULT_TOKENIZER = "cl100k_base"
+
+# Model -> (tokenizer, context window used as the token budget).
+MODEL_PRESETS = {
+    "gpt-4o": ("o200k_base", 128000),
+    "gpt-4o-mini": ("o200k_base", 128000),
+    "gpt-4.1": ("o200k_base", 1047576),
+    "o3 / o4-mini": ("o200k_base", 200000),
+    "gpt-4-turbo": ("cl100k_base", 128000),
+    "gpt-3.5-turbo": ("cl100k_base", 16385),
+    "other model (estimate)": (BYTES_ESTIMATOR, 128000),
+}
+
+ESTIMATE_BYTES_PER_TOKEN = 4.0
+ESTIMATE_MAX_PIECE_CHARS = 8  # longer words count as several tokens
+# Roughly the pre-tokenization of the GPT encodings: words with their leading
+# space, up to three digits, punctuation runs and whitespace.
+_PIECE_PATTERN = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]+| ?\d{1,3}| ?[^\s\w]+|\s+(?!\S)|\s+""")
+
+# Put into an allowed_special set to encode all other special tokens as plain
+# text instead of raising. It can't clash with a real token and keeps the
+# TokenCache keys of the two modes apart.
+SPECIAL_AS_TEXT = "\0special-as-text"
+
+tiktoken_available = importlib.util.find_spec("tiktoken") is not None
+
+
+def encoder_cache_dir():
+    """Where tiktoken keeps its downloaded BPE files, unless TIKTOKEN_CACHE_DIR says otherwise."""
+    return os.path.join(default_cache_dir(), "tiktoken")
+
+
+def _prepare_encoder_cache():
+    # tiktoken defaults to a folder in the temp dir, which the OS may clear; a
+    # persistent one lets later cold starts load offline. Files already in the
+    # old location are carried over.
+    if "TIKTOKEN_CACHE_DIR" in os.environ or "DATA_GYM_CACHE_DIR" in os.environ:
+        return
+    cache_dir = encoder_cache_dir()
+    legacy_dir = os.path.join(tempfile.gettempdir(), "data-gym-cache")
+    if not os.path.isdir(cache_dir) and os.path.isdir(legacy_dir):
+        try:
+            shutil.copytree(legacy_dir, cache_dir)
+        except OSError:
+            pass
+    os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+
+class TiktokenBackend:
+    """A tiktoken encoding; tokens are array('I') of token ids (4 bytes per token)."""
+    exact = True
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        self.name = encoding.name
+        self.special_tokens_set = encoding.special_tokens_set
+
+    def _ids(self, text, allowed_special):
+        allowed = allowed_special or set()
+        if SPECIAL_AS_TEXT in allowed:
+            return self.encoding.encode(text, allowed_special=allowed - {SPECIAL_AS_TEXT}, disallowed_special=())
+        return self.encoding.encode(text, allowed_special=allowed)
+
+    def count(self, text, allowed_special=None):
+        return len(self._ids(text, allowed_special))
+
+    def encode(self, text, allowed_special=None):
+        return array('I', self._ids(text, allowed_special))
+
+    def decode(self, tokens):
+        return self.encoding.decode(tokens)
+
+
+class TextTokens:
+    """
+    An estimator's tokens: a view of the piece boundaries (`ends`, character
+    offsets) of a text, so that any contiguous slice decodes back to the text
+    it covers. Slicing doesn't copy.
+    """
+    __slots__ = ("text", "ends", "lo", "hi")
+
+    def __init__(self, text, ends, lo=0, hi=None):
+        self.text = text
+        self.ends = ends
+        self.lo = lo
+        self.hi = len(ends) if hi is None else hi
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.step not in (None, 1):
+            raise TypeError("TextTokens only support contiguous slices.")
+        start, stop, _ = index.indices(len(self))
+        return TextTokens(self.text, self.ends, self.lo + start, self.lo + max(start, stop))
+
+    def decode(self):
+        if self.hi <= self.lo:
+            return ""
+        begin = self.ends[self.lo - 1] if self.lo else 0
+        return self.text[begin:self.ends[self.hi - 1]]
+
+
+class _EvenEnds:
+    """The ends of `count` pieces spread evenly over n characters, computed on access."""
+    __slots__ = ("n", "count")
+
+    def __init__(self, n, count):
+        self.n = n
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return (i + 1) * self.n // self.count
+
+
+class BytesEstimator:
+    """Counts one token per bytes_per_token bytes of utf-8; the fastest backend."""
+    exact = False
+    special_tokens_set = frozenset()
+
+    def __init__(self, name=BYTES_ESTIMATOR, bytes_per_token=ESTIMATE_BYTES_PER_TOKEN):
+        self.name = name
+        self.bytes_per_token = bytes_per_token
+
+    def count(self, text, allowed_special=None):
+        return math.ceil(len(text.encode("utf-8", "surrogatepass")) / self.bytes_per_token)
+
+    def encode(self, text, allowed_special=None):
+        return TextTokens(text, _EvenEnds(len(text), self.count(text)))
+
+    def decode(self, tokens):
+        return tokens.decode()
+
+
+class RegexEstimator:
+    """
+    Counts the pieces the GPT encodings split text into before BPE, with words
+    longer than max_piece_chars counting as several tokens. Closer to the real
+    count than BytesEstimator for code and prose, at regex speed.
+    """
+    exact = False
+    special_tokens_set = frozenset()
+
+    def __init__(self, name=REGEX_ESTIMATOR, max_piece_chars=ESTIMATE_MAX_PIECE_CHARS):
+        self.name = name
+        self.max_piece_chars = max_piece_chars
+
+    def count(self, text, allowed_special=None):
+        step = self.max_piece_chars
+        return sum(-(-len(piece) // step) for piece in _PIECE_PATTERN.findall(text))
+
+    def encode(self, text, allowed_special=None):
+        step = self.max_piece_chars
+        ends = array('I')
+        for match in _PIECE_PATTERN.finditer(text):
+            start, end = match.span()
+            if end - start > step:
+                ends.extend(range(start + step, end, step))
+            ends.append(end)
+        return TextTokens(text, ends)
+
+    def decode(self, tokens):
+        return tokens.decode()
+
+
+_tokenizers = {}
+_load_errors = {}
+_lock = threading.Lock()
+
+
+def _create(name):
+    if name == BYTES_ESTIMATOR:
+        return BytesEstimator()
+    if name == REGEX_ESTIMATOR:
+        return RegexEstimator()
+    import tiktoken
+    _prepare_encoder_cache()
+    return TiktokenBackend(tiktoken.get_encoding(name))
+
+
+def get_tokenizer(name=DEFAULT_TOKENIZER):
+    """
+    Returns the backend `name` (one of BACKENDS), creating it on first use. One
+    instance per name is shared by all jobs and threads; threads asking while
+    it loads wait for it. Returns None if it can't be loaded (tiktoken missing,
+    or its encoding not downloadable); load_error(name) then says why.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown tokenizer '{name}'. Choose from: {', '.join(BACKENDS)}.")
+    tokenizer = _tokenizers.get(name)
+    if tokenizer is not None or name in _load_errors:
+        return tokenizer
+    with _lock:
+        if name not in _tokenizers and name not in _load_errors:
+            try:
+                _tokenizers[name] = _create(name)
+            except Exception as e:
+                _load_errors[name] = e
+                print(f"Warning: tiktoken not installed or model not found ({e}).")
+    return _tokenizers.get(name)
+
+
+def load_error(name):
+    return _load_errors.get(name)
+
+
+def is_loaded(name):
+    return name in _tokenizers
+
+
+def is_available(name):
+    """False if the backend is known not to load; a tiktoken encoding may still fail on first use."""
+    if name in (REGEX_ESTIMATOR, BYTES_ESTIMATOR):
+        return True
+    return tiktoken_available and name not in _load_errors
+
+
+def load_in_background(name, on_done):
+    """Starts loading a backend on a daemon thread; on_done(tokenizer, seconds) is called from that thread."""
+    def target():
+        start = time.perf_counter()
+        on_done(get_tokenizer(name), time.perf_counter() - start)
+    threading.Thread(target=target, daemon=True).start()
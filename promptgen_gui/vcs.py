@@ -0,0 +1,191 @@
+# promptgen_gui/vcs.py
+import os
+import shutil
+import stat
+import subprocess
+
+from . import reducers, utils
+
+# Git-backed file listing: tracked and untracked (not ignored) files come from
+# `git ls-files` instead of a filesystem walk, so .gitignore is honoured by git
+# itself, and `git diff` narrows the listing (and optionally the contents) to
+# what changed against a ref.
+
+git_available = shutil.which("git") is not None
+
+# "tracked" lists the repository's files; "changed" only those that differ from
+# the ref; "hunks" lists the same files but emits only their changed hunks.
+GIT_MODES = ("tracked", "changed", "hunks")
+DEFAULT_REF = "HEAD"
+DEFAULT_CONTEXT_LINES = 3
+
+
+class GitError(RuntimeError):
+    """git is missing, the folder isn't in a work tree, or a git command failed."""
+
+
+def run_git(root_dir, *args):
+    """Runs git in root_dir and returns its stdout as bytes."""
+    if not git_available:
+        raise GitError("git is not installed.")
+    try:
+        result = subprocess.run(["git", "-c", "core.quotepath=false", *args], cwd=root_dir,
+                                stdin=subprocess.DEVNULL, capture_output=True)
+    except OSError as e:
+        raise GitError(str(e)) from None
+    if result.returncode != 0:
+        message = result.stderr.decode("utf-8", errors="replace").strip()
+        raise GitError(message or f"git {args[0]} exited with status {result.returncode}.")
+    return result.stdout
+
+
+def is_work_tree(root_dir):
+    try:
+        return run_git(root_dir, "rev-parse", "--is-inside-work-tree").strip() == b"true"
+    except GitError:
+        return False
+
+
+def _require_work_tree(root_dir):
+    if not is_work_tree(root_dir):
+        raise GitError(f"'{root_dir}' is not inside a git work tree.")
+
+
+def _split_z(output):
+    return [os.fsdecode(path) for path in output.split(b"\0") if path]
+
+
+def listed_files(root_dir):
+    """Tracked and untracked, non-ignored files under root_dir (relative, '/'-separated); deleted files are left out."""
+    output = run_git(root_dir, "ls-files", "-z", "-t", "--cached", "--others", "--deleted", "--exclude-standard")
+    files, deleted = [], set()
+    for entry in _split_z(output):
+        tag, rel_path = entry[0], entry[2:]
+        if tag == "R":
+            deleted.add(rel_path)
+        else:
+            files.append(rel_path)
+    return [rel_path for rel_path in dict.fromkeys(files) if rel_path not in deleted]
+
+
+def changed_files(root_dir, ref=DEFAULT_REF):
+    """Files under root_dir that differ from ref in the work tree (staged or not), plus untracked ones."""
+    changed = _split_z(run_git(root_dir, "diff", "--name-only", "-z", "--no-renames", "--diff-filter=d", ref, "--relative", "--"))
+    untracked = _split_z(run_git(root_dir, "ls-files", "-z", "--others", "--exclude-standard"))
+    return sorted(set(changed).union(untracked))
+
+
+def scan_git(root_dir, exclude_paths=None, include_exts=None, changed_ref=None, with_stats=False):
+    """
+    utils.scan_directory for a git work tree: the same items, from git's file
+    list instead of a walk. .gitignore always applies; exclude_paths and
+    include_exts filter as usual. With changed_ref, only files changed against
+    that ref are listed. Folders are listed only if they contain a listed file.
+    """
+    _require_work_tree(root_dir)
+    rel_paths = changed_files(root_dir, changed_ref) if changed_ref else listed_files(root_dir)
+    matchers = [utils.PathMatcher(exclude_paths)]
+    included = utils._compile_include(include_exts)
+    excluded_dirs = {"": False}
+
+    def dir_excluded(rel_dir):
+        if rel_dir not in excluded_dirs:
+            parent = os.path.dirname(rel_dir)
+            excluded_dirs[rel_dir] = dir_excluded(parent) or utils._is_excluded(matchers, rel_dir, True)
+        return excluded_dirs[rel_dir]
+
+    items = []
+    dirs = set()
+    abs_root_dir = os.path.abspath(root_dir)
+    for rel_path in rel_paths:
+        rel_dir, name = os.path.split(rel_path)
+        if included is not None and not included(name):
+            continue
+        if dir_excluded(rel_dir) or utils._is_excluded(matchers, rel_path, False):
+            continue
+        if with_stats:
+            try:
+                st = os.stat(os.path.join(abs_root_dir, rel_path))
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue  # a submodule
+            items.append((rel_path, 'file', st.st_mtime_ns, st.st_size))
+        else:
+            items.append((rel_path, 'file'))
+        while rel_dir and rel_dir not in dirs:
+            dirs.add(rel_dir)
+            rel_dir = os.path.dirname(rel_dir)
+    items.extend((rel_dir, 'dir', 0, 0) if with_stats else (rel_dir, 'dir') for rel_dir in dirs)
+    items.sort(key=lambda x: (x[0].count('/'), x[1] == 'file', x[0].lower()))
+    return items
+
+
+def _unquote(path):
+    """Undoes git's C-style quoting of a path in diff headers."""
+    if not path.startswith('"'):
+        return path
+    raw = path[1:-1].encode("utf-8")
+    out = bytearray()
+    escapes = {ord("n"): 10, ord("t"): 9, ord("r"): 13, ord("a"): 7, ord("b"): 8, ord("f"): 12, ord("v"): 11}
+    i = 0
+    while i < len(raw):
+        if raw[i] == ord("\\") and i + 1 < len(raw):
+            nxt = raw[i + 1]
+            if ord("0") <= nxt <= ord("7"):
+                out.append(int(raw[i + 1:i + 4], 8))
+                i += 4
+                continue
+            out.append(escapes.get(nxt, nxt))
+            i += 2
+            continue
+        out.append(raw[i])
+        i += 1
+    return os.fsdecode(bytes(out))
+
+
+def diff_hunks(root_dir, ref=DEFAULT_REF, context_lines=DEFAULT_CONTEXT_LINES):
+    """
+    Returns {rel_path: hunks} for files under root_dir that changed against
+    ref, where hunks is the unified diff without its file header. Files that
+    are new since ref (or untracked) are left out, since their full text is
+    the change.
+    """
+    _require_work_tree(root_dir)
+    output = run_git(root_dir, "diff", "--no-color", "--no-ext-diff", "--no-textconv", "--no-renames", "--diff-filter=d",
+                     "--src-prefix=a/", "--dst-prefix=b/", f"-U{context_lines}", ref, "--relative", "--")
+    hunks = {}
+    for block in output.split(b"\ndiff --git "):
+        header, sep, body = block.partition(b"\n@@")
+        if not sep or b"\nnew file mode" in header:
+            continue
+        for line in header.split(b"\n"):
+            if line.startswith(b"+++ "):
+                path = _unquote(line[4:].decode("utf-8", errors="surrogateescape").rstrip("\t"))
+                if path.startswith("b/"):
+                    hunks[path[2:]] = "@@" + body.decode("utf-8", errors="replace").rstrip("\n") + "\n"
+                break
+    return hunks
+
+
+class HunkReducer(reducers.Reducer):
+    """
+    A Reducer that replaces each changed file's content with its diff hunks
+    against `ref` (context_lines of context around each change) before the
+    other reducers run. Files without hunks, such as new files, are kept whole.
+    """
+
+    def __init__(self, root_dir, ref=DEFAULT_REF, context_lines=DEFAULT_CONTEXT_LINES, modes=(), dedupe=False, **options):
+        super().__init__(modes, dedupe=dedupe, **options)
+        self.ref = ref
+        self.context_lines = context_lines
+        abs_root_dir = os.path.abspath(root_dir)
+        self.hunks = {os.path.normpath(os.path.join(abs_root_dir, rel_path)): text
+                      for rel_path, text in diff_hunks(root_dir, ref, context_lines).items()}
+
+    def reduce(self, abs_path, text, encode, context=""):
+        return super().reduce(abs_path, self.hunks.get(abs_path, text), encode, context)
+
+    def summary_lines(self):
+        lines = [f"Changed hunks against {self.ref} ({self.context_lines} line(s) of context) for {len(self.hunks):,} file(s)"]
+        return lines + super().summary_lines()
@@ -0,0 +1,124 @@
+# promptgen_gui/watcher.py
+import os
+import threading
+import time
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+    watchdog_available = True
+except ImportError:
+    FileSystemEventHandler = object
+    watchdog_available = False
+
+DEFAULT_POLL_INTERVAL = 3.0
+POLL_IDLE_FACTOR = 20  # wait at least this many times the last scan's duration between polls
+DEBOUNCE_SECONDS = 0.3
+
+
+class _ChangeHandler(FileSystemEventHandler):
+    def __init__(self, notify, root_dir, ignore=None):
+        super().__init__()
+        self._notify = notify
+        self._root_dir = os.path.abspath(root_dir)
+        self._ignore = ignore
+
+    def _relevant(self, path, is_dir):
+        if self._ignore is None:
+            return True
+        rel_path = os.path.relpath(os.fsdecode(path), self._root_dir).replace(os.sep, '/')
+        if rel_path == '.':
+            return True
+        return not self._ignore(rel_path, is_dir)
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "deleted", "moved", "modified"):
+            return
+        # A directory's "modified" only means its entries changed, which the entries' own events report.
+        if event.is_directory and event.event_type == "modified":
+            return
+        paths = [event.src_path] + ([event.dest_path] if event.event_type == "moved" else [])
+        if any(self._relevant(path, event.is_directory) for path in paths):
+            self._notify()
+
+
+class DirectoryWatcher:
+    """
+    Watches a project directory and reports when the file tree may have changed.
+
+    With the optional `watchdog` package, OS change notifications (inotify,
+    FSEvents, ReadDirectoryChangesW) trigger a single rescan after a short debounce
+    and on_change(None) is called. Without it, `scan()` is polled every
+    poll_interval seconds, or less often for projects whose scan is slow (see
+    POLL_IDLE_FACTOR), and on_change(items) is called with the new scan result
+    whenever it differs from the previous one. on_change runs on a background
+    thread. Events for paths that ignore(rel_path, is_dir) rejects, such as
+    files under excluded folders (see utils.make_ignore_filter), don't count.
+    """
+
+    def __init__(self, root_dir, scan, on_change, poll_interval=DEFAULT_POLL_INTERVAL, ignore=None):
+        self.root_dir = root_dir
+        self.scan = scan
+        self.on_change = on_change
+        self.ignore = ignore
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._observer = None
+        self._thread = None
+        self._timer = None
+        self._lock = threading.Lock()
+        self.last_items = None
+
+    @property
+    def uses_notifications(self):
+        return self._observer is not None
+
+    def start(self, initial_items=None):
+        self.last_items = initial_items
+        if watchdog_available:
+            try:
+                self._observer = Observer()
+                self._observer.schedule(_ChangeHandler(self._debounced_notify, self.root_dir, self.ignore), self.root_dir, recursive=True)
+                self._observer.daemon = True
+                self._observer.start()
+                return
+            except Exception as e:
+                print(f"Warning: File system notifications unavailable ({e}). Falling back to polling.")
+                self._observer = None
+        self._thread = threading.Thread(target=self._poll_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        if self._observer is not None:
+            self._observer.stop()
+
+    def _debounced_notify(self):
+        # Editors and build tools emit bursts of events; report them as one change.
+        with self._lock:
+            if self._stop.is_set():
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(DEBOUNCE_SECONDS, self.on_change, args=(None,))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _poll_loop(self):
+        interval = self.poll_interval
+        while not self._stop.wait(interval):
+            start = time.perf_counter()
+            try:
+                items = self.scan()
+            except Exception as e:
+                print(f"Warning: Polling scan of '{self.root_dir}' failed: {e}")
+                continue
+            finally:
+                # Keep a large project's rescans to a small share of the time.
+                interval = max(self.poll_interval, (time.perf_counter() - start) * POLL_IDLE_FACTOR)
+            if self.last_items is not None and items != self.last_items:
+                self.on_change(items)
+            self.last_items = items
@@ -1,4 +1,7 @@
 # run.py
+import time
+STARTED_AT = time.perf_counter()  # before the imports below, so the startup report includes them
+
 import tkinter as tk
 from promptgen_gui.app import PromptgenGUI, ttk_themes_available
 
@@ -18,7 +21,7 @@ def main():
     else:
         root = tk.Tk()
 
-    app = PromptgenGUI(root)
+    app = PromptgenGUI(root, started_at=STARTED_AT)
     root.mainloop()
 
 if __name__ == "__main__":